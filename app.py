@@ -26,6 +26,7 @@ organizers_page = st.Page("pages/2_Gestione_Organizzatori.py", title=current_i18
 chat_viewer_page = st.Page("pages/3_Chat_Attivisti.py", title=current_i18n.get("menu_chat_viewer", "Chat Attivisti"), icon="📑")
 cubes_page = st.Page("pages/4_Gestione_Cubi.py", title=current_i18n.get("menu_cubes", "Cubes"), icon="📅")
 history_page = st.Page("pages/5_Storico_Partecipazioni.py", title=current_i18n.get("menu_history", "Participation History"), icon="📊")
+tg_metrics_page = st.Page("pages/6_Metriche_Telegram.py", title=current_i18n.get("menu_tg_metrics", "Telegram Metrics"), icon="⏱️")
 
 # Determine visibility based on user profiles
 user_profiles = st.session_state.get("user_profiles", [])
@@ -45,6 +46,7 @@ if is_logged_in:
         pages.append(history_page)
     if "admin" in user_profiles:
         pages.append(organizers_page)
+        pages.append(tg_metrics_page)
     if "org" in user_profiles or "activist" in user_profiles:
         pages.append(chat_viewer_page)
 
@@ -0,0 +1 @@
+"""Benchmark offline delle operazioni Telegram (python -m benchmarks --help)."""
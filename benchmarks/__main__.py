@@ -0,0 +1,69 @@
+"""
+Benchmark offline delle operazioni Telegram, dalla root del progetto:
+
+    python -m benchmarks                                  # tabella a video
+    python -m benchmarks --json out.json                  # report JSON
+    python -m benchmarks --baseline benchmarks/baseline.json --threshold 0.25
+
+Con --baseline esce con codice 1 se una misura regredisce (vedi
+benchmarks/telegram_ops.py:compare).
+"""
+
+import argparse
+import sys
+
+from benchmarks.telegram_ops import Config, compare, format_table, load_report, run_all, save_report
+
+
+def build_parser() -> argparse.ArgumentParser:
+    defaults = Config()
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Benchmark delle operazioni Telegram sul backend finto.")
+    parser.add_argument("--only", help="solo i casi il cui nome contiene questa stringa")
+    parser.add_argument("--repeat", type=int, default=defaults.repeat,
+                        help=f"ripetizioni misurate per caso (default {defaults.repeat})")
+    parser.add_argument("--rpc-latency", type=float, default=defaults.rpc_latency_s,
+                        help=f"latenza simulata per RPC in secondi (default {defaults.rpc_latency_s})")
+    parser.add_argument("--connect-latency", type=float, default=defaults.connect_latency_s,
+                        help=f"latenza simulata dell'handshake in secondi (default {defaults.connect_latency_s})")
+    parser.add_argument("--jitter", type=float, default=defaults.jitter,
+                        help="variazione relativa della latenza simulata (default 0)")
+    parser.add_argument("--batch-size", type=int, default=defaults.batch_size,
+                        help=f"destinatari/numeri per i casi DM e telefono (default {defaults.batch_size})")
+    parser.add_argument("--real-rate-limits", action="store_true",
+                        help="usa i limiti del governor di produzione (molto piu' lento)")
+    parser.add_argument("--json", metavar="PATH", help="scrive il report JSON")
+    parser.add_argument("--baseline", metavar="PATH", help="confronta con un report JSON precedente")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="regressione di latenza tollerata rispetto alla baseline (default 0.25 = +25%%)")
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    config = Config(
+        rpc_latency_s=args.rpc_latency,
+        connect_latency_s=args.connect_latency,
+        jitter=args.jitter,
+        repeat=args.repeat,
+        batch_size=args.batch_size,
+        real_rate_limits=args.real_rate_limits,
+    )
+    report = run_all(config, only=args.only, on_result=lambda r: print(
+        f"  {r.case} [{r.mode}]: {r.latency_s:.3f}s, {r.rpc} rpc, {r.connects} conn", file=sys.stderr,
+    ))
+    print(format_table(report["results"]))
+    if args.json:
+        save_report(report, args.json)
+    if args.baseline:
+        problems = compare(report, load_report(args.baseline), args.threshold)
+        if problems:
+            print("\nRegressioni rispetto a " + args.baseline + ":")
+            for line in problems:
+                print("  - " + line)
+            return 1
+        print("\nNessuna regressione rispetto a " + args.baseline + ".")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,295 @@
+"""
+Benchmark delle operazioni di lib/telegram_client.py sul backend finto
+(lib/telegram_fake.py): latenza end-to-end, RPC e handshake per operazione.
+
+Ogni caso gira in piu' modalita':
+
+- "per_call": un client nuovo (connect + disconnect) per ogni operazione,
+  come prima del pool;
+- "pooled":   client del pool, riusato fra le operazioni;
+- "batched":  dove esiste, l'API batch (get_poll_voters_delta_batch,
+  send_dm_batch, resolve_phones_bulk) su client del pool.
+
+La latenza simulata per RPC e per handshake viene dal backend, quindi i
+numeri misurano quante richieste e connessioni fa il codice e quanto le
+sovrappone, non la rete. I limiti del governor sono disattivati (salvo
+`real_rate_limits`) perche' il ritmo imposto a DM e ResolvePhone
+dominerebbe ogni altra misura.
+"""
+
+from __future__ import annotations
+
+import json
+import platform
+import statistics
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+import lib.telegram_client as tc
+from lib import telegram_rate as rate
+from lib.telegram_fake import FakeTelegramBackend
+
+PER_CALL = "per_call"
+POOLED = "pooled"
+BATCHED = "batched"
+
+# Governor senza pacing (ma con FloodWait e classi di metodo come in produzione).
+UNLIMITED = {cls: (1e6, 1_000_000) for cls in (rate.READ, rate.DM, rate.RESOLVE)}
+
+POLL_VOTERS = (10, 100, 1000)
+POLL_OPTIONS = (2, 5, 10)
+
+
+@dataclass
+class Config:
+    rpc_latency_s: float = 0.02
+    connect_latency_s: float = 0.3
+    jitter: float = 0.0
+    repeat: int = 3
+    batch_size: int = 20
+    open_polls: int = 60
+    real_rate_limits: bool = False
+    seed: int = 0
+
+
+@dataclass
+class Result:
+    case: str
+    mode: str
+    latency_s: float          # mediana delle ripetizioni
+    latency_min_s: float
+    rpc: int                  # RPC per ripetizione
+    connects: int             # handshake per ripetizione
+
+
+class _Case:
+    """Un caso: `setup(backend, session)` prepara il mondo e ritorna `run(mode)`."""
+
+    def __init__(self, name: str, modes: List[str], setup: Callable):
+        self.name = name
+        self.modes = modes
+        self.setup = setup
+
+
+# ---------------------------------------------------------------------------
+# Casi
+# ---------------------------------------------------------------------------
+
+def _poll_voters_case(n_voters: int, n_options: int) -> _Case:
+    def setup(backend: FakeTelegramBackend, session: str):
+        chat_id, msg_id = backend.synthetic_poll(session, n_voters, n_options)
+
+        def run(mode: str) -> None:
+            result = tc.get_poll_voters(session, chat_id, msg_id, per_option_limit=tc.POLL_VOTERS_HARD_CAP)
+            assert sum(len(o["voters"]) for o in result["options"]) == n_voters
+        return run
+
+    return _Case(f"get_poll_voters[voters={n_voters},options={n_options}]", [PER_CALL, POOLED], setup)
+
+
+def _open_polls_case(incremental: bool, n_polls: int) -> _Case:
+    def setup(backend: FakeTelegramBackend, session: str):
+        chat_id = backend.add_group("Sondaggi", members=[backend.sessions[session]])
+        for n in range(n_polls):
+            backend.add_poll(chat_id, f"Cubo {n}", ["Si", "No"], closed=n % 3 == 0)
+            backend.add_text_message(chat_id, "ok")
+
+        def run(mode: str) -> None:
+            polls = tc.list_open_polls(session, chat_id, full_rescan=not incremental)
+            assert len(polls) == n_polls - len(range(0, n_polls, 3))
+        return run
+
+    kind = "incremental" if incremental else "full"
+    return _Case(f"list_open_polls[{kind},polls={n_polls}]", [PER_CALL, POOLED], setup)
+
+
+def _refresh_events_case(n_polls: int, n_voters: int) -> _Case:
+    """Refresh di tutti i cubi di un organizer: uno per volta o con get_poll_voters_delta_batch."""
+    def setup(backend: FakeTelegramBackend, session: str):
+        # Tutti i cubi nello stesso gruppo del capitolo, come nell'uso reale.
+        members = backend.synthetic_users(n_voters)
+        chat_id = backend.add_group("Capitolo", members=[backend.sessions[session]] + [u.id for u in members])
+        polls = []
+        for n in range(n_polls):
+            msg_id = backend.add_poll(chat_id, f"Cubo {n}: ci sei?", ["Si", "No", "Forse"])
+            for i, user in enumerate(members):
+                backend.vote(chat_id, msg_id, user.id, (i + n) % 3)
+            polls.append((chat_id, msg_id))
+
+        def run(mode: str) -> None:
+            if mode == BATCHED:
+                results = tc.get_poll_voters_delta_batch(
+                    session, [{"chat_ref": chat_id, "msg_id": msg_id} for chat_id, msg_id in polls]
+                )
+                assert all(r["ok"] for r in results)
+            else:
+                for chat_id, msg_id in polls:
+                    tc.get_poll_voters_delta(session, chat_id, msg_id)
+        return run
+
+    return _Case(f"refresh_events[polls={n_polls},voters={n_voters}]", [PER_CALL, POOLED, BATCHED], setup)
+
+
+def _send_dm_case(batch_size: int) -> _Case:
+    def setup(backend: FakeTelegramBackend, session: str):
+        users = backend.synthetic_users(batch_size)
+        messages = [(u.username, f"Ciao {u.first_name}, ti ricordo il cubo.") for u in users]
+
+        def run(mode: str) -> None:
+            if mode == BATCHED:
+                results = tc.send_dm_batch(session, messages)
+            else:
+                results = [tc.send_dm(session, recipient, text) for recipient, text in messages]
+            assert all(r["ok"] for r in results)
+        return run
+
+    return _Case(f"send_dm[batch={batch_size}]", [PER_CALL, POOLED, BATCHED], setup)
+
+
+def _resolve_phone_case(batch_size: int) -> _Case:
+    def setup(backend: FakeTelegramBackend, session: str):
+        users = backend.synthetic_users(batch_size)
+        for u in users[::4]:
+            u.phone_discoverable = False
+        phones = ["+" + u.phone for u in users]
+
+        def run(mode: str) -> None:
+            if mode == BATCHED:
+                results = list(tc.resolve_phones_bulk(session, phones).values())
+            else:
+                results = [tc.resolve_phone(session, p) for p in phones]
+            assert sum(1 for r in results if r["ok"]) == batch_size - len(users[::4])
+        return run
+
+    return _Case(f"resolve_phone[batch={batch_size}]", [PER_CALL, POOLED, BATCHED], setup)
+
+
+def build_cases(config: Config, only: Optional[str] = None) -> List[_Case]:
+    cases = [_poll_voters_case(v, o) for v in POLL_VOTERS for o in POLL_OPTIONS]
+    cases += [_open_polls_case(False, config.open_polls), _open_polls_case(True, config.open_polls)]
+    cases += [_refresh_events_case(8, 100)]
+    cases += [_send_dm_case(config.batch_size), _resolve_phone_case(config.batch_size)]
+    if only:
+        cases = [c for c in cases if only in c.name]
+    return cases
+
+
+# ---------------------------------------------------------------------------
+# Esecuzione
+# ---------------------------------------------------------------------------
+
+def run_case(case: _Case, mode: str, config: Config) -> Result:
+    """Esegue un caso in una modalita' su un backend e un pool nuovi."""
+    backend = FakeTelegramBackend(
+        latency_s=config.rpc_latency_s,
+        connect_latency_s=config.connect_latency_s,
+        jitter=config.jitter,
+        seed=config.seed,
+    )
+    tc.set_client_factory(
+        backend.client,
+        pooling=mode != PER_CALL,
+        rate_limits=None if config.real_rate_limits else UNLIMITED,
+    )
+    try:
+        session = backend.add_account("Benchmark")
+        run = case.setup(backend, session)
+        # Riscaldamento fuori misura: pool connesso, cache entita' e indici
+        # come dopo il primo uso della pagina.
+        run(mode)
+        timings, rpc, connects = [], [], []
+        for _ in range(config.repeat):
+            backend.reset_stats()
+            start = time.perf_counter()
+            run(mode)
+            timings.append(time.perf_counter() - start)
+            rpc.append(backend.stats()["rpc_total"])
+            connects.append(backend.connects)
+    finally:
+        tc.set_client_factory(None)
+    return Result(
+        case=case.name,
+        mode=mode,
+        latency_s=round(statistics.median(timings), 4),
+        latency_min_s=round(min(timings), 4),
+        rpc=max(rpc),
+        connects=max(connects),
+    )
+
+
+def run_all(
+    config: Config,
+    only: Optional[str] = None,
+    on_result: Optional[Callable[[Result], None]] = None,
+) -> dict:
+    results = []
+    for case in build_cases(config, only):
+        for mode in case.modes:
+            res = run_case(case, mode, config)
+            results.append(res)
+            if on_result is not None:
+                on_result(res)
+    return {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "config": asdict(config),
+        },
+        "results": [asdict(r) for r in results],
+    }
+
+
+# ---------------------------------------------------------------------------
+# Confronto con una baseline
+# ---------------------------------------------------------------------------
+
+def compare(report: dict, baseline: dict, threshold: float) -> List[str]:
+    """Regressioni rispetto alla baseline, come righe leggibili.
+
+    La latenza regredisce oltre `threshold` (0.2 = +20%); RPC e handshake
+    sono deterministici sul backend finto, quindi basta un aumento.
+    """
+    base = {(r["case"], r["mode"]): r for r in baseline.get("results", [])}
+    problems = []
+    for r in report["results"]:
+        b = base.get((r["case"], r["mode"]))
+        if b is None:
+            continue
+        label = f"{r['case']} [{r['mode']}]"
+        if r["latency_s"] > b["latency_s"] * (1 + threshold):
+            problems.append(f"{label}: latenza {b['latency_s']:.3f}s -> {r['latency_s']:.3f}s")
+        if r["rpc"] > b["rpc"]:
+            problems.append(f"{label}: RPC {b['rpc']} -> {r['rpc']}")
+        if r["connects"] > b["connects"]:
+            problems.append(f"{label}: handshake {b['connects']} -> {r['connects']}")
+    return problems
+
+
+def load_report(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_report(report: dict, path: str) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+        f.write("\n")
+
+
+def format_table(results: List[dict]) -> str:
+    """Tabella testuale: una riga per caso, colonne latenza/RPC/handshake per modalita'."""
+    by_case: Dict[str, Dict[str, dict]] = {}
+    for r in results:
+        by_case.setdefault(r["case"], {})[r["mode"]] = r
+    modes = [m for m in (PER_CALL, POOLED, BATCHED) if any(m in v for v in by_case.values())]
+    width = max(len(c) for c in by_case) if by_case else 10
+    lines = [f"{'caso':<{width}}  " + "  ".join(f"{m:>24}" for m in modes)]
+    for case, per_mode in by_case.items():
+        cells = []
+        for m in modes:
+            r = per_mode.get(m)
+            cells.append(f"{r['latency_s']:>8.3f}s {r['rpc']:>5} rpc {r['connects']:>2} conn" if r else " " * 24)
+        lines.append(f"{case:<{width}}  " + "  ".join(cells))
+    return "\n".join(lines)
@@ -0,0 +1,125 @@
+"""
+Event loop asyncio dedicato in un thread daemon.
+
+Streamlit esegue le pagine in modo sincrono e ricrea lo stato a ogni rerun:
+le risorse async che devono sopravvivere fra rerun (client Telethon connessi,
+pool HTTP, ...) vanno quindi legate a un loop che vive per tutto il processo,
+non a un loop creato e chiuso da asyncio.run() a ogni chiamata.
+
+BackgroundLoop avvia pigramente il proprio thread alla prima richiesta ed
+espone una facciata sincrona (run / submit / iterate) utilizzabile da qualunque thread
+tranne quello del loop stesso.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
+import threading
+from typing import Any, AsyncIterator, Awaitable, Iterator, Optional
+
+
+_EXHAUSTED = object()
+
+
+class BackgroundLoop:
+    """Un event loop asyncio che gira per sempre in un thread daemon."""
+
+    def __init__(self, name: str = "av-background-loop"):
+        self._name = name
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+
+    # -- ciclo di vita ------------------------------------------------------
+
+    def _ensure_started(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._loop is not None:
+                return self._loop
+            loop = asyncio.new_event_loop()
+            started = threading.Event()
+
+            def _main():
+                asyncio.set_event_loop(loop)
+                loop.call_soon(started.set)
+                loop.run_forever()
+
+            thread = threading.Thread(target=_main, name=self._name, daemon=True)
+            thread.start()
+            started.wait()
+            self._loop = loop
+            self._thread = thread
+            return loop
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        return self._ensure_started()
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def in_loop_thread(self) -> bool:
+        return self._thread is not None and threading.current_thread() is self._thread
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Ferma il loop (se avviato) e attende la fine del thread."""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = None
+            self._thread = None
+        if loop is None or thread is None:
+            return
+        loop.call_soon_threadsafe(loop.stop)
+        if threading.current_thread() is not thread:
+            thread.join(timeout)
+
+    # -- facciata sincrona --------------------------------------------------
+
+    def submit(self, coro: Awaitable[Any]) -> concurrent.futures.Future:
+        """Schedula una coroutine sul loop e ritorna subito un concurrent Future."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro: Awaitable[Any], timeout: Optional[float] = None) -> Any:
+        """Esegue una coroutine sul loop e ne attende il risultato (bloccante).
+
+        Non va chiamata dal thread del loop: si bloccherebbe per sempre.
+        """
+        if self.in_loop_thread():
+            raise RuntimeError(
+                f"BackgroundLoop.run() chiamata dal thread del loop '{self._name}': usare await."
+            )
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+    def iterate(self, agen: AsyncIterator[Any]) -> Iterator[Any]:
+        """Consuma un async iterator sul loop, producendo gli elementi nel thread chiamante.
+
+        Utile per riportare progressi (callback, UI Streamlit) sul thread dello
+        script mentre il lavoro async gira sul loop. Se il chiamante smette di
+        iterare, l'async generator viene chiuso sul loop.
+        """
+
+        async def _next():
+            try:
+                return await agen.__anext__()
+            except StopAsyncIteration:
+                return _EXHAUSTED
+
+        try:
+            while True:
+                item = self.run(_next())
+                if item is _EXHAUSTED:
+                    return
+                yield item
+        finally:
+            aclose = getattr(agen, "aclose", None)
+            if aclose is not None:
+                try:
+                    self.run(aclose())
+                except Exception:
+                    pass
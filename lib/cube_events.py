@@ -0,0 +1,390 @@
+"""
+Logica di dominio dei cubi (collezione Firestore `cube_events`), condivisa
+fra la pagina "Gestione Cubi" e i processi in background (worker.py).
+
+Nessuna dipendenza da Streamlit: le funzioni lavorano su dict (eventi,
+attivisti, output di lib.telegram_client) e ritornano dict/update Firestore.
+"""
+
+import re as _re
+
+from firebase_admin import firestore
+
+EVENTS_COLLECTION = "cube_events"
+
+CATEGORIES = ["ignore", "yes", "maybe", "no"]
+
+
+def render_reminder_template(template: str, recipient: dict, ev: dict) -> str:
+    """Sostituisce i placeholder nel template per un destinatario specifico."""
+    out = template or ""
+    out = out.replace("{nome}", recipient.get("nome", "") or "")
+    out = out.replace("{cognome}", recipient.get("cognome", "") or "")
+    out = out.replace("{data}", ev.get("data", "") or "")
+    out = out.replace("{ora}", ev.get("ora", "") or "")
+    out = out.replace("{luogo}", ev.get("luogo", "") or "")
+    out = out.replace("{poll_link}", ev.get("poll_link", "") or "")
+    return out
+
+
+def reminder_candidates(ev: dict, activists_list):
+    """Attivisti a cui mandare un reminder: chi non ha votato o ha votato "Forse".
+
+    Ritorna (candidates, skipped_unreachable). I candidati hanno "status_cat"
+    "no_response" o "maybe" e almeno un identificativo Telegram (user_id o
+    username); chi non ne ha finisce in skipped_unreachable.
+    """
+    cat_by_idx = {o["idx"]: o.get("category", "ignore") for o in ev.get("poll_options", [])}
+    parts = ev.get("participations", {})
+    sent = ev.get("reminders_sent", {})
+    candidates = []
+    skipped_unreachable = []
+    for a in activists_list:
+        uname = (a.get("telegram_username") or "").strip().lstrip("@")
+        uid = a.get("telegram_user_id")
+        email = a.get("email", "")
+        nome = a.get("nome", "")
+        cognome = a.get("cognome", "")
+        part = parts.get(email)
+        if part:
+            status_cat = cat_by_idx.get(part.get("option_idx"), "ignore")
+            if status_cat in ("yes", "no"):
+                continue
+        else:
+            status_cat = "no_response"
+        # Raggiungibile se abbiamo user_id (canonico) o username
+        if not uname and not (isinstance(uid, int) and uid > 0):
+            skipped_unreachable.append({"nome": nome, "cognome": cognome, "email": email, "status_cat": status_cat})
+            continue
+        candidates.append({
+            "email": email,
+            "nome": nome,
+            "cognome": cognome,
+            "username": uname,
+            "user_id": uid if isinstance(uid, int) else None,
+            "status_cat": status_cat,
+            "last_sent": sent.get(email, {}).get("sent_at"),
+        })
+    return candidates, skipped_unreachable
+
+
+def reminder_job_items(template: str, recipients, ev: dict):
+    """Item di un job di invio (lib/reminder_jobs.py), col testo gia' renderizzato."""
+    # Preferisce user_id (canonico) se cached, altrimenti username
+    return [
+        {
+            "email": rcp["email"],
+            "nome": rcp["nome"],
+            "cognome": rcp["cognome"],
+            "username": rcp.get("username") or None,
+            "user_id": rcp.get("user_id"),
+            "text": render_reminder_template(template, rcp, ev),
+        }
+        for rcp in recipients
+    ]
+
+
+# Keyword per indovinare la categoria dal testo dell'opzione del sondaggio.
+# IMPORTANTE: la lista "no" viene matchata PRIMA della lista "yes" perche'
+# espressioni come "non vengo" / "non posso" contengono parole che da sole
+# matcherebbero "yes" (es. "vengo", "posso").
+CATEGORY_KEYWORDS = {
+    "no": [
+        r"\bno\b",
+        r"non\s+posso",
+        r"non\s+vengo",
+        r"non\s+riesco",
+        r"non\s+partecipo",
+        r"non\s+ci\s+sar",
+        r"impossibile",
+        r"\bko\b",
+        r"\bskip\b",
+        r"\bsalto\b",
+        r"can't",
+        r"cannot",
+        r"\bout\b",
+        r"\bnope\b",
+        r"❌",
+        r"🚫",
+        r"👎",
+    ],
+    "maybe": [
+        r"\bforse\b",
+        r"\bvediamo\b",
+        r"non\s+lo\s+so",
+        r"\bnon\s+so\b",
+        r"\bmagari\b",
+        r"\bboh\b",
+        r"incerto",
+        r"in\s+forse",
+        r"\bmaybe\b",
+        r"perhaps",
+        r"not\s+sure",
+        r"\bdunno\b",
+        r"\?",
+        r"🤔",
+        r"❓",
+    ],
+    "yes": [
+        r"\bs[iì]\b",
+        r"\bci\s+sar[oò]\b",
+        r"\bvengo\b",
+        r"\bpresente\b",
+        r"\bpartecipo\b",
+        r"ci\s+sono",
+        r"primo\s+giorno",
+        r"secondo\s+giorno",
+        r"terzo\s+giorno",
+        r"quarto\s+giorno",
+        r"quinto\s+giorno",
+        r"day\s+\d",
+        r"giorno\s+\d",
+        r"\d+\s*°\s*giorno",
+        r"\bok\b",
+        r"\byes\b",
+        r"i'?ll\s+be\s+there",
+        r"\bcoming\b",
+        r"\bgoing\b",
+        r"attending",
+        r"\bin\b",
+        r"✅",
+        r"👍",
+        r"🙋",
+    ],
+}
+
+
+def auto_detect_category(option_text: str) -> str:
+    """Indovina la categoria (yes/maybe/no/ignore) dal testo libero di un'opzione.
+
+    Logica: lowercase + regex word-boundary matching, in ordine no -> maybe -> yes
+    (l'ordine evita falsi positivi: "non vengo" deve matchare NO prima di YES).
+    Ritorna "ignore" se nessuna keyword matcha.
+    """
+    if not option_text:
+        return "ignore"
+    t = option_text.strip().lower()
+    if not t:
+        return "ignore"
+    for cat in ("no", "maybe", "yes"):
+        for pattern in CATEGORY_KEYWORDS[cat]:
+            if _re.search(pattern, t, flags=_re.IGNORECASE):
+                return cat
+    return "ignore"
+
+
+def derive_initial_category(option_text: str, memorized_mappings: dict) -> str:
+    """Decide la categoria di default per un'opzione del poll.
+
+    1) Se l'organizer ha gia' classificato esattamente quel testo in passato
+       (memorized_mappings), riutilizza quella scelta.
+    2) Altrimenti applica auto_detect_category sul testo.
+    3) Default finale: "ignore".
+    """
+    key = (option_text or "").strip().lower()
+    if key and memorized_mappings and key in memorized_mappings:
+        cat = memorized_mappings[key]
+        if cat in CATEGORIES:
+            return cat
+    return auto_detect_category(option_text)
+
+
+def remember_mappings(current_memory: dict, poll_options_with_categories) -> dict:
+    """Aggiorna la memoria mapping con le scelte non-banali dell'organizer.
+
+    Non memorizziamo "ignore" (e' il default, non insegna nulla).
+    Le voci esistenti vengono SOVRASCRITTE (l'ultimo verdetto vince).
+    """
+    out = dict(current_memory or {})
+    for opt in poll_options_with_categories:
+        text = (opt.get("text") or "").strip().lower()
+        cat = opt.get("category", "ignore")
+        if not text:
+            continue
+        if cat == "ignore":
+            continue
+        if cat not in CATEGORIES:
+            continue
+        out[text] = cat
+    return out
+
+
+def compute_participations(activists_list, options_with_voters):
+    """Match votanti -> attivisti, prima per telegram_user_id (canonico, infallibile),
+    poi per telegram_username (fallback).
+
+    Ritorna (participations, outside_voters).
+    participations: dict keyed by activist email.
+    outside_voters: list di dict per chi ha votato ma non e' nella lista attivisti.
+    """
+    # Index attivisti per user_id (priorita') e per username (fallback)
+    by_user_id = {}
+    by_username = {}
+    for a in activists_list:
+        uid = a.get("telegram_user_id")
+        if isinstance(uid, int) and uid > 0:
+            by_user_id[uid] = a
+        uname = (a.get("telegram_username") or "").strip().lower().lstrip("@")
+        if uname:
+            by_username[uname] = a
+
+    participations = {}
+    matched_user_ids = set()
+    for opt in options_with_voters:
+        for v in opt.get("voters", []):
+            vid = v.get("user_id")
+            vuname = (v.get("username") or "").strip().lower()
+            # Match priority: user_id > username
+            act = None
+            if isinstance(vid, int) and vid in by_user_id:
+                act = by_user_id[vid]
+            elif vuname and vuname in by_username:
+                act = by_username[vuname]
+            if act is None:
+                continue
+            # Se vota piu' opzioni (multiple_choice), prendiamo la prima trovata
+            if act["email"] not in participations:
+                participations[act["email"]] = {
+                    "voted": True,
+                    "option_idx": opt["idx"],
+                    "option_text": opt["text"],
+                    "telegram_user_id": vid,
+                    "voted_at": v.get("voted_at"),
+                }
+                if vid:
+                    matched_user_ids.add(vid)
+
+    outside = []
+    for opt in options_with_voters:
+        for v in opt.get("voters", []):
+            if v.get("user_id") in matched_user_ids:
+                continue
+            outside.append({
+                "user_id": v.get("user_id"),
+                "username": v.get("username"),
+                "first_name": v.get("first_name", ""),
+                "last_name": v.get("last_name", ""),
+                "option_idx": opt["idx"],
+                "option_text": opt["text"],
+                "voted_at": v.get("voted_at"),
+            })
+
+    return participations, outside
+
+
+def known_option_counts(ev):
+    """Conteggi per opzione del refresh precedente, o None se serve un refresh completo.
+
+    Valgono solo se il doc ha anche gli user_id per opzione (poll_voter_ids):
+    gli eventi senza (creati prima del refresh incrementale o con la vecchia
+    cache poll_voters) rileggono tutte le opzioni.
+    """
+    if "poll_voter_ids" not in ev:
+        return None
+    return ev.get("poll_option_counts") or None
+
+
+def _known_voters(ev, activists_list):
+    """Dettagli dei votanti gia' noti, ricostruiti da participations e outside_voters.
+
+    Chiavi (user_id, idx) e user_id. Per gli attivisti lo username e' quello
+    della lista attivisti corrente.
+    """
+    username_by_email = {
+        a.get("email"): (a.get("telegram_username") or "").strip().lstrip("@") or None
+        for a in activists_list
+    }
+    known = {}
+    for email, p in (ev.get("participations") or {}).items():
+        uid = p.get("telegram_user_id")
+        if not uid:
+            continue
+        voter = {
+            "user_id": uid,
+            "username": username_by_email.get(email),
+            "first_name": "",
+            "last_name": "",
+            "voted_at": p.get("voted_at"),
+        }
+        known[uid] = voter
+        known[(uid, p.get("option_idx"))] = voter
+    for o in ev.get("outside_voters") or []:
+        uid = o.get("user_id")
+        voter = {k: o.get(k) for k in ("user_id", "username", "first_name", "last_name", "voted_at")}
+        known.setdefault(uid, voter)
+        known[(uid, o.get("option_idx"))] = voter
+    return known
+
+
+def build_refresh_update(ev, delta, activists_list, org_mem):
+    """Costruisce l'update Firestore (merge) per un refresh incrementale.
+
+    `delta` e' l'output di get_poll_voters_delta. Sul doc resta solo lo stato
+    compatto per opzione (poll_voter_ids: str(idx) -> [user_id], piu'
+    poll_option_counts): i dettagli dei votanti delle opzioni non cambiate
+    si ricostruiscono da participations/outside_voters, che li contengono
+    gia', cosi' il doc non duplica i votanti e resta lontano dal limite di
+    1 MiB. Si riscrivono solo le opzioni cambiate e si ricalcolano
+    participations/outside_voters, scrivendoli solo se diversi.
+
+    Un votante gia' noto che non e' piu' ne' attivista ne' fra gli esterni
+    (es. attivista rimosso fra due refresh) resta con il solo user_id finche'
+    la sua opzione non cambia.
+    """
+    voter_ids = ev.get("poll_voter_ids") or {}
+    fresh = {}
+    update = {}
+    for opt in delta["changed_options"]:
+        key = str(opt["idx"])
+        fresh[key] = opt["voters"]
+        update[firestore.FieldPath("poll_voter_ids", key).to_api_repr()] = [
+            v["user_id"] for v in opt["voters"] if v.get("user_id")
+        ]
+    if "poll_voters" in ev:
+        # Vecchia cache con i votanti completi: sostituita da poll_voter_ids.
+        update["poll_voters"] = firestore.DELETE_FIELD
+
+    known = _known_voters(ev, activists_list) if len(fresh) < len(delta["options"]) else {}
+
+    def _voters(idx):
+        key = str(idx)
+        if key in fresh:
+            return fresh[key]
+        return [
+            known.get((uid, idx)) or known.get(uid) or {"user_id": uid, "username": None, "voted_at": None}
+            for uid in voter_ids.get(key, [])
+        ]
+
+    options_with_voters = [
+        {"idx": o["idx"], "text": o["text"], "voters": _voters(o["idx"])}
+        for o in delta["options"]
+    ]
+    participations, outside = compute_participations(activists_list, options_with_voters)
+    if participations != ev.get("participations", {}):
+        update["participations"] = participations
+    if outside != ev.get("outside_voters", []):
+        update["outside_voters"] = outside
+    if delta["option_counts"] != ev.get("poll_option_counts"):
+        update["poll_option_counts"] = delta["option_counts"]
+    if delta["question"] != ev.get("poll_question"):
+        update["poll_question"] = delta["question"]
+
+    # Se al refresh sono apparse opzioni nuove (raro: poll modificato),
+    # le aggiungiamo a poll_options con auto-detect / memoria.
+    existing_idxs = {o["idx"] for o in ev.get("poll_options", [])}
+    new_options = [
+        {
+            "idx": o["idx"],
+            "text": o["text"],
+            "category": derive_initial_category(o["text"], org_mem),
+        }
+        for o in delta["options"]
+        if o["idx"] not in existing_idxs
+    ]
+    if new_options:
+        update["poll_options"] = list(ev.get("poll_options", [])) + new_options
+
+    if update:
+        update["updated_at"] = firestore.SERVER_TIMESTAMP
+    update["last_refresh"] = firestore.SERVER_TIMESTAMP
+    return update
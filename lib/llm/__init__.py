@@ -0,0 +1 @@
+"""Provider LLM (Groq, OpenRouter, Gemini): client condivisi e adapter di streaming."""
@@ -0,0 +1,260 @@
+"""
+Adapter dei provider LLM dietro un'unica interfaccia di streaming async.
+
+Ogni adapter espone
+
+    async for event in adapter.stream(messages, system, params): ...
+
+con `messages` = [{"role": "user" | "assistant", "content": str}, ...]
+(l'ultimo e' il turno dell'utente), `system` = system prompt e `params` =
+{"temperature", "max_tokens"} opzionali. Eventi prodotti:
+
+    {"type": "delta", "text": str}
+    {"type": "done", "provider", "model", "text",
+     "usage": {"input_tokens": int | None, "output_tokens": int | None},
+     "timing": {"ttft_s": float | None, "total_s": float},
+     "retries": int}
+
+L'adapter si sceglie con get_adapter(provider, model_name, api_key) dai
+campi `provider` / `model_name` di data/experts.json (fallback
+data/app_config.json); aggiungere un provider = una classe in _ADAPTERS.
+Qui vivono anche retry, timeout e metriche delle chiamate LLM; pool e
+client sono in lib/llm/clients.py. Le pagine (sincrone) consumano lo stream
+con stream_chat(), che lo esegue sul loop LLM del processo.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+from lib.llm.clients import GEMINI, GROQ, OPENROUTER, READ_TIMEOUT_S, get_llm_client, get_llm_loop
+
+# Un errore transitorio prima del primo token viene ritentato (dopo il primo
+# token no: il testo parziale e' gia' a video).
+STREAM_RETRIES = 1
+RETRY_DELAY_S = 1.0
+
+LLM_CALLS_BUFFER = 500
+
+_CALLS_LOCK = threading.Lock()
+_CALLS: deque = deque(maxlen=LLM_CALLS_BUFFER)
+
+
+def recent_llm_calls() -> List[dict]:
+    """Ultime chiamate LLM del processo (provider, modello, tempi, token, esito).
+
+    `ok` e' None per uno stream chiuso o cancellato dal consumatore prima della fine.
+    """
+    with _CALLS_LOCK:
+        return list(_CALLS)
+
+
+def _record_call(call: dict) -> None:
+    with _CALLS_LOCK:
+        _CALLS.append(call)
+
+
+class LLMAdapter(ABC):
+    """Base: retry prima del primo token, tempi e metriche. Le sottoclassi implementano _stream."""
+
+    provider: str = ""
+    # Parametri di default del provider, sovrascritti da `params`.
+    default_params: Dict[str, Any] = {}
+
+    def __init__(self, model: str, api_key: str):
+        self.model = model
+        self.client = get_llm_client(self.provider, api_key)
+
+    def _transient_errors(self) -> Tuple[type, ...]:
+        """Errori da ritentare prima del primo token (oltre ai retry interni dello SDK)."""
+        return ()
+
+    @abstractmethod
+    def _stream(self, messages: List[dict], system: str, params: dict) -> AsyncIterator[Tuple[str, Optional[dict]]]:
+        """Async generator: (testo, None) per ogni delta e ("", usage) quando l'usage e' noto."""
+
+    async def stream(self, messages: List[dict], system: str, params: Optional[dict] = None) -> AsyncIterator[dict]:
+        params = {**self.default_params, **{k: v for k, v in (params or {}).items() if v is not None}}
+        start = time.perf_counter()
+        ttft: Optional[float] = None
+        parts: List[str] = []
+        usage = {"input_tokens": None, "output_tokens": None}
+        retries = 0
+        error: Optional[str] = None
+        cancelled = False
+        try:
+            while True:
+                try:
+                    async for text, chunk_usage in self._stream(messages, system, params):
+                        if chunk_usage:
+                            usage.update({k: v for k, v in chunk_usage.items() if v is not None})
+                        if text:
+                            if ttft is None:
+                                ttft = time.perf_counter() - start
+                            parts.append(text)
+                            yield {"type": "delta", "text": text}
+                    break
+                except self._transient_errors():
+                    if parts or retries >= STREAM_RETRIES:
+                        raise
+                    retries += 1
+                    await asyncio.sleep(RETRY_DELAY_S)
+        except (GeneratorExit, asyncio.CancelledError):
+            # Chiuso dal consumatore (es. rerun Streamlit): non e' un errore del provider.
+            cancelled = True
+            raise
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            total = time.perf_counter() - start
+            _record_call({
+                "ts": time.time(),
+                "provider": self.provider,
+                "model": self.model,
+                "ok": None if cancelled else error is None,
+                "error": error,
+                "ttft_s": ttft,
+                "total_s": total,
+                "retries": retries,
+                **usage,
+            })
+        yield {
+            "type": "done",
+            "provider": self.provider,
+            "model": self.model,
+            "text": "".join(parts),
+            "usage": usage,
+            "timing": {"ttft_s": ttft, "total_s": total},
+            "retries": retries,
+        }
+
+
+# ---------------------------------------------------------------------------
+# Provider compatibili con l'API OpenAI (Groq, OpenRouter)
+# ---------------------------------------------------------------------------
+
+def _openai_usage(usage: Any) -> Optional[dict]:
+    if usage is None:
+        return None
+    return {
+        "input_tokens": getattr(usage, "prompt_tokens", None),
+        "output_tokens": getattr(usage, "completion_tokens", None),
+    }
+
+
+class OpenAICompatibleAdapter(LLMAdapter):
+    """Chat completions in streaming. I retry della richiesta iniziale li fa lo SDK."""
+
+    def _request(self, messages: List[dict], system: str, params: dict) -> dict:
+        payload = [{"role": "system", "content": system}]
+        payload.extend({"role": m["role"], "content": m["content"]} for m in messages)
+        request = {"model": self.model, "messages": payload, "stream": True}
+        if params.get("temperature") is not None:
+            request["temperature"] = params["temperature"]
+        if params.get("max_tokens") is not None:
+            request["max_tokens"] = params["max_tokens"]
+        return request
+
+    def _chunk_usage(self, chunk: Any) -> Optional[dict]:
+        return _openai_usage(getattr(chunk, "usage", None))
+
+    async def _stream(self, messages, system, params):
+        completion = await self.client.chat.completions.create(**self._request(messages, system, params))
+        try:
+            async for chunk in completion:
+                text = chunk.choices[0].delta.content if chunk.choices else None
+                yield text or "", self._chunk_usage(chunk)
+        finally:
+            await completion.close()
+
+
+class GroqAdapter(OpenAICompatibleAdapter):
+    provider = GROQ
+    default_params = {"max_tokens": 1024}
+
+    def _chunk_usage(self, chunk: Any) -> Optional[dict]:
+        # Groq mette l'usage nell'ultimo chunk, sotto x_groq.
+        x_groq = getattr(chunk, "x_groq", None)
+        return _openai_usage(getattr(x_groq, "usage", None)) or super()._chunk_usage(chunk)
+
+
+class OpenRouterAdapter(OpenAICompatibleAdapter):
+    provider = OPENROUTER
+
+    def _request(self, messages, system, params):
+        request = super()._request(messages, system, params)
+        # Chunk finale con l'usage (senza choices).
+        request["stream_options"] = {"include_usage": True}
+        return request
+
+
+# ---------------------------------------------------------------------------
+# Gemini
+# ---------------------------------------------------------------------------
+
+class GeminiAdapter(LLMAdapter):
+    """Gemini usa la temperatura di default del modello: `temperature` non viene inviata."""
+
+    provider = GEMINI
+
+    def _transient_errors(self):
+        from google.api_core import exceptions as gexc
+
+        return (gexc.ServiceUnavailable, gexc.InternalServerError, gexc.DeadlineExceeded)
+
+    async def _stream(self, messages, system, params):
+        genai = self.client
+        model = genai.GenerativeModel(model_name=self.model, system_instruction=system)
+        contents = [
+            {"role": "user" if m["role"] == "user" else "model", "parts": [m["content"]]}
+            for m in messages
+        ]
+        config = {}
+        if params.get("max_tokens") is not None:
+            config["max_output_tokens"] = params["max_tokens"]
+        response = await model.generate_content_async(
+            contents,
+            generation_config=config or None,
+            stream=True,
+            request_options={"timeout": READ_TIMEOUT_S},
+        )
+        async for chunk in response:
+            meta = getattr(chunk, "usage_metadata", None)
+            usage = {
+                "input_tokens": getattr(meta, "prompt_token_count", None),
+                "output_tokens": getattr(meta, "candidates_token_count", None),
+            } if meta else None
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunk senza parti di testo (es. solo metadata o blocco safety).
+                text = ""
+            yield text, usage
+
+
+_ADAPTERS = {
+    GROQ: GroqAdapter,
+    OPENROUTER: OpenRouterAdapter,
+    GEMINI: GeminiAdapter,
+}
+
+
+def get_adapter(provider: str, model_name: str, api_key: str) -> LLMAdapter:
+    """Adapter per provider/modello. Solleva ValueError per un provider sconosciuto."""
+    cls = _ADAPTERS.get((provider or "").lower())
+    if cls is None:
+        raise ValueError(f"Provider LLM sconosciuto: {provider!r}")
+    return cls(model_name, api_key)
+
+
+def stream_chat(
+    adapter: LLMAdapter, messages: List[dict], system: str, params: Optional[dict] = None
+) -> Iterator[dict]:
+    """Facciata sincrona di adapter.stream: gira sul loop LLM, eventi nel thread chiamante."""
+    return get_llm_loop().iterate(adapter.stream(messages, system, params))
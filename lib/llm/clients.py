@@ -0,0 +1,171 @@
+"""
+Registro process-wide dei client dei provider LLM.
+
+Streamlit riesegue la pagina a ogni interazione: costruire `Groq(...)` o
+`OpenAI(...)` nel corpo della pagina butta via a ogni rerun il pool HTTP e
+la sessione TLS, e il primo token di ogni risposta aspetta un handshake
+nuovo. Qui i client sono creati una volta per (provider, fingerprint della
+chiave) e condivisi da tutte le sessioni e da tutti gli esperti.
+
+- I client sono async (AsyncGroq / AsyncOpenAI) e vanno usati solo sul loop
+  LLM del processo (get_llm_loop), a cui restano legati i loro pool HTTP.
+- Timeout espliciti (connessione breve, lettura lunga per lo streaming) e
+  limiti di connessione per client.
+- Keep-alive delle connessioni idle per KEEPALIVE_EXPIRY_S: il default degli
+  SDK (5 s) chiude la connessione fra un messaggio e l'altro.
+- Al piu' MAX_CLIENTS client (es. chiavi inserite a mano nella sidebar):
+  oltre si chiude quello usato meno di recente.
+- Gemini (google.generativeai) ha una configurazione globale: genai.configure
+  viene richiamato solo quando la chiave cambia, cosi' il canale verso
+  l'API resta vivo fra un messaggio e l'altro.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+from lib.aio_loop import BackgroundLoop
+
+GROQ = "groq"
+OPENROUTER = "openrouter"
+GEMINI = "gemini"
+
+# Secret Streamlit con la chiave di ogni provider.
+API_KEY_SECRETS = {
+    GROQ: "GROQ_API_KEY",
+    GEMINI: "GOOGLE_API_KEY",
+    OPENROUTER: "OPENROUTER_API_KEY",
+}
+
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+OPENROUTER_HEADERS = {
+    "HTTP-Referer": "https://av-assistant.streamlit.app",
+    "X-Title": "AV Assistant",
+}
+
+CONNECT_TIMEOUT_S = 10.0
+READ_TIMEOUT_S = 120.0       # fra un chunk e il successivo durante lo streaming
+MAX_CONNECTIONS = 20
+MAX_KEEPALIVE_CONNECTIONS = 10
+KEEPALIVE_EXPIRY_S = 300.0
+MAX_RETRIES = 2
+MAX_CLIENTS = 16
+
+_LOOP = BackgroundLoop(name="llm")
+_LOCK = threading.Lock()
+_CLIENTS: "OrderedDict[Tuple[str, str], Any]" = OrderedDict()
+_GEMINI_KEY: Optional[str] = None
+
+
+def get_llm_loop() -> BackgroundLoop:
+    """Loop dedicato su cui girano tutte le chiamate LLM del processo."""
+    return _LOOP
+
+
+def key_fingerprint(api_key: str) -> str:
+    """Identificativo non reversibile di una chiave, per le chiavi del registro."""
+    return hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:16]
+
+
+def _http_options(sdk: Any) -> dict:
+    """Timeout e limiti nei tipi httpx dello SDK (groq e openai possono usare versioni diverse)."""
+    limits_cls = type(sdk.DEFAULT_CONNECTION_LIMITS)
+    return {
+        "timeout": sdk.Timeout(READ_TIMEOUT_S, connect=CONNECT_TIMEOUT_S),
+        "limits": limits_cls(
+            max_connections=MAX_CONNECTIONS,
+            max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=KEEPALIVE_EXPIRY_S,
+        ),
+    }
+
+
+def _build_groq(api_key: str) -> Any:
+    import groq
+
+    options = _http_options(groq)
+    return groq.AsyncGroq(
+        api_key=api_key,
+        timeout=options["timeout"],
+        max_retries=MAX_RETRIES,
+        http_client=groq.DefaultAsyncHttpxClient(**options),
+    )
+
+
+def _build_openrouter(api_key: str) -> Any:
+    import openai
+
+    options = _http_options(openai)
+    return openai.AsyncOpenAI(
+        base_url=OPENROUTER_BASE_URL,
+        api_key=api_key,
+        default_headers=OPENROUTER_HEADERS,
+        timeout=options["timeout"],
+        max_retries=MAX_RETRIES,
+        http_client=openai.DefaultAsyncHttpxClient(**options),
+    )
+
+
+def _configure_gemini(api_key: str) -> Any:
+    global _GEMINI_KEY
+    import google.generativeai as genai
+
+    if _GEMINI_KEY != api_key:
+        genai.configure(api_key=api_key)
+        _GEMINI_KEY = api_key
+    return genai
+
+
+_BUILDERS = {
+    GROQ: _build_groq,
+    OPENROUTER: _build_openrouter,
+}
+
+
+def get_llm_client(provider: str, api_key: str) -> Any:
+    """Client condiviso per provider e chiave.
+
+    groq / openrouter: client SDK async (AsyncGroq / AsyncOpenAI) con pool
+        HTTP persistente, da usare sul loop di get_llm_loop().
+    gemini: il modulo google.generativeai, configurato con la chiave.
+    Solleva ValueError per un provider sconosciuto.
+    """
+    provider = (provider or "").lower()
+    with _LOCK:
+        if provider == GEMINI:
+            return _configure_gemini(api_key)
+        builder = _BUILDERS.get(provider)
+        if builder is None:
+            raise ValueError(f"Provider LLM sconosciuto: {provider!r}")
+        key = (provider, key_fingerprint(api_key))
+        client = _CLIENTS.get(key)
+        if client is not None:
+            _CLIENTS.move_to_end(key)
+            return client
+        client = builder(api_key)
+        _CLIENTS[key] = client
+        while len(_CLIENTS) > MAX_CLIENTS:
+            _, evicted = _CLIENTS.popitem(last=False)
+            _close_quietly(evicted)
+        return client
+
+
+def _close_quietly(client: Any) -> None:
+    try:
+        _LOOP.submit(client.close())
+    except Exception:
+        pass
+
+
+def close_llm_clients() -> None:
+    """Chiude tutti i client (es. nei test o allo spegnimento del processo)."""
+    global _GEMINI_KEY
+    with _LOCK:
+        clients = list(_CLIENTS.values())
+        _CLIENTS.clear()
+        _GEMINI_KEY = None
+    for client in clients:
+        _close_quietly(client)
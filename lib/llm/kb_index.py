@@ -0,0 +1,240 @@
+"""
+Indice lessicale (BM25) sulle knowledge base degli esperti.
+
+Con `"kb_mode": "retrieval"` in data/experts.json la KB non viene accodata
+per intero al system prompt: si inietta solo i KB_TOP_K chunk piu' rilevanti
+per l'ultimo messaggio dell'utente, cosi' costo e latenza non crescono con la
+dimensione del file.
+
+- Chunking: sezioni separate da righe `---` e da righe vuote, accorpate fino
+  a CHUNK_MAX_CHARS; un paragrafo piu' lungo si spezza per righe.
+- Token: minuscolo, senza accenti, senza stopword IT/EN, con uno stemming
+  minimo (plurali / vocale finale) perche' "proteina" trovi "proteine".
+- L'indice e' salvato in INDEX_DIR (JSON) e ricostruito quando mtime o
+  dimensione del file cambiano; in memoria resta uno per file.
+- Un file mancante o illeggibile non ha indice (get_kb_index ritorna None)
+  e non produce chunk, come la KB assente nel prompt completo.
+Nessuna dipendenza oltre la libreria standard.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import heapq
+import json
+import math
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+INDEX_DIR = os.path.join(".cache", "kb_index")
+INDEX_FORMAT = 1
+CHUNK_MAX_CHARS = 1200
+KB_TOP_K = 4
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+KB_FULL = "full"
+KB_RETRIEVAL = "retrieval"
+
+_SECTION_RE = re.compile(r"^\s*-{3,}\s*$", re.MULTILINE)
+_PARAGRAPH_RE = re.compile(r"\n\s*\n")
+_WORD_RE = re.compile(r"\w+")
+
+STOPWORDS = frozenset("""
+a ad al alla alle agli ai allo anche ci che chi con cosa come da dal dalla dei del della delle degli di e ed
+gli ha hai ho i il in io la le lo ma mi ne nei nel nella non o per piu poi quale quali quando quello questa
+questo se si sia sono su sul sulla suo sua ti tra tu un una uno vi
+about an and are as at be been but by can do does for from had has have how i if in into is it its me my
+no not of on or so than that the their them then there these they this to was we what when where which
+who why will with you your
+""".split())
+
+_LOCK = threading.Lock()
+_INDEXES: Dict[str, "KBIndex"] = {}
+
+
+# ---------------------------------------------------------------------------
+# Testo
+# ---------------------------------------------------------------------------
+
+def chunk_text(text: str, max_chars: int = CHUNK_MAX_CHARS) -> List[str]:
+    """Chunk della KB: sezioni e paragrafi accorpati fino a `max_chars`."""
+    chunks: List[str] = []
+    for section in _SECTION_RE.split(text):
+        current = ""
+        for paragraph in _PARAGRAPH_RE.split(section):
+            paragraph = paragraph.strip()
+            if not paragraph:
+                continue
+            pieces = [paragraph] if len(paragraph) <= max_chars else _split_lines(paragraph, max_chars)
+            for piece in pieces:
+                if current and len(current) + 2 + len(piece) > max_chars:
+                    chunks.append(current)
+                    current = ""
+                current = f"{current}\n\n{piece}" if current else piece
+        if current:
+            chunks.append(current)
+    return chunks
+
+
+def _split_lines(paragraph: str, max_chars: int) -> List[str]:
+    pieces: List[str] = []
+    current = ""
+    for line in paragraph.splitlines():
+        # Una riga sola oltre il limite resta intera: meglio un chunk lungo che una frase spezzata.
+        if current and len(current) + 1 + len(line) > max_chars:
+            pieces.append(current)
+            current = ""
+        current = f"{current}\n{line}" if current else line
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def _stem(token: str) -> str:
+    if len(token) > 4 and token.endswith("s") and not token.endswith("ss"):
+        token = token[:-1]
+    if len(token) > 4 and token[-1] in "aeiou":
+        token = token[:-1]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return [
+        _stem(token) for token in _WORD_RE.findall(text)
+        if len(token) > 1 and token not in STOPWORDS
+    ]
+
+
+# ---------------------------------------------------------------------------
+# Indice
+# ---------------------------------------------------------------------------
+
+class KBIndex:
+    """BM25 su chunk: postings {termine: [[chunk, tf], ...]} e lunghezze dei chunk."""
+
+    def __init__(self, version: tuple, chunks: List[str], lengths: List[int], postings: Dict[str, list]):
+        self.version = tuple(version)
+        self.chunks = chunks
+        self.lengths = lengths
+        self.postings = postings
+        self.avg_length = (sum(lengths) / len(lengths)) if lengths else 0.0
+
+    @classmethod
+    def build(cls, text: str, version: tuple) -> "KBIndex":
+        chunks = chunk_text(text)
+        lengths: List[int] = []
+        postings: Dict[str, list] = {}
+        for i, chunk in enumerate(chunks):
+            counts = Counter(tokenize(chunk))
+            lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append([i, tf])
+        return cls(version, chunks, lengths, postings)
+
+    def to_dict(self) -> dict:
+        return {
+            "format": INDEX_FORMAT,
+            "version": list(self.version),
+            "chunks": self.chunks,
+            "lengths": self.lengths,
+            "postings": self.postings,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "KBIndex":
+        return cls(data["version"], data["chunks"], data["lengths"], data["postings"])
+
+    def search(self, query: str, k: int = KB_TOP_K) -> List[Tuple[float, int]]:
+        """(punteggio, indice del chunk) dei migliori `k` chunk con punteggio > 0."""
+        n = len(self.chunks)
+        if not n or k <= 0:
+            return []
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+            for doc, tf in posting:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[doc] / (self.avg_length or 1))
+                scores[doc] = scores.get(doc, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return heapq.nlargest(k, ((s, doc) for doc, s in scores.items() if s > 0))
+
+
+def _file_version(path: str) -> tuple:
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size, CHUNK_MAX_CHARS)
+
+
+def _index_path(path: str) -> str:
+    digest = hashlib.sha256(os.path.abspath(path).encode("utf-8")).hexdigest()[:12]
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(INDEX_DIR, f"{name}-{digest}.json")
+
+
+def _load_persisted(path: str, version: tuple) -> Optional[KBIndex]:
+    try:
+        with open(_index_path(path), "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if data.get("format") != INDEX_FORMAT or tuple(data.get("version") or ()) != version:
+        return None
+    return KBIndex.from_dict(data)
+
+
+def _persist(path: str, index: KBIndex) -> None:
+    # Best effort: su un filesystem in sola lettura l'indice resta in memoria.
+    target = _index_path(path)
+    try:
+        os.makedirs(INDEX_DIR, exist_ok=True)
+        tmp = f"{target}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(index.to_dict(), f, ensure_ascii=False)
+        os.replace(tmp, target)
+    except OSError:
+        pass
+
+
+def get_kb_index(path: str) -> Optional[KBIndex]:
+    """Indice della KB: dalla memoria, dal disco o ricostruito se il file e' cambiato.
+
+    None se il file manca o non si legge.
+    """
+    try:
+        return _get_kb_index(path)
+    except OSError:
+        with _LOCK:
+            _INDEXES.pop(path, None)
+        return None
+
+
+def _get_kb_index(path: str) -> KBIndex:
+    version = _file_version(path)
+    with _LOCK:
+        index = _INDEXES.get(path)
+        if index is not None and index.version == version:
+            return index
+        index = _load_persisted(path, version)
+        if index is None:
+            with open(path, "r", encoding="utf-8") as f:
+                index = KBIndex.build(f.read(), version)
+            _persist(path, index)
+        _INDEXES[path] = index
+        return index
+
+
+def retrieve_kb(path: str, query: str, k: int = KB_TOP_K) -> List[str]:
+    """I `k` chunk della KB piu' rilevanti per `query`, in ordine di documento."""
+    index = get_kb_index(path)
+    if index is None:
+        return []
+    hits = sorted(doc for _, doc in index.search(query, k))
+    return [index.chunks[doc] for doc in hits]
@@ -0,0 +1,134 @@
+"""
+Compilazione (con cache) del system prompt degli esperti.
+
+Il system prompt di un esperto e' il template in `prompt_file` (con
+{{LANGUAGE}} e i placeholder dei `settings`), seguito dalla knowledge base
+in `kb_file`; i placeholder non valorizzati spariscono. Invece di rileggere
+i file e fare una replace per placeholder a ogni rerun:
+
+- ogni file e' letto e diviso in segmenti (testo / placeholder) una volta,
+  finche' mtime e dimensione non cambiano;
+- il prompt finale e' in cache per (expert_id, lingua, settings, file): una
+  modifica sotto prompts/ o data/ cambia l'mtime e invalida la voce, quindi
+  l'hot-reload senza riavvio continua a funzionare.
+
+Con `"kb_mode": "retrieval"` la KB resta fuori (include_kb=False) e
+with_kb_chunks() accoda solo i chunk recuperati da lib/llm/kb_index.py.
+"""
+
+from __future__ import annotations
+
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+PLACEHOLDER_RE = re.compile(r"\{\{.*?\}\}")
+LANGUAGE_NAMES = {"IT": "Italiano", "EN": "English"}
+KB_HEADER = "\n\nCONTEXT / KNOWLEDGE BASE:\n"
+KB_CHUNK_SEPARATOR = "\n\n---\n\n"
+MAX_COMPILED = 256
+
+# Segmento: (testo, None) oppure (None, nome del placeholder).
+Segment = Tuple[Optional[str], Optional[str]]
+
+_LOCK = threading.Lock()
+_TEMPLATES: Dict[str, Tuple[tuple, Tuple[Segment, ...]]] = {}
+_COMPILED: "OrderedDict[tuple, Tuple[tuple, str]]" = OrderedDict()
+
+
+def parse_template(text: str) -> Tuple[Segment, ...]:
+    """Divide il testo in segmenti; `{{NOME}}` diventa (None, "NOME")."""
+    segments = []
+    pos = 0
+    for m in PLACEHOLDER_RE.finditer(text):
+        if m.start() > pos:
+            segments.append((text[pos:m.start()], None))
+        segments.append((None, m.group()[2:-2]))
+        pos = m.end()
+    if pos < len(text):
+        segments.append((text[pos:], None))
+    return tuple(segments)
+
+
+def _file_version(path: Optional[str]) -> Optional[tuple]:
+    if not path:
+        return None
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _template(path: Optional[str], version: Optional[tuple]) -> Tuple[Segment, ...]:
+    """Segmenti del file, riletto solo se la versione (mtime, size) e' cambiata."""
+    if version is None:
+        return ()
+    with _LOCK:
+        cached = _TEMPLATES.get(path)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    with open(path, "r", encoding="utf-8") as f:
+        segments = parse_template(f.read())
+    with _LOCK:
+        _TEMPLATES[path] = (version, segments)
+    return segments
+
+
+def _render(segments: Tuple[Segment, ...], values: Dict[str, str]) -> str:
+    return "".join(text if name is None else values.get(name, "") for text, name in segments)
+
+
+def compile_system_prompt(
+    expert: dict, lang_code: str, settings: Optional[Dict[str, str]] = None, include_kb: bool = True
+) -> str:
+    """System prompt dell'esperto per lingua e valori dei settings ({key: valore}).
+
+    {{LANGUAGE}} vale solo nel prompt; i settings valgono anche nella KB.
+    `include_kb=False` esclude la knowledge base (es. se la si inietta a pezzi).
+    """
+    settings = settings or {}
+    prompt_file = expert.get("prompt_file")
+    kb_file = expert.get("kb_file") if include_kb else None
+    versions = (_file_version(prompt_file), _file_version(kb_file))
+    key = (expert.get("id"), lang_code, tuple(sorted(settings.items())), prompt_file, kb_file)
+
+    with _LOCK:
+        cached = _COMPILED.get(key)
+        if cached is not None and cached[0] == versions:
+            _COMPILED.move_to_end(key)
+            return cached[1]
+
+    # I valori dei settings non introducono nuovi placeholder.
+    values = {k: PLACEHOLDER_RE.sub("", str(v)) for k, v in settings.items()}
+    prompt = _render(
+        _template(prompt_file, versions[0]),
+        {**values, "LANGUAGE": LANGUAGE_NAMES.get(lang_code, LANGUAGE_NAMES["EN"])},
+    )
+    kb_segments = _template(kb_file, versions[1])
+    if kb_segments:
+        prompt += KB_HEADER + _render(kb_segments, values)
+
+    with _LOCK:
+        _COMPILED[key] = (versions, prompt)
+        _COMPILED.move_to_end(key)
+        while len(_COMPILED) > MAX_COMPILED:
+            _COMPILED.popitem(last=False)
+    return prompt
+
+
+def with_kb_chunks(system_prompt: str, chunks: List[str], settings: Optional[Dict[str, str]] = None) -> str:
+    """Accoda al prompt (compilato senza KB) i chunk recuperati, con i settings applicati."""
+    if not chunks:
+        return system_prompt
+    values = {k: PLACEHOLDER_RE.sub("", str(v)) for k, v in (settings or {}).items()}
+    rendered = [_render(parse_template(chunk), values) for chunk in chunks]
+    return system_prompt + KB_HEADER + KB_CHUNK_SEPARATOR.join(rendered)
+
+
+def clear_prompt_cache() -> None:
+    with _LOCK:
+        _TEMPLATES.clear()
+        _COMPILED.clear()
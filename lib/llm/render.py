@@ -0,0 +1,100 @@
+"""
+Rendering a cadenza delle risposte in streaming.
+
+Aggiornare il placeholder a ogni token ri-invia (e ri-renderizza) l'intera
+risposta che cresce: byte quadratici sul websocket e CPU sprecata sul
+server. StreamRenderer accumula i chunk in una lista e aggiorna il
+placeholder al piu' ogni `interval_s` secondi, oppure subito quando il testo
+in arrivo chiude un paragrafo; close() fa il flush finale.
+
+Per ogni risposta registra chunk ricevuti e aggiornamenti UI effettivi
+(recent_renders()), cosi' il risparmio si verifica sui numeri.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, List
+
+FLUSH_INTERVAL_S = 0.08
+PARAGRAPH_BREAK = "\n\n"
+RENDERS_BUFFER = 500
+
+_RENDERS_LOCK = threading.Lock()
+_RENDERS: deque = deque(maxlen=RENDERS_BUFFER)
+
+
+def recent_renders() -> List[dict]:
+    """Statistiche delle ultime risposte renderizzate dal processo."""
+    with _RENDERS_LOCK:
+        return list(_RENDERS)
+
+
+class StreamRenderer:
+    """Scrive su un placeholder Streamlit (st.empty()) a cadenza limitata.
+
+    `labels` (es. provider, model) finiscono nelle statistiche della risposta.
+    """
+
+    def __init__(
+        self,
+        placeholder: Any,
+        interval_s: float = FLUSH_INTERVAL_S,
+        clock: Callable[[], float] = time.monotonic,
+        **labels: Any,
+    ):
+        self.placeholder = placeholder
+        self.interval_s = interval_s
+        self.labels = labels
+        self._clock = clock
+        self._parts: List[str] = []
+        self._rendered = 0          # parti gia' mostrate
+        self._last_flush = clock()
+        self._started = self._last_flush
+        self._closed = False
+        self.chunks = 0
+        self.updates = 0
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    def write(self, chunk: str) -> None:
+        if not chunk:
+            return
+        # L'ultimo carattere del chunk precedente: "\n" + "\n" chiude un paragrafo.
+        tail = self._parts[-1][-1:] if self._parts else ""
+        self._parts.append(chunk)
+        self.chunks += 1
+        if PARAGRAPH_BREAK in tail + chunk or self._clock() - self._last_flush >= self.interval_s:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._rendered == len(self._parts):
+            return
+        self.placeholder.markdown(self.text)
+        self._rendered = len(self._parts)
+        self._last_flush = self._clock()
+        self.updates += 1
+
+    def close(self) -> str:
+        """Flush finale e registrazione delle statistiche; restituisce il testo completo."""
+        self.flush()
+        if not self._closed:
+            self._closed = True
+            text = self.text
+            with _RENDERS_LOCK:
+                _RENDERS.append({
+                    "ts": time.time(),
+                    **self.labels,
+                    "chunks": self.chunks,
+                    "updates": self.updates,
+                    "chars": len(text),
+                    "duration_s": self._clock() - self._started,
+                })
+        return self.text
+
+    def stats(self) -> dict:
+        return {"chunks": self.chunks, "updates": self.updates, "chars": len(self.text)}
@@ -0,0 +1,189 @@
+"""
+Tracciamento live dei sondaggi dei cubi a partire dagli update Telegram.
+
+PollTracker riceve uno stream di update (UpdateMessagePoll, o qualunque
+oggetto con `poll_id` e `results`) e, quando i conteggi di un sondaggio
+tracciato cambiano, rilegge solo le opzioni cambiate (refresh incrementale)
+e passa il risultato a chi lo scrive su Firestore.
+
+Non conosce ne' Telethon ne' Firestore: le due dipendenze sono iniettate,
+cosi' si puo' pilotare con uno stream finto:
+
+    async def fetch_delta(poll: TrackedPoll) -> dict   # output di get_poll_voters_delta
+    async def apply_delta(poll: TrackedPoll, delta: dict) -> None
+
+Politiche:
+- debounce: un burst di update dello stesso sondaggio produce un solo refresh;
+- risincronizzazione periodica: Telegram non garantisce la consegna degli
+  update (es. supergruppi non aperti di recente), quindi ogni
+  `resync_interval_s` tutti i sondaggi vengono ricontrollati (una RPC
+  ciascuno se nulla e' cambiato).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Any, AsyncIterable, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class TrackedPoll:
+    event_id: str
+    chat_ref: str
+    msg_id: int
+    # Noti dopo il primo refresh (o dal documento evento).
+    poll_id: Optional[int] = None
+    counts: Optional[dict] = None
+    # Firma dei risultati dell'ultimo update visto, per scartare i duplicati.
+    last_signature: Optional[Tuple] = None
+
+
+def results_signature(results: Any) -> Optional[Tuple]:
+    """Firma confrontabile dei risultati di un sondaggio, None se non disponibili."""
+    answer_results = getattr(results, "results", None) if results is not None else None
+    if answer_results is None or getattr(results, "min", False):
+        return None
+    return (
+        getattr(results, "total_voters", None),
+        tuple(sorted((bytes(r.option), getattr(r, "voters", 0) or 0) for r in answer_results)),
+    )
+
+
+class PollTracker:
+    """Tiene aggiornati i sondaggi di un organizer a partire da uno stream di update."""
+
+    def __init__(
+        self,
+        fetch_delta: Callable[[TrackedPoll], Awaitable[dict]],
+        apply_delta: Callable[[TrackedPoll, dict], Awaitable[None]],
+        *,
+        debounce_s: float = 2.0,
+        resync_interval_s: float = 900.0,
+        max_concurrent_refreshes: int = 2,
+    ):
+        self._fetch_delta = fetch_delta
+        self._apply_delta = apply_delta
+        self.debounce_s = debounce_s
+        self.resync_interval_s = resync_interval_s
+        self._polls: Dict[str, TrackedPoll] = {}
+        # Refresh schedulati ma non ancora partiti, per evento (debounce).
+        self._pending: Dict[str, asyncio.Task] = {}
+        self._tasks: set = set()
+        self._max_concurrent = max(1, max_concurrent_refreshes)
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._running = False
+        self.stats = {"updates": 0, "ignored": 0, "refreshes": 0, "applied": 0, "errors": 0}
+
+    # -- insieme dei sondaggi tracciati -------------------------------------
+
+    def tracked(self) -> Dict[str, TrackedPoll]:
+        return dict(self._polls)
+
+    def track(self, poll: TrackedPoll) -> None:
+        """Aggiunge (o sostituisce) un sondaggio; se il tracker gira, lo allinea subito."""
+        old = self._polls.get(poll.event_id)
+        if old is not None and (old.chat_ref, old.msg_id) == (poll.chat_ref, poll.msg_id):
+            return
+        self._polls[poll.event_id] = poll
+        if self._running:
+            self._schedule(poll.event_id, delay=0.0)
+
+    def untrack(self, event_id: str) -> None:
+        self._polls.pop(event_id, None)
+        task = self._pending.pop(event_id, None)
+        if task is not None:
+            task.cancel()
+
+    def sync(self, polls: Iterable[TrackedPoll]) -> None:
+        """Allinea i sondaggi tracciati a `polls` (aggiunge i nuovi, rimuove gli assenti)."""
+        wanted = {p.event_id: p for p in polls}
+        for event_id in list(self._polls):
+            if event_id not in wanted:
+                self.untrack(event_id)
+        for poll in wanted.values():
+            self.track(poll)
+
+    # -- ciclo principale ---------------------------------------------------
+
+    async def run(self, updates: AsyncIterable[Any]) -> None:
+        """Consuma lo stream di update finche' non termina (o il task viene cancellato)."""
+        self._running = True
+        self._semaphore = asyncio.Semaphore(self._max_concurrent)
+        resync = asyncio.ensure_future(self._resync_forever())
+        try:
+            async for update in updates:
+                self.handle_update(update)
+        finally:
+            self._running = False
+            resync.cancel()
+            tasks = list(self._tasks)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(resync, *tasks, return_exceptions=True)
+            self._pending.clear()
+
+    def handle_update(self, update: Any) -> None:
+        """Smista un update: se riguarda un sondaggio tracciato e cambia i conteggi, schedula un refresh."""
+        self.stats["updates"] += 1
+        poll_id = getattr(update, "poll_id", None)
+        poll = next((p for p in self._polls.values() if p.poll_id == poll_id), None)
+        if poll is None:
+            self.stats["ignored"] += 1
+            return
+        signature = results_signature(getattr(update, "results", None))
+        if signature is not None and signature == poll.last_signature:
+            self.stats["ignored"] += 1
+            return
+        poll.last_signature = signature
+        self._schedule(poll.event_id, delay=self.debounce_s)
+
+    async def refresh(self, event_id: str) -> Optional[dict]:
+        """Refresh incrementale di un sondaggio; applica il delta se qualcosa e' cambiato."""
+        poll = self._polls.get(event_id)
+        if poll is None:
+            return None
+        self.stats["refreshes"] += 1
+        delta = await self._fetch_delta(poll)
+        first = poll.poll_id is None
+        poll.poll_id = delta.get("poll_id", poll.poll_id)
+        changed = bool(delta.get("changed_options")) or delta.get("option_counts") != poll.counts
+        poll.counts = delta.get("option_counts") or None
+        if changed or first:
+            await self._apply_delta(poll, delta)
+            self.stats["applied"] += 1
+        return delta
+
+    # -- interni ------------------------------------------------------------
+
+    def _schedule(self, event_id: str, delay: float) -> None:
+        task = self._pending.get(event_id)
+        if task is not None and not task.done():
+            return  # gia' in coda: il refresh coprira' anche questo update
+        task = asyncio.ensure_future(self._delayed_refresh(event_id, delay))
+        self._pending[event_id] = task
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _delayed_refresh(self, event_id: str, delay: float) -> None:
+        try:
+            if delay:
+                await asyncio.sleep(delay)
+            # Da qui in poi nuovi update schedulano un altro refresh.
+            self._pending.pop(event_id, None)
+            async with self._semaphore:
+                await self.refresh(event_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.stats["errors"] += 1
+            logger.exception("Refresh del sondaggio per l'evento %s fallito", event_id)
+
+    async def _resync_forever(self) -> None:
+        while True:
+            for event_id in list(self._polls):
+                self._schedule(event_id, delay=0.0)
+            await asyncio.sleep(self.resync_interval_s)
@@ -0,0 +1,159 @@
+"""
+Pianificazione dei refresh periodici dei cubi attivi (worker.py scheduler).
+
+Alternativa (o complemento) al tracking via update: ogni cubo attivo viene
+riletto a intervalli che dipendono da quanto e' vicino l'evento, con jitter
+per non allineare le richieste e un budget di richieste per account Telegram.
+
+Lo stato di pianificazione e' persistito nel documento evento, campo
+`refresh_schedule`, cosi' un riavvio riprende dalle scadenze salvate invece
+di rileggere tutto insieme:
+
+    refresh_schedule: {
+      "next_due": datetime UTC,
+      "last_run": datetime UTC,
+      "failures": int,            # fallimenti consecutivi (backoff esponenziale)
+      "last_error": str | None,
+      "poll_closed": bool,        # il sondaggio Telegram e' chiuso
+    }
+
+Qui solo logica pura (niente Telethon ne' Firestore): politiche di intervallo,
+scadenze e budget per account.
+"""
+
+from __future__ import annotations
+
+import random
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Callable, Dict, Optional
+from zoneinfo import ZoneInfo
+
+EVENT_TIMEZONE = ZoneInfo("Europe/Rome")
+
+# Intervalli di refresh in secondi, in funzione della distanza dall'evento.
+INTERVAL_SOON_S = 10 * 60          # entro 48 ore
+INTERVAL_WEEK_S = 30 * 60          # entro 7 giorni
+INTERVAL_MONTH_S = 2 * 60 * 60     # entro 30 giorni
+INTERVAL_FAR_S = 6 * 60 * 60       # oltre, o sondaggio chiuso
+INTERVAL_PAST_S = 12 * 60 * 60     # evento gia' passato
+MAX_BACKOFF_S = 6 * 60 * 60
+JITTER = 0.2                       # +/- 20% sull'intervallo
+
+
+def event_start(ev: dict) -> Optional[datetime]:
+    """Data/ora di inizio del cubo (campi "data" YYYY-MM-DD e "ora" HH:MM), timezone Europe/Rome."""
+    try:
+        day = date.fromisoformat(ev.get("data") or "")
+    except (TypeError, ValueError):
+        return None
+    start = datetime(day.year, day.month, day.day, tzinfo=EVENT_TIMEZONE)
+    if ev.get("ora"):
+        # Ora malformata o fuori range (es. "25:00"): si tiene la mezzanotte.
+        try:
+            hour, minute = (int(x) for x in str(ev["ora"]).split(":")[:2])
+            start = start.replace(hour=hour, minute=minute)
+        except ValueError:
+            pass
+    return start
+
+
+def refresh_interval_s(ev: dict, now: datetime) -> float:
+    """Intervallo base fra due refresh di un cubo, prima di jitter e backoff."""
+    state = ev.get("refresh_schedule") or {}
+    start = event_start(ev)
+    if start is None:
+        return INTERVAL_FAR_S
+    until = start - now
+    if until < -timedelta(hours=6):
+        return INTERVAL_PAST_S
+    if state.get("poll_closed"):
+        return INTERVAL_FAR_S
+    if until <= timedelta(hours=48):
+        return INTERVAL_SOON_S
+    if until <= timedelta(days=7):
+        return INTERVAL_WEEK_S
+    if until <= timedelta(days=30):
+        return INTERVAL_MONTH_S
+    return INTERVAL_FAR_S
+
+
+def with_jitter(seconds: float, rng: Callable[[], float] = random.random) -> float:
+    return seconds * (1 - JITTER + 2 * JITTER * rng())
+
+
+def next_due_after_success(ev: dict, now: datetime, rng: Callable[[], float] = random.random) -> datetime:
+    return now + timedelta(seconds=with_jitter(refresh_interval_s(ev, now), rng))
+
+
+def next_due_after_failure(
+    ev: dict, now: datetime, failures: int, rng: Callable[[], float] = random.random
+) -> datetime:
+    """Backoff esponenziale sull'intervallo base, con tetto MAX_BACKOFF_S."""
+    base = refresh_interval_s(ev, now)
+    backoff = min(MAX_BACKOFF_S, base * (2 ** max(0, failures - 1)))
+    return now + timedelta(seconds=with_jitter(backoff, rng))
+
+
+def initial_due(ev: dict, now: datetime, rng: Callable[[], float] = random.random) -> datetime:
+    """Scadenza per un cubo mai pianificato: sparsa nel primo intervallo, per non partire tutti insieme."""
+    return now + timedelta(seconds=refresh_interval_s(ev, now) * rng())
+
+
+def due_at(ev: dict, now: datetime, rng: Callable[[], float] = random.random) -> datetime:
+    """Prossima scadenza persistita, o una iniziale se il cubo non e' mai stato pianificato."""
+    next_due = (ev.get("refresh_schedule") or {}).get("next_due")
+    if isinstance(next_due, datetime):
+        return next_due if next_due.tzinfo else next_due.replace(tzinfo=timezone.utc)
+    return initial_due(ev, now, rng)
+
+
+class AccountBudget:
+    """Budget di richieste Telegram per account: token bucket che puo' andare in debito.
+
+    Il costo di un refresh si conosce solo a posteriori (1 lettura del
+    messaggio + le pagine delle opzioni cambiate): si addebita dopo, e un
+    saldo negativo ritarda i refresh successivi dello stesso account.
+    """
+
+    def __init__(self, per_minute: float, burst: Optional[float] = None, clock: Callable[[], float] = time.monotonic):
+        self.rate = per_minute / 60.0
+        self.capacity = burst if burst is not None else per_minute
+        self._clock = clock
+        self._tokens = self.capacity
+        self._stamp = clock()
+        self._blocked_until = 0.0
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def available(self) -> bool:
+        self._refill()
+        return self._clock() >= self._blocked_until and self._tokens >= 1
+
+    def charge(self, cost: float) -> None:
+        self._refill()
+        self._tokens -= cost
+
+    def block_for(self, seconds: float) -> None:
+        """Sospende l'account (es. dopo un FloodWait) per `seconds`."""
+        self._blocked_until = max(self._blocked_until, self._clock() + seconds)
+
+    def snapshot(self) -> Dict[str, float]:
+        self._refill()
+        return {
+            "tokens": round(self._tokens, 2),
+            "blocked_for_s": max(0.0, round(self._blocked_until - self._clock(), 1)),
+        }
+
+
+def refresh_cost(delta: dict, page_size: int = 50) -> int:
+    """Richieste Telegram spese da un refresh incrementale (output di get_poll_voters_delta)."""
+    cost = 1
+    for opt in delta.get("changed_options", []):
+        n = opt.get("voter_count", 0)
+        if n:
+            cost += -(-n // page_size)
+    return cost
@@ -0,0 +1,367 @@
+"""
+Job di invio reminder (collezione Firestore `reminder_jobs`).
+
+La pagina "Gestione Cubi" non invia i DM nel thread dello script Streamlit:
+crea un job con destinatari e testi gia' renderizzati, lo avvia sul loop del
+pool Telegram (start_reminder_job) e ne mostra l'avanzamento rileggendo il
+documento. Se il processo muore a meta', il job viene ripreso dal worker
+(`python worker.py reminders`) o dalla pagina alla visita successiva.
+
+Documento job:
+
+    {
+      "organizer_email", "event_id",
+      "status": "queued" | "running" | "done" | "failed" | "cancelled",
+      "items": [{"email", "nome", "cognome", "username", "user_id", "text"}],
+      "cursor": int,                 # prossimo item da elaborare
+      "results": {"<idx>": {...}},   # esito per item (forma di send_dm)
+      "ok": int, "fail": int,
+      "lease_owner": str | None,     # chi lo sta eseguendo...
+      "lease_until": datetime,       # ...e fino a quando (rinnovato a ogni item)
+      "not_before": datetime | None, # ripresa dopo un FloodWait lungo
+      "paused_s": int | None,        # FloodWait breve in corso
+      "error": str | None,
+      "created_at", "updated_at", "finished_at",
+    }
+
+Al piu' un invio per destinatario: prima di ogni DM viene creato in
+`reminder_log` il documento `{job_id}-{idx}` con status "sending" (create
+fallisce se esiste gia'). Alla ripresa un item con il log gia' presente non
+viene rinviato; se il log e' rimasto a "sending" l'esito e' incerto e l'item
+viene registrato come "interrupted". Un errore prima dell'invio (connessione,
+sessione, risoluzione del destinatario, FloodWait) cancella il log: l'item
+non e' partito e alla ripresa viene ritentato.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from firebase_admin import firestore
+from google.api_core.exceptions import Conflict, NotFound
+from telethon.errors import FloodWaitError, PeerFloodError
+
+from lib.cube_events import EVENTS_COLLECTION
+from lib.telegram_client import get_client_pool, send_dm_async
+
+logger = logging.getLogger(__name__)
+
+REMINDER_JOBS_COLLECTION = "reminder_jobs"
+REMINDER_LOG_COLLECTION = "reminder_log"
+
+ACTIVE_STATUSES = ("queued", "running")
+# Un job il cui esecutore non rinnova il lease entro questo tempo e' considerato
+# abbandonato e puo' essere ripreso da un altro processo. Il lease si rinnova a
+# ogni destinatario e si allunga durante le pause per FloodWait.
+JOB_LEASE_S = 120
+
+PEER_FLOOD_MESSAGE = (
+    "Telegram ha temporaneamente bloccato il tuo account dall'invio di DM verso "
+    "non-contatti (protezione anti-spam). Attendi qualche ora prima di riprovare, "
+    "oppure aggiungi i destinatari ai tuoi contatti Telegram."
+)
+
+
+def new_owner_id() -> str:
+    """Identificativo dell'esecutore (host, pid, random) per il lease."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+def _as_utc(value) -> Optional[datetime]:
+    if not isinstance(value, datetime):
+        return None
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def is_claimable(job: dict, now: datetime) -> bool:
+    """True se il job e' da eseguire e nessuno lo sta eseguendo."""
+    if job.get("status") not in ACTIVE_STATUSES:
+        return False
+    not_before = _as_utc(job.get("not_before"))
+    if not_before is not None and not_before > now:
+        return False
+    lease_until = _as_utc(job.get("lease_until"))
+    return not job.get("lease_owner") or lease_until is None or lease_until <= now
+
+
+# ---------------------------------------------------------------------------
+# API per la pagina
+# ---------------------------------------------------------------------------
+
+def enqueue_reminder_job(
+    db, organizer_email: str, event_id: str, items: List[dict], job_id: Optional[str] = None
+) -> str:
+    """Crea il job e lo collega all'evento (campo `active_reminder_job`). Ritorna l'id.
+
+    Con `job_id` esplicito il job viene creato solo se non esiste gia'
+    (altrimenti Conflict): cosi' i reminder programmati non generano mai due
+    job per la stessa programmazione.
+    """
+    job_ref = db.collection(REMINDER_JOBS_COLLECTION).document(job_id)
+    now = firestore.SERVER_TIMESTAMP
+    batch = db.batch()
+    (batch.create if job_id else batch.set)(job_ref, {
+        "organizer_email": organizer_email,
+        "event_id": event_id,
+        "status": "queued",
+        "items": items,
+        "cursor": 0,
+        "results": {},
+        "ok": 0,
+        "fail": 0,
+        "lease_owner": None,
+        "lease_until": None,
+        "not_before": None,
+        "paused_s": None,
+        "error": None,
+        "created_at": now,
+        "updated_at": now,
+        "finished_at": None,
+    })
+    batch.update(db.collection(EVENTS_COLLECTION).document(event_id), {"active_reminder_job": job_ref.id})
+    batch.commit()
+    return job_ref.id
+
+
+def load_job(db, job_id: str) -> Optional[dict]:
+    snap = db.collection(REMINDER_JOBS_COLLECTION).document(job_id).get()
+    if not snap.exists:
+        return None
+    return {"id": snap.id, **snap.to_dict()}
+
+
+def cancel_reminder_job(db, job_id: str, event_id: str) -> None:
+    """Ferma il job: l'esecutore se ne accorge prima del destinatario successivo."""
+    batch = db.batch()
+    batch.update(db.collection(REMINDER_JOBS_COLLECTION).document(job_id), {
+        "status": "cancelled",
+        "updated_at": firestore.SERVER_TIMESTAMP,
+    })
+    batch.update(db.collection(EVENTS_COLLECTION).document(event_id), {
+        "active_reminder_job": firestore.DELETE_FIELD,
+    })
+    batch.commit()
+
+
+def start_reminder_job(db, job_id: str, session_string: str):
+    """Avvia (o riprende) il job sul loop del pool, senza attenderlo.
+
+    Se un altro processo lo sta gia' eseguendo, il lease lo impedisce e il
+    task termina subito.
+    """
+    return get_client_pool().submit(run_reminder_job(db, job_id, session_string))
+
+
+def active_jobs(db) -> List[dict]:
+    """Job in coda o in esecuzione (per il worker)."""
+    query = db.collection(REMINDER_JOBS_COLLECTION).where("status", "in", list(ACTIVE_STATUSES))
+    return [{"id": snap.id, **snap.to_dict()} for snap in query.stream()]
+
+
+# ---------------------------------------------------------------------------
+# Esecuzione
+# ---------------------------------------------------------------------------
+
+def _claim(db, job_id: str, owner: str, lease_s: float) -> Optional[dict]:
+    """Prende il lease del job in transazione. Ritorna il job, o None se non disponibile."""
+    job_ref = db.collection(REMINDER_JOBS_COLLECTION).document(job_id)
+
+    @firestore.transactional
+    def _txn(transaction):
+        snap = job_ref.get(transaction=transaction)
+        if not snap.exists:
+            return None
+        job = snap.to_dict()
+        now = datetime.now(timezone.utc)
+        if not is_claimable(job, now):
+            return None
+        transaction.update(job_ref, {
+            "status": "running",
+            "lease_owner": owner,
+            "lease_until": now + timedelta(seconds=lease_s),
+            "not_before": None,
+            "updated_at": firestore.SERVER_TIMESTAMP,
+        })
+        return {"id": job_id, **job}
+
+    return _txn(db.transaction())
+
+
+def _still_owned(db, job_id: str, owner: str) -> bool:
+    """False se il job e' stato annullato o se il lease e' passato a un altro processo."""
+    snap = db.collection(REMINDER_JOBS_COLLECTION).document(job_id).get()
+    job = snap.to_dict() or {}
+    return job.get("status") == "running" and job.get("lease_owner") == owner
+
+
+def _begin_item(db, job: dict, idx: int) -> Optional[dict]:
+    """Marca l'item come "in invio"; se era gia' stato tentato ritorna l'esito registrato."""
+    log_ref = db.collection(REMINDER_LOG_COLLECTION).document(f"{job['id']}-{idx}")
+    item = job["items"][idx]
+    try:
+        log_ref.create({
+            "job_id": job["id"],
+            "event_id": job["event_id"],
+            "organizer_email": job["organizer_email"],
+            "to_email": item["email"],
+            "to_username": item.get("username"),
+            "to_telegram_user_id": item.get("user_id"),
+            "status": "sending",
+            "error": None,
+            "sent_at": firestore.SERVER_TIMESTAMP,
+        })
+        return None
+    except Conflict:
+        prev = log_ref.get().to_dict() or {}
+    if prev.get("status") == "ok":
+        return {"ok": True, "error": None, "fallback_link": prev.get("fallback_link")}
+    if prev.get("status") == "fail":
+        return {"ok": False, "error": prev.get("error"), "fallback_link": prev.get("fallback_link")}
+    # Crash fra create e registrazione dell'esito: il DM potrebbe essere partito.
+    return {"ok": False, "error": "interrupted", "fallback_link": None}
+
+
+def _record_item(db, job: dict, idx: int, res: dict, owner: str, lease_s: float) -> None:
+    """Scrive esito dell'item, avanzamento del job e reminders_sent dell'evento in un batch."""
+    item = job["items"][idx]
+    now = firestore.SERVER_TIMESTAMP
+    entry = {
+        "sent_at": now,
+        "status": "ok" if res.get("ok") else "fail",
+        "error": res.get("error"),
+        "fallback_link": res.get("fallback_link"),
+    }
+    batch = db.batch()
+    batch.set(db.collection(REMINDER_LOG_COLLECTION).document(f"{job['id']}-{idx}"), {
+        "job_id": job["id"],
+        "event_id": job["event_id"],
+        "organizer_email": job["organizer_email"],
+        "to_email": item["email"],
+        "to_username": item.get("username") or res.get("username"),
+        "to_telegram_user_id": res.get("user_id") or item.get("user_id"),
+        **entry,
+    })
+    batch.update(db.collection(REMINDER_JOBS_COLLECTION).document(job["id"]), {
+        "cursor": idx + 1,
+        f"results.{idx}": {
+            "ok": bool(res.get("ok")),
+            "error": res.get("error"),
+            "fallback_link": res.get("fallback_link"),
+            "username": item.get("username") or res.get("username"),
+            "user_id": res.get("user_id") or item.get("user_id"),
+        },
+        ("ok" if res.get("ok") else "fail"): firestore.Increment(1),
+        "lease_until": datetime.now(timezone.utc) + timedelta(seconds=lease_s),
+        "paused_s": None,
+        "updated_at": now,
+    })
+    batch.update(db.collection(EVENTS_COLLECTION).document(job["event_id"]), {
+        firestore.FieldPath("reminders_sent", item["email"]).to_api_repr(): entry,
+        "updated_at": now,
+    })
+    batch.commit()
+
+
+def _finish(db, job: dict, update: dict) -> None:
+    db.collection(REMINDER_JOBS_COLLECTION).document(job["id"]).update({
+        "lease_owner": None,
+        "lease_until": None,
+        "paused_s": None,
+        "updated_at": firestore.SERVER_TIMESTAMP,
+        **update,
+    })
+    if update.get("status") in ACTIVE_STATUSES:
+        return
+    try:
+        db.collection(EVENTS_COLLECTION).document(job["event_id"]).update({
+            "active_reminder_job": firestore.DELETE_FIELD,
+        })
+    except NotFound:
+        pass
+
+
+async def run_reminder_job(
+    db, job_id: str, session_string: str, owner: Optional[str] = None, lease_s: float = JOB_LEASE_S
+) -> Optional[str]:
+    """Esegue il job dal cursore in poi. Ritorna lo stato finale, None se non preso in carico.
+
+    Va eseguita sul loop del pool; le chiamate Firestore girano nel thread
+    executor per non bloccare gli altri client.
+    """
+    loop = asyncio.get_running_loop()
+
+    def _in_thread(fn, *args):
+        return loop.run_in_executor(None, fn, *args)
+
+    owner = owner or new_owner_id()
+    job = await _in_thread(_claim, db, job_id, owner, lease_s)
+    if job is None:
+        return None
+    job_ref = db.collection(REMINDER_JOBS_COLLECTION).document(job_id)
+
+    def _on_pause(seconds: int) -> None:
+        future = _in_thread(job_ref.update, {
+            "paused_s": seconds,
+            "lease_until": datetime.now(timezone.utc) + timedelta(seconds=seconds + lease_s),
+            "updated_at": firestore.SERVER_TIMESTAMP,
+        })
+        future.add_done_callback(lambda f: f.exception())
+
+    items = job.get("items", [])
+    try:
+        for idx in range(int(job.get("cursor", 0)), len(items)):
+            if idx > int(job.get("cursor", 0)) and not await _in_thread(_still_owned, db, job_id, owner):
+                # Annullato dalla pagina (che scollega anche l'evento), o lease
+                # passato a un altro processo: in entrambi i casi ci si ferma qui.
+                return "cancelled"
+            res = await _in_thread(_begin_item, db, job, idx)
+            if res is None:
+                item = items[idx]
+                log_ref = db.collection(REMINDER_LOG_COLLECTION).document(f"{job_id}-{idx}")
+                try:
+                    res = await send_dm_async(
+                        session_string, item.get("user_id") or item.get("username"), item["text"],
+                        on_pause=_on_pause,
+                    )
+                except PeerFloodError:
+                    res = {"ok": False, "error": "peer_flood", "fallback_link": None}
+                    await _in_thread(_record_item, db, job, idx, res, owner, lease_s)
+                    await _in_thread(_finish, db, job, {"status": "failed", "error": PEER_FLOOD_MESSAGE})
+                    return "failed"
+                except FloodWaitError as e:
+                    # Attesa troppo lunga per tenere il job in esecuzione: l'item
+                    # non e' partito, si libera il log e si riprende piu' tardi.
+                    await _in_thread(log_ref.delete)
+                    await _in_thread(_finish, db, job, {
+                        "status": "queued",
+                        "not_before": datetime.now(timezone.utc) + timedelta(seconds=e.seconds + 5),
+                        "error": f"Rate limit Telegram: ripresa fra {e.seconds}s.",
+                    })
+                    return "queued"
+                except Exception:
+                    # send_dm_async solleva altro solo prima dell'invio: il DM
+                    # non e' partito, l'item resta da ritentare alla ripresa.
+                    await _in_thread(log_ref.delete)
+                    raise
+            await _in_thread(_record_item, db, job, idx, res, owner, lease_s)
+    except NotFound:
+        # Evento cancellato durante l'invio.
+        await _in_thread(_finish, db, job, {"status": "cancelled", "error": "Evento eliminato."})
+        return "cancelled"
+    except Exception as e:
+        logger.exception("Job reminder %s fallito", job_id)
+        # Lease lasciato scadere: il job verra' ripreso (senza doppi invii).
+        await _in_thread(job_ref.update, {"error": str(e)[:300], "updated_at": firestore.SERVER_TIMESTAMP})
+        raise
+    await _in_thread(_finish, db, job, {
+        "status": "done",
+        "error": None,
+        "finished_at": firestore.SERVER_TIMESTAMP,
+    })
+    return "done"
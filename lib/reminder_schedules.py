@@ -0,0 +1,218 @@
+"""
+Reminder programmati (collezione Firestore `reminder_schedules`).
+
+Dalla pagina "Gestione Cubi" l'organizer programma l'invio automatico dei
+reminder a N ore dall'inizio del cubo (es. 48h e 6h prima). Ogni orario e' un
+documento:
+
+    {
+      "organizer_email", "event_id",
+      "offset_h": int,               # ore prima dell'inizio del cubo
+      "due_at": datetime UTC,        # inizio cubo (Europe/Rome) - offset_h
+      "template": str,               # placeholder come render_reminder_template
+      "include_maybe": bool,         # anche chi ha votato "Forse"
+      "status": "pending" | "sent" | "skipped" | "failed" | "cancelled",
+      "job_id": str | None,          # job di invio creato (lib/reminder_jobs.py)
+      "n_recipients": int | None,
+      "attempts": int,               # tentativi di refresh falliti
+      "error": str | None,
+      "created_at", "updated_at",
+    }
+
+I destinatari NON vengono fissati alla programmazione: il worker
+(`python worker.py reminders`) li calcola al momento dell'invio, dopo un
+refresh del sondaggio, e crea un job `sched-{id}` (create: mai due job per la
+stessa programmazione). Le scadenze si trovano con una query su
+status == "pending" e due_at <= ora, che richiede l'indice composito
+(status ASC, due_at ASC) su `reminder_schedules`.
+"""
+
+from __future__ import annotations
+
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from firebase_admin import firestore
+
+from lib.refresh_scheduler import event_start
+
+REMINDER_SCHEDULES_COLLECTION = "reminder_schedules"
+
+# Orari proposti nella pagina (ore prima del cubo) e default.
+OFFSET_CHOICES_H = [72, 48, 24, 12, 6, 2]
+DEFAULT_OFFSETS_H = [48, 6]
+
+# Refresh fallito prima dell'invio: si riprova dopo RETRY_DELAY_S, al piu'
+# MAX_ATTEMPTS volte, poi si invia con le partecipazioni gia' salvate.
+RETRY_DELAY_S = 5 * 60
+MAX_ATTEMPTS = 3
+
+
+def schedule_job_id(schedule_id: str) -> str:
+    return f"sched-{schedule_id}"
+
+
+def schedule_due_at(ev: dict, offset_h: float) -> Optional[datetime]:
+    """Scadenza (UTC) di un reminder `offset_h` ore prima del cubo; None senza data."""
+    start = event_start(ev)
+    if start is None:
+        return None
+    return (start - timedelta(hours=offset_h)).astimezone(timezone.utc)
+
+
+def split_due(schedules: Iterable[dict]) -> Tuple[List[dict], List[dict]]:
+    """Fra le programmazioni scadute, una sola per cubo: quella piu' vicina al cubo.
+
+    Se il worker e' rimasto fermo e sono scaduti sia il 48h che il 6h, si
+    manda solo il 6h. Ritorna (da inviare, superate).
+    """
+    best: Dict[str, dict] = {}
+    superseded = []
+    for sched in schedules:
+        prev = best.get(sched["event_id"])
+        if prev is None:
+            best[sched["event_id"]] = sched
+        elif sched.get("offset_h", 0) < prev.get("offset_h", 0):
+            superseded.append(prev)
+            best[sched["event_id"]] = sched
+        else:
+            superseded.append(sched)
+    return list(best.values()), superseded
+
+
+# ---------------------------------------------------------------------------
+# API per la pagina
+# ---------------------------------------------------------------------------
+
+def create_reminder_schedules(
+    db,
+    organizer_email: str,
+    event_id: str,
+    ev: dict,
+    offsets_h: Iterable[int],
+    template: str,
+    include_maybe: bool,
+    now: Optional[datetime] = None,
+) -> dict:
+    """Programma un reminder per ogni offset.
+
+    Ritorna {"created": [offset_h], "past": [offset_h]}: gli orari gia'
+    passati (o senza data del cubo) non vengono programmati.
+    """
+    now = now or datetime.now(timezone.utc)
+    col = db.collection(REMINDER_SCHEDULES_COLLECTION)
+    batch = db.batch()
+    created, past = [], []
+    for offset_h in sorted(set(offsets_h), reverse=True):
+        due = schedule_due_at(ev, offset_h)
+        if due is None or due <= now:
+            past.append(offset_h)
+            continue
+        batch.set(col.document(), {
+            "organizer_email": organizer_email,
+            "event_id": event_id,
+            "offset_h": offset_h,
+            "due_at": due,
+            "template": template,
+            "include_maybe": bool(include_maybe),
+            "status": "pending",
+            "job_id": None,
+            "n_recipients": None,
+            "attempts": 0,
+            "error": None,
+            "created_at": firestore.SERVER_TIMESTAMP,
+            "updated_at": firestore.SERVER_TIMESTAMP,
+        })
+        created.append(offset_h)
+    if created:
+        batch.commit()
+    return {"created": created, "past": past}
+
+
+def event_schedules(db, event_id: str) -> List[dict]:
+    """Programmazioni di un cubo, in ordine di scadenza."""
+    query = db.collection(REMINDER_SCHEDULES_COLLECTION).where("event_id", "==", event_id)
+    out = [{"id": snap.id, **snap.to_dict()} for snap in query.stream()]
+    out.sort(key=lambda s: -s.get("offset_h", 0))
+    return out
+
+
+def cancel_reminder_schedule(db, schedule_id: str) -> None:
+    db.collection(REMINDER_SCHEDULES_COLLECTION).document(schedule_id).update({
+        "status": "cancelled",
+        "updated_at": firestore.SERVER_TIMESTAMP,
+    })
+
+
+def _pending_for_event(db, event_id: str) -> List[dict]:
+    return [s for s in event_schedules(db, event_id) if s.get("status") == "pending"]
+
+
+def cancel_event_schedules(db, event_id: str) -> int:
+    """Annulla le programmazioni in attesa di un cubo (chiuso o eliminato)."""
+    pending = _pending_for_event(db, event_id)
+    if pending:
+        batch = db.batch()
+        for sched in pending:
+            batch.update(db.collection(REMINDER_SCHEDULES_COLLECTION).document(sched["id"]), {
+                "status": "cancelled",
+                "updated_at": firestore.SERVER_TIMESTAMP,
+            })
+        batch.commit()
+    return len(pending)
+
+
+def reschedule_event(db, event_id: str, ev: dict) -> int:
+    """Ricalcola due_at delle programmazioni in attesa dopo una modifica di data/ora.
+
+    Se il cubo non ha piu' una data le programmazioni vengono annullate.
+    """
+    pending = _pending_for_event(db, event_id)
+    if pending:
+        batch = db.batch()
+        for sched in pending:
+            due = schedule_due_at(ev, sched.get("offset_h", 0))
+            update = {"due_at": due, "updated_at": firestore.SERVER_TIMESTAMP}
+            if due is None:
+                update = {"status": "cancelled", "updated_at": firestore.SERVER_TIMESTAMP}
+            batch.update(db.collection(REMINDER_SCHEDULES_COLLECTION).document(sched["id"]), update)
+        batch.commit()
+    return len(pending)
+
+
+# ---------------------------------------------------------------------------
+# API per il worker
+# ---------------------------------------------------------------------------
+
+def due_schedules(db, now: datetime, limit: int = 50) -> List[dict]:
+    """Programmazioni scadute e non ancora eseguite (indice: status + due_at)."""
+    query = (
+        db.collection(REMINDER_SCHEDULES_COLLECTION)
+        .where("status", "==", "pending")
+        .where("due_at", "<=", now)
+        .order_by("due_at")
+        .limit(limit)
+    )
+    return [{"id": snap.id, **snap.to_dict()} for snap in query.stream()]
+
+
+def mark_schedule(db, schedule_id: str, status: str, fields: Optional[dict] = None) -> None:
+    db.collection(REMINDER_SCHEDULES_COLLECTION).document(schedule_id).update({
+        "status": status,
+        "updated_at": firestore.SERVER_TIMESTAMP,
+        **(fields or {}),
+    })
+
+
+def postpone_schedule(db, sched: dict, error: str, now: datetime, count_attempt: bool = True) -> bool:
+    """Riprova fra RETRY_DELAY_S. False se i tentativi (contati solo se `count_attempt`) sono finiti."""
+    attempts = int(sched.get("attempts", 0)) + (1 if count_attempt else 0)
+    if count_attempt and attempts >= MAX_ATTEMPTS:
+        return False
+    db.collection(REMINDER_SCHEDULES_COLLECTION).document(sched["id"]).update({
+        "attempts": attempts,
+        "due_at": now + timedelta(seconds=RETRY_DELAY_S),
+        "error": error[:300],
+        "updated_at": firestore.SERVER_TIMESTAMP,
+    })
+    return True
@@ -9,15 +9,24 @@ Responsabilita':
 - Invio DM reminder: send_dm (Fase 3).
 
 Convenzioni:
-- Non viene mantenuta nessuna istanza di TelegramClient cacheata fra rerun
-  Streamlit: ogni operazione apre un client fresco da StringSession e lo
-  chiude alla fine. Questo evita problemi con event loop chiusi.
-- Tutte le funzioni "pubbliche" hanno una versione sync che incapsula
-  asyncio.run(...) cosi' da poter essere chiamate direttamente dalle pagine
-  Streamlit (che sono sincrone).
+- Le operazioni post-login usano un pool process-wide di TelegramClient
+  (lib/telegram_pool.py): un client per sessione resta connesso e
+  autorizzato su un event loop dedicato in un thread daemon, cosi' il costo
+  dell'handshake MTProto si paga una volta sola e non a ogni chiamata.
+  I client del login wizard restano invece usa-e-getta.
+- Tutte le funzioni "pubbliche" hanno una versione sync che esegue la
+  coroutine sul loop del pool (_run) cosi' da poter essere chiamate
+  direttamente dalle pagine Streamlit (che sono sincrone).
 - I segreti vengono letti da st.secrets. Le funzioni che hanno bisogno
   di segreti li accettano comunque come parametri espliciti per facilitare
   i test.
+- Il cifrario Fernet e le session decifrate restano in memoria di processo
+  (LRU limitata, azzerata al logout): i rerun di Streamlit non ripetono la
+  decifratura.
+- Connessioni, richieste, retry e FloodWait vengono registrati da
+  lib/telegram_metrics.py (pagina admin "Metriche Telegram").
+- set_client_factory sostituisce i client Telethon (es. con il backend in
+  memoria di lib/telegram_fake.py) per test e benchmark offline.
 
 Secrets richiesti in .streamlit/secrets.toml:
 
@@ -33,12 +42,18 @@ Per generare TELEGRAM_SESSION_FERNET_KEY una volta sola:
 from __future__ import annotations
 
 import asyncio
+import contextvars
+import hashlib
 import re
-from typing import Any, List, Optional, Tuple, Union
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
 import streamlit as st
 from cryptography.fernet import Fernet, InvalidToken
-from telethon import TelegramClient
+from telethon import TelegramClient, events
 from telethon.errors import (
     ChannelPrivateError,
     FloodWaitError,
@@ -51,6 +66,7 @@ from telethon.errors import (
     PhoneNumberInvalidError,
     PollVoteRequiredError,
     SessionPasswordNeededError,
+    UnauthorizedError,
     UserIdInvalidError,
     UserIsBlockedError,
     UserPrivacyRestrictedError,
@@ -59,10 +75,39 @@ from telethon.errors import (
     YouBlockedUserError,
 )
 from telethon.sessions import StringSession
-from telethon.tl.functions.contacts import ResolvePhoneRequest
-from telethon.tl.functions.messages import GetPollVotesRequest
-from telethon.tl.types import MessageMediaPoll
-
+from telethon.tl.functions.contacts import ImportContactsRequest, ResolvePhoneRequest, ResolveUsernameRequest
+from telethon.tl.functions.messages import (
+    ForwardMessagesRequest,
+    GetPollVotesRequest,
+    SendMediaRequest,
+    SendMessageRequest,
+)
+from telethon.tl.functions.updates import GetStateRequest
+from telethon.tl.types import (
+    Channel,
+    Chat,
+    ChatPhotoEmpty,
+    InputMessagesFilterPoll,
+    MessageMediaPoll,
+    PeerChannel,
+    PeerUser,
+    UpdateMessagePoll,
+    User,
+)
+from telethon.utils import get_peer_id, resolve_id
+
+from lib import telegram_metrics
+from lib import telegram_rate as rate
+from lib.telegram_entities import EntityStore
+from lib.telegram_groups import (
+    GROUP_INDEX_FULL_TTL_S,
+    GROUP_INDEX_TTL_S,
+    apply_group_sync,
+    needs_full_sync,
+    needs_sync,
+)
+from lib.telegram_pool import DISCARD_ERRORS, TelegramClientPool, session_fingerprint
+from lib.telegram_rate import FloodStore, RateGovernor
 
 # ---------------------------------------------------------------------------
 # Tipi / Exceptions
@@ -174,7 +219,16 @@ def get_api_credentials() -> Tuple[int, str]:
     return api_id, api_hash
 
 
+# Il cifrario si costruisce una volta per processo: la chiave non cambia mai
+# dopo il primo deploy (vedi docstring del modulo).
+_FERNET: Optional[Fernet] = None
+_FERNET_LOCK = threading.Lock()
+
+
 def _get_fernet() -> Fernet:
+    global _FERNET
+    if _FERNET is not None:
+        return _FERNET
     try:
         key = st.secrets["TELEGRAM_SESSION_FERNET_KEY"]
     except (KeyError, FileNotFoundError) as e:
@@ -184,9 +238,13 @@ def _get_fernet() -> Fernet:
     if isinstance(key, str):
         key = key.encode("utf-8")
     try:
-        return Fernet(key)
+        fernet = Fernet(key)
     except Exception as e:
         raise TelegramConfigError("TELEGRAM_SESSION_FERNET_KEY non valido (deve essere una chiave Fernet base64 a 44 caratteri).") from e
+    with _FERNET_LOCK:
+        if _FERNET is None:
+            _FERNET = fernet
+        return _FERNET
 
 
 def is_telegram_configured() -> bool:
@@ -210,11 +268,57 @@ def encrypt_session(session_string: str) -> str:
     return _get_fernet().encrypt(session_string.encode("utf-8")).decode("utf-8")
 
 
+# Session decifrate, per hash del token: ogni rerun di Streamlit rilegge il
+# token da Firestore, la decifratura (e la verifica HMAC) si paga una volta.
+# Il testo in chiaro e' tenuto in un bytearray e azzerato quando esce dalla
+# cache (LRU o forget_decrypted_session); le str gia' restituite ai chiamanti
+# restano a carico del garbage collector.
+DECRYPTED_SESSIONS_MAX = 32
+
+_DECRYPTED_LOCK = threading.Lock()
+_DECRYPTED_SESSIONS: "OrderedDict[str, bytearray]" = OrderedDict()
+
+
+def _token_key(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def _wipe(buf: bytearray) -> None:
+    for i in range(len(buf)):
+        buf[i] = 0
+
+
 def decrypt_session(token: str) -> str:
     """Decifra una stringa salvata con encrypt_session(). Lancia InvalidToken se corrotta."""
     if not token:
         return ""
-    return _get_fernet().decrypt(token.encode("utf-8")).decode("utf-8")
+    key = _token_key(token)
+    with _DECRYPTED_LOCK:
+        buf = _DECRYPTED_SESSIONS.get(key)
+        if buf is not None:
+            _DECRYPTED_SESSIONS.move_to_end(key)
+            return buf.decode("utf-8")
+    buf = bytearray(_get_fernet().decrypt(token.encode("utf-8")))
+    session_string = buf.decode("utf-8")
+    with _DECRYPTED_LOCK:
+        old = _DECRYPTED_SESSIONS.pop(key, None)
+        if old is not None:
+            _wipe(old)
+        _DECRYPTED_SESSIONS[key] = buf
+        while len(_DECRYPTED_SESSIONS) > DECRYPTED_SESSIONS_MAX:
+            _, evicted = _DECRYPTED_SESSIONS.popitem(last=False)
+            _wipe(evicted)
+    return session_string
+
+
+def forget_decrypted_session(session_string: Optional[str] = None) -> None:
+    """Azzera e dimentica la session in chiaro dalla cache (tutte se None)."""
+    target = session_string.encode("utf-8") if session_string is not None else None
+    with _DECRYPTED_LOCK:
+        for key, buf in list(_DECRYPTED_SESSIONS.items()):
+            if target is None or buf == target:
+                del _DECRYPTED_SESSIONS[key]
+                _wipe(buf)
 
 
 def try_decrypt_session(token: str) -> Optional[str]:
@@ -233,23 +337,64 @@ def try_decrypt_session(token: str) -> Optional[str]:
 
 def _run(coro):
     """
-    Esegue una coroutine in un nuovo event loop.
+    Esegue una coroutine sul loop del pool Telegram e ne attende il risultato.
 
-    Usato per chiamare Telethon (async) da Streamlit (sync). Ogni chiamata crea
-    e chiude un proprio loop -> nessun rischio di state condiviso tra rerun.
+    Usato per chiamare Telethon (async) da Streamlit (sync). Tutti i client,
+    pooled o usa-e-getta, vengono cosi' connessi sullo stesso loop, che vive
+    per tutto il processo.
     """
-    try:
-        return asyncio.run(coro)
-    except RuntimeError as e:
-        # Edge case: se Streamlit/altri stanno gia' girando un loop nel main thread,
-        # asyncio.run alza "asyncio.run() cannot be called from a running event loop".
-        if "running event loop" not in str(e):
-            raise
-        loop = asyncio.new_event_loop()
+    return get_client_pool().run(_as_operation(coro))
+
+
+async def _as_operation(coro):
+    """Esegue `coro` come operazione strumentata (lib/telegram_metrics.py).
+
+    Il nome e' quello della coroutine senza "_" iniziale e "_async" finale
+    (es. _get_poll_voters_delta_async -> get_poll_voters_delta).
+    """
+    name = getattr(coro, "__name__", "operation").lstrip("_")
+    if name.endswith("_async"):
+        name = name[: -len("_async")]
+    with telegram_metrics.operation(name):
+        return await coro
+
+
+def _iterate(agen):
+    """Consuma un async generator sul loop del pool, producendo gli elementi nel thread chiamante."""
+    return get_client_pool().iterate(agen)
+
+
+# FloodWait fino a questa soglia vengono attesi e la richiesta ritentata;
+# oltre, l'errore risale al chiamante (che lo mappa in un messaggio utente).
+FLOOD_WAIT_RETRY_MAX_S = 30
+FLOOD_WAIT_MAX_RETRIES = 3
+# Richieste GetPollVotes in volo contemporaneamente per un singolo sondaggio.
+POLL_VOTES_CONCURRENCY = 4
+# Sondaggi letti contemporaneamente da get_poll_voters_delta_batch.
+POLL_BATCH_CONCURRENCY = 3
+
+
+async def _call_with_flood_retry(
+    client: Any,
+    request: Any,
+    max_wait: float = FLOOD_WAIT_RETRY_MAX_S,
+    max_retries: int = FLOOD_WAIT_MAX_RETRIES,
+) -> Any:
+    """Esegue una richiesta raw ritentandola dopo FloodWait brevi.
+
+    Il flood-sleep automatico di Telethon e' disattivato per questa chiamata
+    (flood_sleep_threshold=0) cosi' che attese e tentativi siano espliciti qui.
+    """
+    attempt = 0
+    while True:
         try:
-            return loop.run_until_complete(coro)
-        finally:
-            loop.close()
+            return await client(request, flood_sleep_threshold=0)
+        except FloodWaitError as e:
+            attempt += 1
+            if attempt > max_retries or e.seconds > max_wait:
+                raise
+            with telegram_metrics.timed(telegram_metrics.RETRY, type(request).__name__, flood_wait_s=e.seconds):
+                await asyncio.sleep(e.seconds + 1)
 
 
 # ---------------------------------------------------------------------------
@@ -268,9 +413,134 @@ SYSTEM_VERSION = "Streamlit Cloud"
 APP_VERSION = "1.0"
 
 
+class _AVTelegramClient(TelegramClient):
+    """TelegramClient che rispetta `flood_sleep_threshold` passato a client(request)
+    e fa passare ogni richiesta dal governor dei rate-limit.
+
+    In Telethon 1.x __call__ accetta il parametro ma non lo inoltra a _call:
+    senza questa correzione non si puo' disattivare il flood-sleep automatico
+    per una singola richiesta (vedi _call_with_flood_retry).
+
+    I client pooled hanno `_av_rate_key` (fingerprint della sessione, vedi
+    _session_client): le loro richieste consumano il budget dell'account e i
+    FloodWait ricevuti bloccano la classe di metodo per tutti i chiamanti.
+    """
+
+    async def __call__(self, request, ordered=False, flood_sleep_threshold=None):
+        return await self._call(
+            self._sender, request, ordered=ordered, flood_sleep_threshold=flood_sleep_threshold
+        )
+
+    async def _call(self, sender, request, ordered=False, flood_sleep_threshold=None):
+        async def _send(threshold):
+            return await super(_AVTelegramClient, self)._call(sender, request, ordered, threshold)
+
+        return await _governed_call(self, request, flood_sleep_threshold, _send)
+
+
+# Soglia di flood-sleep per le richieste fatte dai metodi di alto livello di
+# Telethon (es. send_message), che non la accettano come parametro.
+_FLOOD_SLEEP_THRESHOLD: contextvars.ContextVar = contextvars.ContextVar("av_flood_sleep_threshold", default=None)
+
+
+@contextmanager
+def _flood_sleep_threshold(seconds: float):
+    """Dentro il blocco le richieste senza soglia esplicita usano `seconds` (0 = nessun flood-sleep).
+
+    Per task (contextvar): non tocca le altre operazioni sullo stesso client
+    pooled. Non attraversa uno `yield`: va usato attorno al solo await.
+    """
+    token = _FLOOD_SLEEP_THRESHOLD.set(seconds)
+    try:
+        yield
+    finally:
+        _FLOOD_SLEEP_THRESHOLD.reset(token)
+
+
+async def _governed_call(client: Any, request: Any, flood_sleep_threshold: Optional[float], send) -> Any:
+    """Esegue `send(flood_sleep_threshold)` passando dal governor dell'account del client.
+
+    Condiviso da _AVTelegramClient e dai client finti (lib/telegram_fake.py).
+    """
+    if flood_sleep_threshold is None:
+        flood_sleep_threshold = _FLOOD_SLEEP_THRESHOLD.get()
+    name = type(request).__name__
+    account = getattr(client, "_av_rate_key", None)
+    method_class = _method_class(request) if account else None
+    if method_class is None:
+        with telegram_metrics.timed(telegram_metrics.RPC, name) as extra:
+            try:
+                return await send(flood_sleep_threshold)
+            except FloodWaitError as e:
+                extra["flood_wait_s"] = e.seconds
+                raise
+    governor = get_rate_governor()
+    # Un FloodWait gia' noto si attende entro la stessa soglia con cui
+    # Telethon attenderebbe quello vero; oltre, si fallisce subito.
+    if flood_sleep_threshold is None:
+        flood_sleep_threshold = client.flood_sleep_threshold
+    wait_start = time.perf_counter()
+    try:
+        await governor.acquire(account, method_class, max_wait=flood_sleep_threshold)
+    except FloodWaitError as e:
+        telegram_metrics.record(
+            telegram_metrics.RPC, name, 0.0, ok=False, error=type(e).__name__,
+            wait_s=round(time.perf_counter() - wait_start, 6), flood_wait_s=e.seconds,
+        )
+        raise
+    with telegram_metrics.timed(
+        telegram_metrics.RPC, name, wait_s=round(time.perf_counter() - wait_start, 6)
+    ) as extra:
+        try:
+            return await send(flood_sleep_threshold)
+        except FloodWaitError as e:
+            extra["flood_wait_s"] = e.seconds
+            governor.note_flood_wait(account, method_class, e.seconds)
+            raise
+
+
+# Costruttore alternativo dei client (set_client_factory), None = Telethon reale.
+_CLIENT_FACTORY: Optional[Callable[[str], Any]] = None
+# Opzioni del prossimo pool e limiti del prossimo governor (set_client_factory).
+_POOL_OPTIONS: Dict[str, Any] = {}
+_RATE_LIMITS: Dict[str, tuple] = {}
+
+
+def set_client_factory(
+    factory: Optional[Callable[[str], Any]],
+    *,
+    pooling: bool = True,
+    rate_limits: Optional[Dict[str, tuple]] = None,
+) -> None:
+    """Sostituisce la costruzione dei client Telegram, per test e benchmark offline.
+
+    `factory(session_string)` deve ritornare un oggetto con la superficie di
+    TelegramClient usata da questo modulo (vedi lib/telegram_fake.py); None
+    ripristina Telethon. Il pool, il governor e le cache in memoria vengono
+    ricreati, cosi' nessun client del backend precedente resta in uso.
+
+    `pooling=False`: un client nuovo per ogni operazione (vedi
+    TelegramClientPool). `rate_limits`: {classe: (richieste/s, burst)} al
+    posto dei limiti di default del governor.
+    """
+    global _CLIENT_FACTORY, _POOL, _RATE_GOVERNOR, _POOL_OPTIONS, _RATE_LIMITS
+    with _POOL_LOCK:
+        _CLIENT_FACTORY = factory
+        _POOL_OPTIONS = {} if pooling else {"pooling": False}
+        _RATE_LIMITS = dict(rate_limits or {})
+        pool, _POOL = _POOL, None
+        _RATE_GOVERNOR = None
+    if pool is not None:
+        pool.close()
+    invalidate_identity()
+    invalidate_open_polls()
+
+
 def _new_client(session_string: str = "") -> TelegramClient:
+    if _CLIENT_FACTORY is not None:
+        return _CLIENT_FACTORY(session_string)
     api_id, api_hash = get_api_credentials()
-    return TelegramClient(
+    return _AVTelegramClient(
         StringSession(session_string),
         api_id,
         api_hash,
@@ -280,6 +550,241 @@ def _new_client(session_string: str = "") -> TelegramClient:
     )
 
 
+# ---------------------------------------------------------------------------
+# Governor dei rate-limit per account (vedi lib/telegram_rate.py)
+# ---------------------------------------------------------------------------
+
+_RATE_GOVERNOR: Optional[RateGovernor] = None
+
+_DM_REQUESTS = (SendMessageRequest, SendMediaRequest, ForwardMessagesRequest)
+_RESOLVE_REQUESTS = (ResolvePhoneRequest, ResolveUsernameRequest, ImportContactsRequest)
+
+
+def get_rate_governor() -> RateGovernor:
+    """Ritorna il governor process-wide (creato alla prima chiamata)."""
+    global _RATE_GOVERNOR
+    with _POOL_LOCK:
+        if _RATE_GOVERNOR is None:
+            _RATE_GOVERNOR = RateGovernor({
+                rate.DM: (DM_RATE_PER_S, DM_BURST),
+                rate.RESOLVE: (RESOLVE_PHONE_RATE_PER_S, RESOLVE_PHONE_BURST),
+                **_RATE_LIMITS,
+            })
+        return _RATE_GOVERNOR
+
+
+def _method_class(request: Any) -> Optional[str]:
+    """Classe di rate-limit di una richiesta; None per quelle non governate (login, health check del pool)."""
+    if isinstance(request, (list, tuple)):
+        request = request[0] if request else None
+    if isinstance(request, GetStateRequest):
+        return None
+    if isinstance(request, _DM_REQUESTS):
+        return rate.DM
+    if isinstance(request, _RESOLVE_REQUESTS):
+        return rate.RESOLVE
+    if type(request).__module__.endswith(".auth"):
+        return None
+    return rate.READ
+
+
+def bind_rate_store(session_string: str, store: Optional[FloodStore]) -> None:
+    """Associa (o con None rimuove) la persistenza delle scadenze FloodWait della sessione.
+
+    Come bind_entity_store, idempotente: le scadenze vengono caricate una
+    volta per store (stessa `key`) alla prima richiesta dell'account.
+    """
+    get_rate_governor().bind_store(session_fingerprint(session_string), store)
+
+
+def get_rate_state(session_string: str) -> Dict[str, dict]:
+    """Budget corrente dell'account, per classe ("read", "dm", "resolve").
+
+    Ritorna {classe: {"tokens", "capacity", "rate_per_s", "blocked_for_s"}};
+    `blocked_for_s` > 0 indica un FloodWait in corso: le richieste di quella
+    classe aspettano o falliscono subito con "riprova fra N secondi".
+    """
+    governor = get_rate_governor()
+    key = session_fingerprint(session_string)
+    _run(governor.ensure_loaded(key))
+    return governor.snapshot(key)
+
+
+# ---------------------------------------------------------------------------
+# Pool di client per sessione
+# ---------------------------------------------------------------------------
+
+_POOL: Optional[TelegramClientPool] = None
+_POOL_LOCK = threading.Lock()
+
+
+def get_client_pool() -> TelegramClientPool:
+    """Ritorna il pool process-wide (creato alla prima chiamata)."""
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            configure_metrics_sink()
+            _POOL = TelegramClientPool(_new_client, **_POOL_OPTIONS)
+        return _POOL
+
+
+_METRICS_SINK: Optional[telegram_metrics.MetricsSink] = None
+
+
+def configure_metrics_sink() -> None:
+    """Registra (una volta) il sink aggiuntivo di TELEGRAM_METRICS_SINK, se configurato."""
+    global _METRICS_SINK
+    if _METRICS_SINK is not None:
+        return
+    try:
+        spec = st.secrets.get("TELEGRAM_METRICS_SINK", "")
+    except FileNotFoundError:
+        return
+    try:
+        _METRICS_SINK = telegram_metrics.sink_from_spec(spec)
+    except ValueError:
+        return
+    if _METRICS_SINK is not None:
+        telegram_metrics.add_metrics_sink(_METRICS_SINK)
+
+
+@asynccontextmanager
+async def _session_client(session_string: str):
+    """Async context manager: client pooled autorizzato, oppure None.
+
+        async with _session_client(session_string) as client:
+            if client is None:
+                ...  # sessione non (piu') autorizzata
+
+    Le richieste del client passano dal governor dei rate-limit dell'account.
+    Se alla sessione e' associato un EntityStore (bind_entity_store), il
+    client viene idratato dalla cache persistente prima dell'uso e le
+    entita' nuove viste durante l'operazione vengono salvate all'uscita.
+    """
+    async with get_client_pool().session(session_string) as client:
+        key = session_fingerprint(session_string)
+        if client is not None:
+            client._av_rate_key = key
+        store = _ENTITY_STORES.get(key) if client is not None else None
+        if store is not None:
+            await _hydrate_entities(client, store)
+        try:
+            yield client
+        finally:
+            # Dopo un logout lo store viene sganciato: niente write-back.
+            if store is not None and _ENTITY_STORES.get(key) is store:
+                _persist_new_entities(client, store)
+
+
+# ---------------------------------------------------------------------------
+# Cache entita' persistente (vedi lib/telegram_entities.py)
+# ---------------------------------------------------------------------------
+
+_ENTITY_STORES: Dict[str, EntityStore] = {}
+
+
+def bind_entity_store(session_string: str, store: Optional[EntityStore]) -> None:
+    """Associa (o con None rimuove) lo store entita' della sessione.
+
+    Idempotente: le pagine possono chiamarlo a ogni rerun con uno store
+    nuovo; un client gia' idratato da uno store con la stessa `key` non
+    viene ricaricato.
+    """
+    key = session_fingerprint(session_string)
+    if store is None:
+        _ENTITY_STORES.pop(key, None)
+    else:
+        _ENTITY_STORES[key] = store
+
+
+def _entity_rows(client: Any) -> Optional[set]:
+    """Le righe (id, hash, username, phone, name) della cache entita' della MemorySession.
+
+    La sessione non ha un'API pubblica per elencare le entita': si legge
+    `_entities`, il cui formato e' quello delle versioni di Telethon in
+    requirements.txt. Se manca o ha un'altra forma ritorna None e la cache
+    persistente si limita all'idratazione (niente write-back, username None).
+    """
+    rows = getattr(getattr(client, "session", None), "_entities", None)
+    if not isinstance(rows, set):
+        return None
+    for row in list(rows)[:1]:
+        if not (isinstance(row, tuple) and len(row) >= 3 and isinstance(row[0], int)):
+            return None
+    return rows
+
+
+def _tl_entity(marked_id: int, access_hash: int, username: Optional[str]) -> Any:
+    """Entita' TL minima (id, access_hash, username) da passare a session.process_entities."""
+    bare_id, kind = resolve_id(marked_id)
+    if kind is PeerUser:
+        return User(id=bare_id, access_hash=access_hash, username=username)
+    if kind is PeerChannel:
+        return Channel(
+            id=bare_id, title="", photo=ChatPhotoEmpty(), date=None,
+            access_hash=access_hash, username=username,
+        )
+    return Chat(id=bare_id, title="", photo=ChatPhotoEmpty(), participants_count=0, date=None, version=0)
+
+
+async def _hydrate_entities(client: Any, store: EntityStore) -> None:
+    session = getattr(client, "session", None)
+    state = getattr(client, "_av_entity_state", None)
+    if not hasattr(session, "process_entities") or (state is not None and state["key"] == store.key):
+        return
+    loop = asyncio.get_running_loop()
+    try:
+        stored = await loop.run_in_executor(None, store.load)
+    except Exception:
+        # Senza cache si risolve via RPC come prima: non e' un errore fatale.
+        stored = []
+    rows = _entity_rows(client)
+    present = {r[0] for r in rows} if rows is not None else set()
+    try:
+        # API pubblica della sessione: Telethon costruisce le righe a modo suo.
+        session.process_entities([
+            _tl_entity(peer_id, access_hash, username)
+            for peer_id, access_hash, username in stored
+            if peer_id not in present
+        ])
+    except Exception:
+        pass
+    rows = _entity_rows(client)
+    client._av_entity_state = {
+        "key": store.key,
+        "persisted": {(r[0], r[1], r[2]) for r in rows} if rows is not None else set(),
+    }
+
+
+def _persist_new_entities(client: Any, store: EntityStore) -> None:
+    """Salva in background (thread executor) le entita' non ancora persistite."""
+    rows = _entity_rows(client)
+    state = getattr(client, "_av_entity_state", None)
+    if rows is None or state is None or state["key"] != store.key:
+        return
+    current = {(r[0], r[1], r[2]) for r in list(rows)}
+    new_rows = current - state["persisted"]
+    if not new_rows:
+        return
+    state["persisted"] |= new_rows
+    future = asyncio.get_running_loop().run_in_executor(None, store.save, list(new_rows))
+    # Best effort: un errore di scrittura costa solo una risoluzione futura.
+    future.add_done_callback(lambda f: f.exception())
+
+
+def _cached_peer_info(client: Any, peer: Any) -> Tuple[int, Optional[str]]:
+    """(id non marcato, username) di una InputPeer, dalla cache entita' della sessione."""
+    marked_id = get_peer_id(peer)
+    bare_id, _ = resolve_id(marked_id)
+    username = None
+    for row in list(_entity_rows(client) or ()):
+        if row[0] == marked_id:
+            username = row[2]
+            if username:
+                break
+    return bare_id, username
+
+
 async def _send_code_async(phone: str) -> Tuple[str, str]:
     """Step 1 del login: chiede a Telegram di inviare il codice al numero.
 
@@ -330,13 +835,19 @@ def sign_in_with_code(
     intermediate_session: str, phone: str, code: str, phone_code_hash: str
 ) -> Tuple[str, bool]:
     try:
-        return _run(_sign_in_code_async(intermediate_session, phone, code, phone_code_hash))
+        next_session, needs_2fa = _run(
+            _sign_in_code_async(intermediate_session, phone, code, phone_code_hash)
+        )
     except PhoneCodeInvalidError as e:
         raise TelegramLoginError("Codice non valido. Controlla e riprova.") from e
     except PhoneCodeExpiredError as e:
         raise TelegramLoginError("Codice scaduto. Richiedi un nuovo codice.") from e
     except FloodWaitError as e:
         raise TelegramLoginError(f"Troppi tentativi. Riprova fra {e.seconds} secondi.") from e
+    if not needs_2fa:
+        # Nuova sessione autorizzata: nessuna identita' in cache deve sopravvivere.
+        invalidate_identity(next_session)
+    return next_session, needs_2fa
 
 
 async def _sign_in_password_async(intermediate_session: str, password: str) -> str:
@@ -351,7 +862,7 @@ async def _sign_in_password_async(intermediate_session: str, password: str) -> s
 
 def sign_in_with_password(intermediate_session: str, password: str) -> str:
     try:
-        return _run(_sign_in_password_async(intermediate_session, password))
+        final_session = _run(_sign_in_password_async(intermediate_session, password))
     except FloodWaitError as e:
         raise TelegramLoginError(f"Troppi tentativi. Riprova fra {e.seconds} secondi.") from e
     except Exception as e:  # password sbagliata -> Telethon alza Exception generica
@@ -360,6 +871,8 @@ def sign_in_with_password(intermediate_session: str, password: str) -> str:
         if "password" in msg:
             raise TelegramLoginError("Password 2FA errata.") from e
         raise
+    invalidate_identity(final_session)
+    return final_session
 
 
 # ---------------------------------------------------------------------------
@@ -368,10 +881,8 @@ def sign_in_with_password(intermediate_session: str, password: str) -> str:
 
 async def _whoami_async(session_string: str) -> Optional[dict]:
     """Ritorna informazioni base sull'utente loggato, o None se la session non e' valida."""
-    client = _new_client(session_string)
-    try:
-        await client.connect()
-        if not await client.is_user_authorized():
+    async with _session_client(session_string) as client:
+        if client is None:
             return None
         me = await client.get_me()
         return {
@@ -381,27 +892,123 @@ async def _whoami_async(session_string: str) -> Optional[dict]:
             "last_name": me.last_name,
             "phone": me.phone,
         }
-    finally:
-        await client.disconnect()
 
 
 def whoami(session_string: str) -> Optional[dict]:
     try:
-        return _run(_whoami_async(session_string))
+        me = _run(_whoami_async(session_string))
     except Exception:
         # Una session revocata / corrotta alza errori vari; trattiamo come "non valido".
+        me = None
+    _store_identity(session_string, me)
+    return me
+
+
+# ---------------------------------------------------------------------------
+# Cache liveness / identita' della sessione
+#
+# Le pagine chiedono "chi e' connesso?" a ogni rerun Streamlit. La risposta
+# cambia raramente (solo su logout, revoca da Telegram o nuovo login), quindi
+# la teniamo in cache per fingerprint di sessione con un TTL. Quando il TTL e'
+# scaduto ritorniamo comunque subito l'ultimo valore noto e ri-verifichiamo in
+# background sul loop del pool: il rerun successivo vede il risultato fresco.
+# ---------------------------------------------------------------------------
+
+IDENTITY_TTL_S = 300.0
+# Un esito negativo ("sessione non valida") scade prima: puo' dipendere da un
+# problema transitorio e non vogliamo mostrarlo a lungo.
+IDENTITY_NEGATIVE_TTL_S = 30.0
+
+_IDENTITY_LOCK = threading.Lock()
+_IDENTITY_CACHE: dict = {}  # fingerprint -> {"me": dict | None, "verified_at": float}
+_IDENTITY_REFRESHING: set = set()  # fingerprint con ri-verifica gia' in corso
+
+
+def _store_identity(session_string: str, me: Optional[dict]) -> None:
+    if not session_string:
+        return
+    with _IDENTITY_LOCK:
+        _IDENTITY_CACHE[session_fingerprint(session_string)] = {
+            "me": me,
+            "verified_at": time.time(),
+        }
+
+
+def _identity_ttl(entry: dict) -> float:
+    return IDENTITY_TTL_S if entry.get("me") else IDENTITY_NEGATIVE_TTL_S
+
+
+async def _refresh_identity_async(session_string: str) -> None:
+    key = session_fingerprint(session_string)
+    try:
+        me = await _whoami_async(session_string)
+    except Exception:
+        # Errore transitorio: teniamo l'ultimo valore noto, si riprova al prossimo rerun.
+        return
+    finally:
+        with _IDENTITY_LOCK:
+            _IDENTITY_REFRESHING.discard(key)
+    _store_identity(session_string, me)
+
+
+def last_verified_at(session_string: str) -> Optional[float]:
+    """Epoch (secondi) dell'ultima verifica della sessione, o None. Non fa I/O."""
+    if not session_string:
         return None
+    with _IDENTITY_LOCK:
+        entry = _IDENTITY_CACHE.get(session_fingerprint(session_string))
+        return entry["verified_at"] if entry else None
+
+
+def session_identity(session_string: str) -> dict:
+    """Identita' dell'account collegato, servita dalla cache quando possibile.
+
+    Ritorna:
+        {
+          "me": dict | None,          # stesso formato di whoami()
+          "verified_at": float | None,  # epoch dell'ultima verifica
+          "stale": bool,              # True se e' in corso una ri-verifica in background
+        }
+
+    Solo la prima chiamata per una sessione (o dopo invalidate_identity) e'
+    bloccante; le successive non fanno I/O nel thread chiamante.
+    """
+    if not session_string:
+        return {"me": None, "verified_at": None, "stale": False}
+    key = session_fingerprint(session_string)
+    with _IDENTITY_LOCK:
+        entry = _IDENTITY_CACHE.get(key)
+        if entry is not None:
+            age = time.time() - entry["verified_at"]
+            stale = age >= _identity_ttl(entry)
+            if stale and key not in _IDENTITY_REFRESHING:
+                _IDENTITY_REFRESHING.add(key)
+                get_client_pool().submit(_refresh_identity_async(session_string))
+            return {"me": entry["me"], "verified_at": entry["verified_at"], "stale": stale}
+    me = whoami(session_string)
+    return {"me": me, "verified_at": last_verified_at(session_string), "stale": False}
+
+
+def invalidate_identity(session_string: Optional[str] = None) -> None:
+    """Dimentica l'identita' in cache di una sessione (o di tutte se None)."""
+    with _IDENTITY_LOCK:
+        if session_string is None:
+            _IDENTITY_CACHE.clear()
+        else:
+            _IDENTITY_CACHE.pop(session_fingerprint(session_string), None)
 
 
 async def _logout_async(session_string: str) -> bool:
-    client = _new_client(session_string)
-    try:
-        await client.connect()
-        if not await client.is_user_authorized():
+    async with _session_client(session_string) as client:
+        if client is None:
             return False
-        return await client.log_out()
-    finally:
-        await client.disconnect()
+        # Gli access_hash sono dell'account che si disconnette: niente write-back.
+        bind_entity_store(session_string, None)
+        try:
+            return await client.log_out()
+        finally:
+            # Dopo log_out l'auth key e' revocata: il client pooled non e' piu' usabile.
+            await get_client_pool().discard(session_string)
 
 
 def logout(session_string: str) -> bool:
@@ -410,58 +1017,136 @@ def logout(session_string: str) -> bool:
         return _run(_logout_async(session_string))
     except Exception:
         return False
+    finally:
+        invalidate_identity(session_string)
+        bind_entity_store(session_string, None)
+        invalidate_open_polls(session_string)
+        get_rate_governor().forget(session_fingerprint(session_string))
+        forget_decrypted_session(session_string)
 
 
 # ---------------------------------------------------------------------------
 # Elenco gruppi a cui appartiene l'utente
 # ---------------------------------------------------------------------------
 
-async def _list_groups_async(session_string: str) -> List[dict]:
-    client = _new_client(session_string)
-    try:
-        await client.connect()
-        if not await client.is_user_authorized():
+def _dialog_group(dialog: Any) -> Tuple[Optional[dict], bool]:
+    """(gruppo, da_rimuovere) per un dialog: il dict di list_groups se e' un gruppo attivo."""
+    entity = dialog.entity
+    # Includiamo gruppi base (Chat) e supergruppi (Channel con megagroup=True).
+    # Escludiamo canali broadcast e chat 1:1.
+    is_basic_group = type(entity).__name__ == "Chat"
+    is_megagroup = type(entity).__name__ == "Channel" and getattr(entity, "megagroup", False)
+    if not (is_basic_group or is_megagroup):
+        return None, False
+    # Gruppo base migrato a supergruppo o disattivato: il vecchio id non serve piu'.
+    if is_basic_group and (
+        getattr(entity, "migrated_to", None) or getattr(entity, "deactivated", False)
+        or getattr(entity, "left", False)
+    ):
+        return None, True
+    # Per supergruppi serve il full channel id (-100<id>); dialog.id lo fornisce gia' cosi'.
+    return {
+        "chat_id": dialog.id,
+        "title": dialog.name or "",
+        "is_megagroup": is_megagroup,
+    }, False
+
+
+async def _scan_groups_async(session_string: str, since: Optional[float] = None) -> dict:
+    """Scorre i dialog dal piu' recente; con `since` si ferma al primo non piu' recente.
+
+    I dialog fissati (pinned) vengono prima a prescindere dalla data e non
+    fermano la scansione.
+    """
+    async with _session_client(session_string) as client:
+        if client is None:
             raise TelegramOperationError("Sessione Telegram non valida. Riconnettiti.")
         groups: List[dict] = []
+        removed: List[int] = []
+        watermark = since or 0.0
         async for dialog in client.iter_dialogs():
-            entity = dialog.entity
-            # Includiamo gruppi base (Chat) e supergruppi (Channel con megagroup=True).
-            # Escludiamo canali broadcast e chat 1:1.
-            is_basic_group = type(entity).__name__ == "Chat"
-            is_megagroup = type(entity).__name__ == "Channel" and getattr(entity, "megagroup", False)
-            if not (is_basic_group or is_megagroup):
-                continue
-            # Per supergruppi serve il full channel id (-100<id>); dialog.id lo fornisce gia' cosi'.
-            groups.append({
-                "chat_id": dialog.id,
-                "title": dialog.name or "",
-                "is_megagroup": is_megagroup,
-            })
-        # Ordina alfabeticamente per titolo (case-insensitive)
-        groups.sort(key=lambda g: (g["title"] or "").lower())
-        return groups
-    finally:
-        await client.disconnect()
+            stamp = dialog.date.timestamp() if dialog.date else 0.0
+            if since is not None and stamp <= since and not getattr(dialog, "pinned", False):
+                break
+            watermark = max(watermark, stamp)
+            group, drop = _dialog_group(dialog)
+            if group is not None:
+                groups.append(group)
+            elif drop:
+                removed.append(dialog.id)
+        return {"groups": groups, "removed": removed, "watermark": watermark, "complete": since is None}
+
+
+async def _list_groups_async(session_string: str) -> List[dict]:
+    scan = await _scan_groups_async(session_string)
+    # Ordina alfabeticamente per titolo (case-insensitive)
+    return sorted(scan["groups"], key=lambda g: (g["title"] or "").lower())
+
+
+# Indice incrementale dei sondaggi aperti, per (sessione, gruppo).
+#
+# La prima lettura cerca i sondaggi lato server (InputMessagesFilterPoll) e
+# ricorda il msg_id piu' alto visto; le successive chiedono solo i sondaggi
+# piu' recenti di quel msg_id e ricontrollano lo stato (aperto/chiuso,
+# votanti) di quelli gia' noti con una sola get_messages per id. I sondaggi
+# chiusi o cancellati escono dall'indice: Telegram non li riapre.
+# La prima lettura guarda solo gli ultimi OPEN_POLLS_SCAN_LIMIT messaggi
+# (finestra di msg_id), cosi' un gruppo con una lunga storia non viene
+# percorso fino in fondo.
+OPEN_POLLS_INDEX_MAX_CHATS = 64
+OPEN_POLLS_SCAN_LIMIT = 1000
+
+_OPEN_POLLS_LOCK = threading.Lock()
+# (fingerprint, chat_ref) -> {"high_water": int, "polls": {msg_id: dict}}
+_OPEN_POLLS_INDEX: "OrderedDict[tuple, dict]" = OrderedDict()
+
+
+def _open_poll_entry(msg: Any, link_prefix: str) -> Optional[dict]:
+    """Dict di list_open_polls per un messaggio, None se non e' un sondaggio aperto."""
+    if msg is None or not isinstance(msg.media, MessageMediaPoll):
+        return None
+    poll = msg.media.poll
+    if getattr(poll, "closed", False):
+        return None
+    results_field = getattr(msg.media, "results", None)
+    total_voters = getattr(results_field, "total_voters", 0) if results_field else 0
+    return {
+        "msg_id": msg.id,
+        "question": _extract_text(poll.question),
+        "is_anonymous": not getattr(poll, "public_voters", False),
+        "multiple_choice": getattr(poll, "multiple_choice", False),
+        "total_voters": total_voters or 0,
+        "date": msg.date,
+        "link": (link_prefix + str(msg.id)) if link_prefix else "",
+    }
+
+
+def invalidate_open_polls(session_string: Optional[str] = None) -> None:
+    """Dimentica l'indice dei sondaggi aperti di una sessione (o di tutte se None)."""
+    with _OPEN_POLLS_LOCK:
+        if session_string is None:
+            _OPEN_POLLS_INDEX.clear()
+            return
+        key = session_fingerprint(session_string)
+        for index_key in [k for k in _OPEN_POLLS_INDEX if k[0] == key]:
+            del _OPEN_POLLS_INDEX[index_key]
 
 
 async def _list_open_polls_async(
-    session_string: str, chat_ref: ChatRef, limit: int
+    session_string: str, chat_ref: ChatRef, limit: int, scan_limit: int, full_rescan: bool = False
 ) -> List[dict]:
-    client = _new_client(session_string)
-    try:
-        await client.connect()
-        if not await client.is_user_authorized():
+    async with _session_client(session_string) as client:
+        if client is None:
             raise TelegramOperationError("Sessione Telegram non valida. Riconnettiti.")
         try:
-            entity = await client.get_entity(chat_ref)
+            entity = await client.get_input_entity(chat_ref)
         except (ValueError, UsernameNotOccupiedError) as e:
             raise TelegramOperationError("Gruppo Telegram non trovato.") from e
         except ChannelPrivateError as e:
             raise TelegramOperationError("Gruppo privato non accessibile.") from e
 
         # Determina il prefisso del link per costruire URL al messaggio
-        ent_username = getattr(entity, "username", None)
-        ent_id = getattr(entity, "id", None)
+        ent_id, ent_username = _cached_peer_info(client, entity)
         if ent_username:
             link_prefix = f"https://t.me/{ent_username}/"
         elif ent_id:
@@ -469,33 +1154,69 @@ async def _list_open_polls_async(
         else:
             link_prefix = ""
 
-        polls: List[dict] = []
-        async for msg in client.iter_messages(entity, limit=limit):
-            if not isinstance(msg.media, MessageMediaPoll):
-                continue
-            poll = msg.media.poll
-            if getattr(poll, "closed", False):
-                continue
-            results_field = getattr(msg.media, "results", None)
-            total_voters = getattr(results_field, "total_voters", 0) if results_field else 0
-            polls.append({
-                "msg_id": msg.id,
-                "question": _extract_text(poll.question),
-                "is_anonymous": not getattr(poll, "public_voters", False),
-                "multiple_choice": getattr(poll, "multiple_choice", False),
-                "total_voters": total_voters or 0,
-                "date": msg.date,
-                "link": (link_prefix + str(msg.id)) if link_prefix else "",
-            })
+        index_key = (session_fingerprint(session_string), str(chat_ref))
+        with _OPEN_POLLS_LOCK:
+            cached = None if full_rescan else _OPEN_POLLS_INDEX.get(index_key)
+            high_water = cached["high_water"] if cached else 0
+            known = dict(cached["polls"]) if cached else {}
+
+        polls: Dict[int, dict] = {}
+        try:
+            # Stato aggiornato dei sondaggi gia' noti (una richiesta per 100 id).
+            if known:
+                for msg in await client.get_messages(entity, ids=sorted(known)):
+                    entry = _open_poll_entry(msg, link_prefix)
+                    if entry is not None:
+                        polls[entry["msg_id"]] = entry
+            # Prima lettura: solo gli ultimi `scan_limit` messaggi del gruppo.
+            min_id = high_water
+            if not cached:
+                async for last in client.iter_messages(entity, limit=1):
+                    min_id = max(0, last.id - scan_limit)
+            # Solo i sondaggi piu' recenti dell'ultimo visto, filtrati lato server.
+            async for msg in client.iter_messages(
+                entity, limit=limit, filter=InputMessagesFilterPoll(), min_id=min_id
+            ):
+                high_water = max(high_water, msg.id)
+                entry = _open_poll_entry(msg, link_prefix)
+                if entry is not None:
+                    polls[entry["msg_id"]] = entry
+        except ChannelPrivateError as e:
+            # Con una InputPeer dalla cache l'accesso si verifica solo qui.
+            with _OPEN_POLLS_LOCK:
+                _OPEN_POLLS_INDEX.pop(index_key, None)
+            raise TelegramOperationError("Gruppo privato non accessibile.") from e
+
         # Piu' recenti prima
-        polls.sort(key=lambda p: p["date"] or 0, reverse=True)
-        return polls
-    finally:
-        await client.disconnect()
+        ordered = sorted(polls.values(), key=lambda p: p["msg_id"], reverse=True)[:limit]
+        with _OPEN_POLLS_LOCK:
+            _OPEN_POLLS_INDEX[index_key] = {
+                "high_water": high_water,
+                "polls": {p["msg_id"]: p for p in ordered},
+            }
+            _OPEN_POLLS_INDEX.move_to_end(index_key)
+            while len(_OPEN_POLLS_INDEX) > OPEN_POLLS_INDEX_MAX_CHATS:
+                _OPEN_POLLS_INDEX.popitem(last=False)
+        return [dict(p) for p in ordered]
+
+
+def list_open_polls(
+    session_string: str,
+    chat_ref: ChatRef,
+    limit: int = 200,
+    full_rescan: bool = False,
+    scan_limit: int = OPEN_POLLS_SCAN_LIMIT,
+) -> List[dict]:
+    """Elenca i sondaggi aperti (non chiusi) del gruppo, al massimo `limit`.
 
+    `limit` conta i sondaggi ritornati, non i messaggi letti: la ricerca e'
+    filtrata lato server. `scan_limit` limita la prima lettura agli ultimi
+    `scan_limit` messaggi del gruppo (per id; nei gruppi base gli id sono
+    dell'account, quindi la finestra copre anche meno messaggi).
 
-def list_open_polls(session_string: str, chat_ref: ChatRef, limit: int = 200) -> List[dict]:
-    """Elenca i sondaggi aperti (non chiusi) tra gli ultimi `limit` messaggi del gruppo.
+    Le chiamate successive per lo stesso gruppo sono incrementali: leggono
+    solo i sondaggi nuovi e ricontrollano quelli gia' noti. `full_rescan`
+    ignora l'indice e rilegge da capo (di nuovo entro `scan_limit`).
 
     Ritorna lista di dict ordinati per data discendente:
         {"msg_id": int, "question": str, "is_anonymous": bool, "multiple_choice": bool,
@@ -503,7 +1224,7 @@ def list_open_polls(session_string: str, chat_ref: ChatRef, limit: int = 200) ->
     """
     chat_ref = _normalize_chat_ref(chat_ref)
     try:
-        return _run(_list_open_polls_async(session_string, chat_ref, limit))
+        return _run(_list_open_polls_async(session_string, chat_ref, limit, scan_limit, full_rescan))
     except TelegramOperationError:
         raise
     except FloodWaitError as e:
@@ -528,6 +1249,40 @@ def list_groups(session_string: str) -> List[dict]:
         raise TelegramOperationError(f"Errore durante la lettura dei gruppi: {e}") from e
 
 
+def sync_group_index(
+    session_string: str,
+    index: Optional[dict] = None,
+    *,
+    ttl_s: float = GROUP_INDEX_TTL_S,
+    full_ttl_s: float = GROUP_INDEX_FULL_TTL_S,
+    force_full: bool = False,
+) -> dict:
+    """Aggiorna l'indice persistente dei gruppi (vedi lib/telegram_groups.py).
+
+    - indice piu' giovane di `ttl_s`: ritornato cosi' com'e', nessuna richiesta;
+    - ultimo elenco completo piu' vecchio di `full_ttl_s` (o `force_full`):
+      rilegge tutti i dialog;
+    - altrimenti legge solo i dialog con attivita' dopo il watermark.
+
+    Ritorna l'indice (nuovo dict se e' stato aggiornato: il chiamante lo
+    persiste quando `synced_at` cambia).
+    """
+    now = time.time()
+    if not force_full and index and not needs_sync(index, now, ttl_s):
+        return index
+    full = force_full or needs_full_sync(index, now, full_ttl_s)
+    since = None if full else float(index.get("watermark") or 0)
+    try:
+        scan = _run(_scan_groups_async(session_string, since))
+    except TelegramOperationError:
+        raise
+    except FloodWaitError as e:
+        raise TelegramOperationError(f"Telegram rate limit, riprova fra {e.seconds}s.") from e
+    except Exception as e:
+        raise TelegramOperationError(f"Errore durante la lettura dei gruppi: {e}") from e
+    return apply_group_sync(index, scan, now)
+
+
 # ---------------------------------------------------------------------------
 # Fase 2 - Lettura sondaggi
 # ---------------------------------------------------------------------------
@@ -535,10 +1290,8 @@ def list_groups(session_string: str) -> List[dict]:
 async def _resolve_username_async(session_string: str, username: str) -> Optional[dict]:
     if not username:
         return None
-    client = _new_client(session_string)
-    try:
-        await client.connect()
-        if not await client.is_user_authorized():
+    async with _session_client(session_string) as client:
+        if client is None:
             return None
         try:
             entity = await client.get_entity(username.lstrip("@"))
@@ -550,8 +1303,6 @@ async def _resolve_username_async(session_string: str, username: str) -> Optiona
             "first_name": getattr(entity, "first_name", "") or "",
             "last_name": getattr(entity, "last_name", "") or "",
         }
-    finally:
-        await client.disconnect()
 
 
 def resolve_username(session_string: str, username: str) -> Optional[dict]:
@@ -605,11 +1356,18 @@ def normalize_phone_to_e164(raw: str, default_country_code: str = "39") -> Optio
     return None
 
 
+def _resolved_user_dict(u: Any) -> dict:
+    return {
+        "user_id": u.id,
+        "username": getattr(u, "username", None),
+        "first_name": getattr(u, "first_name", "") or "",
+        "last_name": getattr(u, "last_name", "") or "",
+    }
+
+
 async def _resolve_phone_async(session_string: str, phone_e164: str) -> Optional[dict]:
-    client = _new_client(session_string)
-    try:
-        await client.connect()
-        if not await client.is_user_authorized():
+    async with _session_client(session_string) as client:
+        if client is None:
             return None
         try:
             resolved = await client(ResolvePhoneRequest(phone=phone_e164.lstrip("+")))
@@ -618,15 +1376,7 @@ async def _resolve_phone_async(session_string: str, phone_e164: str) -> Optional
         users = getattr(resolved, "users", []) or []
         if not users:
             return None
-        u = users[0]
-        return {
-            "user_id": u.id,
-            "username": getattr(u, "username", None),
-            "first_name": getattr(u, "first_name", "") or "",
-            "last_name": getattr(u, "last_name", "") or "",
-        }
-    finally:
-        await client.disconnect()
+        return _resolved_user_dict(users[0])
 
 
 def resolve_phone(session_string: str, raw_phone: str) -> dict:
@@ -670,16 +1420,128 @@ def resolve_phone(session_string: str, raw_phone: str) -> dict:
     }
 
 
+# Ritmo per ResolvePhone (classe "resolve" del governor): burst di
+# RESOLVE_PHONE_BURST richieste poi RESOLVE_PHONE_RATE_PER_S al secondo
+# (ResolvePhone ha limiti anti-abuso severi).
+RESOLVE_PHONE_RATE_PER_S = 0.7
+RESOLVE_PHONE_BURST = 5
+
+
+async def _resolve_phones_stream(
+    session_string: str,
+    phones_e164: List[str],
+    max_flood_wait: float,
+):
+    """Async generator di (phone_e164, result) su un'unica connessione.
+
+    Il ritmo delle ResolvePhone e' quello della classe "resolve" del governor.
+    Un errore di rete o di autorizzazione interrompe lo stream: il pool scarta
+    il client invece di tentare i numeri restanti su una connessione morta.
+    """
+    async with _session_client(session_string) as client:
+        if client is None:
+            for phone in phones_e164:
+                yield phone, {"ok": False, "error": "session_invalid", "phone_e164": phone}
+            return
+        for n, phone in enumerate(phones_e164):
+            try:
+                resolved = await _call_with_flood_retry(
+                    client, ResolvePhoneRequest(phone=phone.lstrip("+")), max_wait=max_flood_wait
+                )
+            except PhoneNotOccupiedError:
+                resolved = None
+            except FloodWaitError as e:
+                # Attesa troppo lunga: i numeri restanti non vengono tentati.
+                for rest in phones_e164[n:]:
+                    yield rest, {
+                        "ok": False, "error": "rate_limited",
+                        "phone_e164": rest, "retry_after": e.seconds,
+                    }
+                return
+            except DISCARD_ERRORS:
+                raise
+            except Exception as e:
+                yield phone, {"ok": False, "error": f"unknown: {e}", "phone_e164": phone}
+                continue
+            users = getattr(resolved, "users", []) or []
+            if not users:
+                # PhoneNotOccupied o privacy: Telegram non distingue i due casi
+                yield phone, {"ok": False, "error": "not_on_telegram_or_privacy", "phone_e164": phone}
+                continue
+            yield phone, {"ok": True, "error": None, "phone_e164": phone, **_resolved_user_dict(users[0])}
+
+
+def resolve_phones_bulk(
+    session_string: str,
+    raw_phones: List[str],
+    on_progress: Optional[Callable[[int, int, str], None]] = None,
+    *,
+    max_flood_wait: float = FLOOD_WAIT_RETRY_MAX_S,
+) -> dict:
+    """Risolve molti numeri di telefono su un'unica connessione, con ritmo controllato.
+
+    I numeri vengono normalizzati con normalize_phone_to_e164 e deduplicati;
+    le ResolvePhone sono regolate dal governor dell'account (classe
+    "resolve", condivisa con le altre pagine) e i FloodWait brevi attesi e
+    ritentati.
+
+    on_progress(done, total, raw_phone): chiamata nel thread del chiamante
+        dopo ogni numero elaborato.
+
+    Ritorna {raw_phone: result}, con `result` nella forma di resolve_phone.
+    Errori aggiuntivi: "rate_limited" (con "retry_after": secondi) per i
+    numeri non tentati dopo un FloodWait piu' lungo di max_flood_wait.
+    Un errore di rete o di autorizzazione interrompe la sincronizzazione
+    (TelegramOperationError) e il client viene scartato dal pool.
+    """
+    results: dict = {}
+    by_e164: dict = {}
+    seen = set()
+    for raw in raw_phones:
+        if raw in seen:
+            continue
+        seen.add(raw)
+        phone_e164 = normalize_phone_to_e164(raw)
+        if not phone_e164:
+            results[raw] = {"ok": False, "error": "normalize_failed", "phone_e164": None}
+        else:
+            by_e164.setdefault(phone_e164, []).append(raw)
+
+    total = len(results) + sum(len(rs) for rs in by_e164.values())
+    done = 0
+    if on_progress is not None:
+        for raw in list(results):
+            done += 1
+            on_progress(done, total, raw)
+    if not by_e164:
+        return results
+
+    stream = _resolve_phones_stream(
+        session_string, list(by_e164), max_flood_wait
+    )
+    try:
+        for phone_e164, res in _iterate(stream):
+            for raw in by_e164[phone_e164]:
+                results[raw] = dict(res)
+                done += 1
+                if on_progress is not None:
+                    on_progress(done, total, raw)
+    except UnauthorizedError as e:
+        raise TelegramOperationError("Sessione Telegram non valida. Riconnettiti.") from e
+    except Exception as e:
+        raise TelegramOperationError(f"Errore durante la risoluzione dei numeri: {e}") from e
+    return results
+
+
 async def _get_poll_message_async(
     session_string: str, chat_ref: ChatRef, msg_id: int
 ) -> dict:
-    client = _new_client(session_string)
-    try:
-        await client.connect()
-        if not await client.is_user_authorized():
+    async with _session_client(session_string) as client:
+        if client is None:
             raise TelegramOperationError("Sessione Telegram non valida. Riconnettiti.")
         try:
-            entity = await client.get_entity(chat_ref)
+            entity = await client.get_input_entity(chat_ref)
+            msg = await client.get_messages(entity, ids=msg_id)
         except (ValueError, UsernameNotOccupiedError) as e:
             raise TelegramOperationError(
                 "Gruppo Telegram non trovato. Controlla di essere nel gruppo del link."
@@ -688,7 +1550,6 @@ async def _get_poll_message_async(
             raise TelegramOperationError(
                 "Gruppo privato a cui non hai accesso con questo account Telegram."
             ) from e
-        msg = await client.get_messages(entity, ids=msg_id)
         if msg is None:
             raise TelegramOperationError("Messaggio non trovato in questo gruppo.")
         if not isinstance(msg.media, MessageMediaPoll):
@@ -708,8 +1569,6 @@ async def _get_poll_message_async(
             "is_closed": getattr(poll, "closed", False),
             "multiple_choice": getattr(poll, "multiple_choice", False),
         }
-    finally:
-        await client.disconnect()
 
 
 def get_poll_message(session_string: str, chat_ref: ChatRef, msg_id: int) -> dict:
@@ -739,76 +1598,271 @@ def get_poll_message(session_string: str, chat_ref: ChatRef, msg_id: int) -> dic
         raise TelegramOperationError(f"Errore durante la lettura del sondaggio: {e}") from e
 
 
-async def _get_poll_voters_async(
-    session_string: str, chat_ref: ChatRef, msg_id: int, per_option_limit: int
-) -> dict:
-    client = _new_client(session_string)
+def _voters_from_votes_list(vot_res: Any) -> List[dict]:
+    """Converte un messages.VotesList in lista di votanti {user_id, username, ..., voted_at}."""
+    # Build user_id -> voted_at map dai MessagePeerVote
+    vote_dates = {}
+    for vote in (getattr(vot_res, "votes", []) or []):
+        vpeer = getattr(vote, "peer", None)
+        vuid = getattr(vpeer, "user_id", None) if vpeer is not None else None
+        if isinstance(vuid, int):
+            vote_dates[vuid] = getattr(vote, "date", None)
+    voter_list = []
+    for u in getattr(vot_res, "users", []) or []:
+        voter_list.append({
+            "user_id": u.id,
+            "username": getattr(u, "username", None),
+            "first_name": getattr(u, "first_name", "") or "",
+            "last_name": getattr(u, "last_name", "") or "",
+            "voted_at": vote_dates.get(u.id),
+        })
+    return voter_list
+
+
+# Dimensione pagina per GetPollVotes e votanti letti per opzione: di default
+# POLL_VOTERS_DEFAULT_LIMIT (4 pagine); chi vuole la lettura completa passa
+# per_option_limit=POLL_VOTERS_HARD_CAP, tetto oltre il quale non si va mai.
+# Superato il limite l'opzione viene marcata "truncated" invece di crescere senza limite.
+POLL_VOTES_PAGE_SIZE = 50
+POLL_VOTERS_DEFAULT_LIMIT = 200
+POLL_VOTERS_HARD_CAP = 5000
+
+
+async def _open_poll(client: Any, chat_ref: ChatRef, msg_id: int) -> Tuple[Any, Any]:
+    """Risolve il gruppo e legge il messaggio-sondaggio. Ritorna (entity, msg).
+
+    Solleva TelegramOperationError se il gruppo/sondaggio non e' accessibile
+    o se il sondaggio e' anonimo.
+    """
+    # get_input_entity usa la cache entita' della sessione in pool: dopo la
+    # prima risoluzione non costa RPC (get_entity farebbe sempre GetChannels).
     try:
-        await client.connect()
-        if not await client.is_user_authorized():
-            raise TelegramOperationError("Sessione Telegram non valida. Riconnettiti.")
-        try:
-            entity = await client.get_entity(chat_ref)
-        except (ValueError, UsernameNotOccupiedError) as e:
-            raise TelegramOperationError("Gruppo Telegram non trovato.") from e
-        except ChannelPrivateError as e:
-            raise TelegramOperationError("Gruppo privato non accessibile.") from e
+        entity = await client.get_input_entity(chat_ref)
         msg = await client.get_messages(entity, ids=msg_id)
-        if msg is None or not isinstance(msg.media, MessageMediaPoll):
-            raise TelegramOperationError("Sondaggio non trovato.")
-        poll = msg.media.poll
-        if not getattr(poll, "public_voters", False):
-            raise TelegramOperationError(
-                "Il sondaggio e' anonimo: Telegram non espone chi ha votato. "
-                "L'organizer deve creare un sondaggio non-anonimo."
-            )
-        results_field = getattr(msg.media, "results", None)
-        total_voters_unique = getattr(results_field, "total_voters", 0) if results_field else 0
-        options_data: List[dict] = []
-        for i, ans in enumerate(poll.answers):
-            vot_res = await client(GetPollVotesRequest(
-                peer=entity,
-                id=msg_id,
-                option=ans.option,
-                limit=per_option_limit,
-            ))
-            # Build user_id -> voted_at map dai MessagePeerVote
-            vote_dates = {}
-            for vote in (getattr(vot_res, "votes", []) or []):
-                vpeer = getattr(vote, "peer", None)
-                vuid = getattr(vpeer, "user_id", None) if vpeer is not None else None
-                if isinstance(vuid, int):
-                    vote_dates[vuid] = getattr(vote, "date", None)
-            voter_list = []
-            for u in getattr(vot_res, "users", []) or []:
-                voter_list.append({
-                    "user_id": u.id,
-                    "username": getattr(u, "username", None),
-                    "first_name": getattr(u, "first_name", "") or "",
-                    "last_name": getattr(u, "last_name", "") or "",
-                    "voted_at": vote_dates.get(u.id),
+    except (ValueError, UsernameNotOccupiedError) as e:
+        raise TelegramOperationError("Gruppo Telegram non trovato.") from e
+    except ChannelPrivateError as e:
+        raise TelegramOperationError("Gruppo privato non accessibile.") from e
+    _check_poll_message(msg)
+    return entity, msg
+
+
+def _check_poll_message(msg: Any) -> None:
+    """Solleva TelegramOperationError se `msg` non e' un sondaggio con votanti pubblici."""
+    if msg is None or not isinstance(msg.media, MessageMediaPoll):
+        raise TelegramOperationError("Sondaggio non trovato.")
+    if not getattr(msg.media.poll, "public_voters", False):
+        raise TelegramOperationError(
+            "Il sondaggio e' anonimo: Telegram non espone chi ha votato. "
+            "L'organizer deve creare un sondaggio non-anonimo."
+        )
+
+
+def _poll_summary(msg: Any) -> dict:
+    """Metadata di un messaggio-sondaggio (senza votanti)."""
+    poll = msg.media.poll
+    results_field = getattr(msg.media, "results", None)
+    total_voters_unique = getattr(results_field, "total_voters", 0) if results_field else 0
+    return {
+        "poll_id": poll.id,
+        "question": _extract_text(poll.question),
+        "is_closed": getattr(poll, "closed", False),
+        "multiple_choice": getattr(poll, "multiple_choice", False),
+        "total_voters_unique": total_voters_unique or 0,
+        "options": [{"idx": i, "text": _extract_text(ans.text)} for i, ans in enumerate(poll.answers)],
+    }
+
+
+async def _stream_option_batches(
+    client: Any,
+    peer: Any,
+    msg_id: int,
+    answers: List[Any],
+    page_size: int,
+    per_option_limit: int,
+    only_idxs: Optional[set] = None,
+):
+    """Async generator: pagine di votanti di ogni opzione, man mano che arrivano.
+
+    Le opzioni vengono lette in parallelo (semaforo POLL_VOTES_CONCURRENCY),
+    ognuna seguendo next_offset fino a esaurimento o fino a per_option_limit.
+    Ogni elemento prodotto:
+        {"idx": int, "voters": [...], "count": int | None,
+         "done": bool,        # ultima pagina per questa opzione
+         "truncated": bool}   # interrotta dal tetto con altri votanti disponibili
+    """
+    idxs = [i for i in range(len(answers)) if only_idxs is None or i in only_idxs]
+    if not idxs:
+        return
+    per_option_limit = max(1, min(per_option_limit, POLL_VOTERS_HARD_CAP))
+    queue: asyncio.Queue = asyncio.Queue()
+    semaphore = asyncio.Semaphore(POLL_VOTES_CONCURRENCY)
+
+    async def _producer(i: int) -> None:
+        try:
+            fetched = 0
+            offset = None
+            while True:
+                limit = max(1, min(page_size, per_option_limit - fetched))
+                async with semaphore:
+                    vot_res = await _call_with_flood_retry(client, GetPollVotesRequest(
+                        peer=peer,
+                        id=msg_id,
+                        option=answers[i].option,
+                        limit=limit,
+                        offset=offset,
+                    ))
+                voters = _voters_from_votes_list(vot_res)
+                fetched += len(voters)
+                offset = getattr(vot_res, "next_offset", None)
+                truncated = bool(offset) and fetched >= per_option_limit
+                done = truncated or not offset or not voters
+                await queue.put({
+                    "idx": i,
+                    "voters": voters,
+                    "count": getattr(vot_res, "count", None),
+                    "done": done,
+                    "truncated": truncated,
                 })
-            options_data.append({
-                "idx": i,
-                "text": _extract_text(ans.text),
-                "voters": voter_list,
-                "voter_count": len(voter_list),
-            })
-        return {
-            "poll_id": poll.id,
-            "question": _extract_text(poll.question),
-            "is_closed": getattr(poll, "closed", False),
-            "multiple_choice": getattr(poll, "multiple_choice", False),
-            "total_voters_unique": total_voters_unique,
-            "options": options_data,
-        }
+                if done:
+                    return
+        except Exception as e:
+            # Propagato al consumatore, che lo rilancia.
+            await queue.put(e)
+
+    tasks = [asyncio.ensure_future(_producer(i)) for i in idxs]
+    pending = len(tasks)
+    try:
+        while pending:
+            item = await queue.get()
+            if isinstance(item, Exception):
+                raise item
+            if item["done"]:
+                pending -= 1
+            yield item
     finally:
-        await client.disconnect()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def iter_poll_voters(
+    session_string: str,
+    chat_ref: ChatRef,
+    msg_id: int,
+    *,
+    page_size: int = POLL_VOTES_PAGE_SIZE,
+    per_option_limit: int = POLL_VOTERS_DEFAULT_LIMIT,
+):
+    """Async generator dei votanti di un sondaggio, a pagine, man mano che arrivano.
+
+    Va consumato sul loop del pool (es. dentro una coroutine passata a
+    get_client_pool().run). Produce prima un evento di metadata e poi un
+    evento per ogni pagina di votanti:
+
+        {"type": "poll", "poll_id", "question", "is_closed", "multiple_choice",
+         "total_voters_unique", "options": [{"idx", "text"}, ...]}
+        {"type": "voters", "idx": int, "voters": [...], "count": int | None,
+         "done": bool, "truncated": bool}
+
+    Gli errori Telethon (PollVoteRequired, FloodWait lunghi, ...) risalgono
+    al chiamante; quelli user-facing come TelegramOperationError.
+    """
+    chat_ref = _normalize_chat_ref(chat_ref)
+    async with _session_client(session_string) as client:
+        if client is None:
+            raise TelegramOperationError("Sessione Telegram non valida. Riconnettiti.")
+        entity, msg = await _open_poll(client, chat_ref, msg_id)
+        yield {"type": "poll", **_poll_summary(msg)}
+        async for batch in _stream_option_batches(
+            client, entity, msg_id, msg.media.poll.answers, page_size, per_option_limit
+        ):
+            yield {"type": "voters", **batch}
+
+
+def _poll_option_counts(msg: Any) -> Optional[dict]:
+    """Numero di votanti per opzione dai `results` del messaggio, {str(idx): int}.
+
+    None se Telegram non ha incluso i conteggi (es. risultati "min"): in quel
+    caso il chiamante deve considerare cambiate tutte le opzioni.
+    """
+    results_field = getattr(msg.media, "results", None)
+    answer_results = getattr(results_field, "results", None) if results_field else None
+    if answer_results is None or getattr(results_field, "min", False):
+        return None
+    by_option = {r.option: getattr(r, "voters", 0) or 0 for r in answer_results}
+    return {
+        str(i): by_option.get(ans.option, 0)
+        for i, ans in enumerate(msg.media.poll.answers)
+    }
+
+
+def _merge_voter_batch(option: dict, batch: dict) -> None:
+    """Accoda una pagina di votanti all'opzione, ignorando eventuali duplicati."""
+    seen = option.setdefault("_seen", set())
+    for v in batch["voters"]:
+        if v["user_id"] in seen:
+            continue
+        seen.add(v["user_id"])
+        option["voters"].append(v)
+    option["truncated"] = option.get("truncated", False) or batch["truncated"]
+
+
+def _finalize_poll_voters(result: dict) -> dict:
+    for opt in result["options"]:
+        opt.pop("_seen", None)
+        opt["voter_count"] = len(opt["voters"])
+        opt.setdefault("truncated", False)
+    result["truncated"] = any(o["truncated"] for o in result["options"])
+    return result
+
+
+def _poll_voters_error_message(e: Exception) -> str:
+    """Messaggio user-facing per un errore nella lettura dei votanti."""
+    if isinstance(e, TelegramOperationError):
+        return str(e)
+    if isinstance(e, PollVoteRequiredError):
+        return (
+            "Per leggere i votanti devi prima votare tu stesso nel sondaggio "
+            "(vincolo di Telegram). Apri il sondaggio in Telegram, vota una "
+            "qualunque opzione, poi torna qui e premi Aggiorna."
+        )
+    if isinstance(e, FloodWaitError):
+        return f"Telegram rate limit, riprova fra {e.seconds}s."
+    return f"Errore durante la lettura dei votanti: {e}"
+
+
+async def _get_poll_voters_async(
+    session_string: str, chat_ref: ChatRef, msg_id: int, per_option_limit: int, page_size: int
+) -> dict:
+    result: Optional[dict] = None
+    async for event in iter_poll_voters(
+        session_string, chat_ref, msg_id, page_size=page_size, per_option_limit=per_option_limit
+    ):
+        if event["type"] == "poll":
+            result = {k: v for k, v in event.items() if k != "type"}
+            result["options"] = [
+                {"idx": o["idx"], "text": o["text"], "voters": [], "truncated": False}
+                for o in result["options"]
+            ]
+        else:
+            _merge_voter_batch(result["options"][event["idx"]], event)
+    return _finalize_poll_voters(result)
+
 
 def get_poll_voters(
-    session_string: str, chat_ref: ChatRef, msg_id: int, per_option_limit: int = 200
+    session_string: str,
+    chat_ref: ChatRef,
+    msg_id: int,
+    per_option_limit: int = POLL_VOTERS_DEFAULT_LIMIT,
+    page_size: int = POLL_VOTES_PAGE_SIZE,
 ) -> dict:
-    """Ritorna l'elenco dei votanti per ogni opzione di un sondaggio non-anonimo.
+    """Ritorna l'elenco completo dei votanti per ogni opzione di un sondaggio non-anonimo.
+
+    Sfoglia GetPollVotes a pagine da `page_size` seguendo next_offset, fino a
+    un massimo di `per_option_limit` votanti per opzione (default
+    POLL_VOTERS_DEFAULT_LIMIT; POLL_VOTERS_HARD_CAP per la lettura completa,
+    valori maggiori vengono ridotti al tetto).
 
     Output:
         {
@@ -817,12 +1871,14 @@ def get_poll_voters(
           "is_closed": bool,
           "multiple_choice": bool,
           "total_voters_unique": int,
+          "truncated": bool,   # True se almeno un'opzione ha raggiunto il tetto
           "options": [
             {
               "idx": int,
               "text": str,
               "voter_count": int,
-              "voters": [{user_id, username, first_name, last_name}, ...],
+              "truncated": bool,
+              "voters": [{user_id, username, first_name, last_name, voted_at}, ...],
             },
             ...
           ],
@@ -831,21 +1887,281 @@ def get_poll_voters(
     Solleva TelegramOperationError("POLL_VOTE_REQUIRED") se l'organizer non
     ha ancora votato nel sondaggio (vincolo Telegram).
     """
+    try:
+        return _run(_get_poll_voters_async(
+            session_string, chat_ref, msg_id, per_option_limit, page_size
+        ))
+    except TelegramOperationError:
+        raise
+    except Exception as e:
+        raise TelegramOperationError(_poll_voters_error_message(e)) from e
+
+
+async def _get_poll_voters_delta_async(
+    session_string: str,
+    chat_ref: ChatRef,
+    msg_id: int,
+    known_counts: Optional[dict],
+    per_option_limit: int,
+    page_size: int,
+) -> dict:
+    async with _session_client(session_string) as client:
+        if client is None:
+            raise TelegramOperationError("Sessione Telegram non valida. Riconnettiti.")
+        entity, msg = await _open_poll(client, chat_ref, msg_id)
+        return await _poll_delta(client, entity, msg, known_counts, per_option_limit, page_size)
+
+
+async def _poll_delta(
+    client: Any, entity: Any, msg: Any, known_counts: Optional[dict], per_option_limit: int, page_size: int
+) -> dict:
+    """Output di get_poll_voters_delta per un messaggio-sondaggio gia' letto."""
+    result = _poll_summary(msg)
+    counts = _poll_option_counts(msg)
+    if counts is None or known_counts is None:
+        changed_idxs = set(range(len(result["options"])))
+    else:
+        changed_idxs = {
+            int(k) for k, n in counts.items() if known_counts.get(k) != n
+        }
+    result["option_counts"] = counts or {}
+    changed = {
+        i: {"idx": i, "text": result["options"][i]["text"], "voters": [], "truncated": False}
+        for i in sorted(changed_idxs)
+    }
+    # Le opzioni passate a zero votanti non richiedono RPC.
+    to_fetch = {i for i in changed_idxs if counts is None or counts[str(i)] > 0}
+    async for batch in _stream_option_batches(
+        client, entity, msg.id, msg.media.poll.answers,
+        page_size, per_option_limit, only_idxs=to_fetch,
+    ):
+        _merge_voter_batch(changed[batch["idx"]], batch)
+    result["changed_options"] = list(changed.values())
+    for opt in result["changed_options"]:
+        opt.pop("_seen", None)
+        opt["voter_count"] = len(opt["voters"])
+    result["truncated"] = any(o["truncated"] for o in result["changed_options"])
+    return result
+
+
+def get_poll_voters_delta(
+    session_string: str,
+    chat_ref: ChatRef,
+    msg_id: int,
+    known_counts: Optional[dict] = None,
+    per_option_limit: int = POLL_VOTERS_DEFAULT_LIMIT,
+    page_size: int = POLL_VOTES_PAGE_SIZE,
+) -> dict:
+    """Refresh incrementale: scarica i votanti solo delle opzioni cambiate.
+
+    `known_counts` e' il dict {str(idx): voter_count} salvato al refresh
+    precedente (campo "option_counts" di questo stesso output). Il messaggio
+    viene letto una volta sola e i conteggi in `results` confrontati con
+    quelli noti: un sondaggio senza voti nuovi costa una sola RPC. Con
+    `known_counts=None` (primo refresh) tutte le opzioni sono considerate
+    cambiate.
+
+    Limite: un voto ritirato e uno nuovo sulla stessa opzione fra due refresh
+    lasciano il conteggio invariato e non vengono rilevati.
+
+    Output:
+        {
+          "poll_id", "question", "is_closed", "multiple_choice",
+          "total_voters_unique",
+          "options": [{"idx": int, "text": str}, ...],      # tutte
+          "option_counts": {str(idx): int},                 # {} se non disponibili
+          "changed_options": [                              # solo le cambiate
+            {"idx", "text", "voter_count", "truncated", "voters": [...]},
+          ],
+          "truncated": bool,
+        }
+    """
     chat_ref = _normalize_chat_ref(chat_ref)
     try:
-        return _run(_get_poll_voters_async(session_string, chat_ref, msg_id, per_option_limit))
+        return _run(_get_poll_voters_delta_async(
+            session_string, chat_ref, msg_id, known_counts, per_option_limit, page_size
+        ))
     except TelegramOperationError:
         raise
-    except PollVoteRequiredError as e:
-        raise TelegramOperationError(
-            "Per leggere i votanti devi prima votare tu stesso nel sondaggio "
-            "(vincolo di Telegram). Apri il sondaggio in Telegram, vota una "
-            "qualunque opzione, poi torna qui e premi Aggiorna."
-        ) from e
-    except FloodWaitError as e:
-        raise TelegramOperationError(f"Telegram rate limit, riprova fra {e.seconds}s.") from e
     except Exception as e:
-        raise TelegramOperationError(f"Errore durante la lettura dei votanti: {e}") from e
+        raise TelegramOperationError(_poll_voters_error_message(e)) from e
+
+
+async def _get_poll_voters_delta_batch_async(
+    session_string: str, polls: List[dict], per_option_limit: int, page_size: int
+) -> List[dict]:
+    results: List[Optional[dict]] = [None] * len(polls)
+    by_chat: Dict[ChatRef, List[int]] = {}
+    for pos, poll in enumerate(polls):
+        by_chat.setdefault(_normalize_chat_ref(poll["chat_ref"]), []).append(pos)
+
+    async with _session_client(session_string) as client:
+        if client is None:
+            raise TelegramOperationError("Sessione Telegram non valida. Riconnettiti.")
+        semaphore = asyncio.Semaphore(POLL_BATCH_CONCURRENCY)
+
+        async def _one(pos: int, entity: Any, msg: Any) -> None:
+            try:
+                _check_poll_message(msg)
+                async with semaphore:
+                    delta = await _poll_delta(
+                        client, entity, msg, polls[pos].get("known_counts"), per_option_limit, page_size
+                    )
+                results[pos] = {"ok": True, "delta": delta}
+            except Exception as e:
+                results[pos] = {"ok": False, "error": _poll_voters_error_message(e)}
+
+        jobs = []
+        for chat_ref, positions in by_chat.items():
+            # Un gruppo e una get_messages per tutti i sondaggi dello stesso gruppo.
+            try:
+                try:
+                    entity = await client.get_input_entity(chat_ref)
+                    msgs = await client.get_messages(entity, ids=[polls[p]["msg_id"] for p in positions])
+                except (ValueError, UsernameNotOccupiedError) as e:
+                    raise TelegramOperationError("Gruppo Telegram non trovato.") from e
+                except ChannelPrivateError as e:
+                    raise TelegramOperationError("Gruppo privato non accessibile.") from e
+            except Exception as e:
+                for pos in positions:
+                    results[pos] = {"ok": False, "error": _poll_voters_error_message(e)}
+                continue
+            jobs.extend(_one(pos, entity, msg) for pos, msg in zip(positions, msgs))
+        await asyncio.gather(*jobs)
+    return results
+
+
+def get_poll_voters_delta_batch(
+    session_string: str,
+    polls: List[dict],
+    per_option_limit: int = POLL_VOTERS_DEFAULT_LIMIT,
+    page_size: int = POLL_VOTES_PAGE_SIZE,
+) -> List[dict]:
+    """Refresh incrementale di piu' sondaggi sulla stessa connessione.
+
+    `polls`: [{"chat_ref", "msg_id", "known_counts"}, ...] (known_counts come
+    in get_poll_voters_delta, anche None). Ogni gruppo viene risolto una
+    volta e i suoi sondaggi letti con una sola get_messages; i votanti delle
+    opzioni cambiate si scaricano in parallelo su piu' sondaggi
+    (POLL_BATCH_CONCURRENCY alla volta, ognuno con le sue opzioni in
+    parallelo), sempre sotto il governor dell'account.
+
+    Ritorna una lista allineata a `polls`:
+        {"ok": True, "delta": <output di get_poll_voters_delta>}
+        {"ok": False, "error": str}    # messaggio user-facing
+    Un sondaggio in errore non ferma gli altri; solleva TelegramOperationError
+    solo se la sessione non e' valida.
+    """
+    if not polls:
+        return []
+    try:
+        return _run(_get_poll_voters_delta_batch_async(session_string, polls, per_option_limit, page_size))
+    except TelegramOperationError:
+        raise
+    except Exception as e:
+        raise TelegramOperationError(_poll_voters_error_message(e)) from e
+
+
+# ---------------------------------------------------------------------------
+# API async per i processi in background (worker.py)
+#
+# Da usare solo sul loop del pool (es. dentro get_client_pool().run(...)):
+# gli errori Telethon risalgono cosi' come sono, senza mapping per la UI.
+# ---------------------------------------------------------------------------
+
+async def get_poll_voters_delta_async(
+    session_string: str,
+    chat_ref: ChatRef,
+    msg_id: int,
+    known_counts: Optional[dict] = None,
+    per_option_limit: int = POLL_VOTERS_DEFAULT_LIMIT,
+    page_size: int = POLL_VOTES_PAGE_SIZE,
+) -> dict:
+    """Versione async di get_poll_voters_delta (stesso output)."""
+    return await _get_poll_voters_delta_async(
+        session_string, _normalize_chat_ref(chat_ref), msg_id,
+        known_counts, per_option_limit, page_size,
+    )
+
+
+async def send_dm_async(
+    session_string: str,
+    recipient: Any,
+    text: str,
+    *,
+    on_pause: Optional[Callable[[int], None]] = None,
+    max_flood_wait: Optional[float] = None,
+) -> dict:
+    """Un singolo DM, con lo stesso risultato di send_dm (per i job di invio reminder).
+
+    on_pause(seconds): chiamata quando Telegram impone un FloodWait breve,
+    prima di attenderlo. PeerFloodError e FloodWaitError oltre
+    `max_flood_wait` (default DM_FLOOD_WAIT_MAX_S) risalgono: fermano l'intero
+    job, non solo il destinatario. Le altre eccezioni risalgono solo prima
+    dell'invio (connessione, risoluzione del destinatario): da SendMessage in
+    poi ogni errore diventa un risultato.
+    """
+    if max_flood_wait is None:
+        max_flood_wait = DM_FLOOD_WAIT_MAX_S
+    async with _session_client(session_string) as client:
+        if client is None:
+            return {"ok": False, "error": "session_invalid", "fallback_link": None}
+        target = (await _resolve_dm_recipients(client, [recipient])).get(recipient)
+        if target is None:
+            return {"ok": False, "error": "unknown_user", "fallback_link": None}
+        res = None
+        try:
+            async for ev in _send_one_dm(client, target, text, max_flood_wait):
+                if ev.get("type") == "paused":
+                    if on_pause is not None:
+                        on_pause(ev["seconds"])
+                else:
+                    res = ev
+        except (PeerFloodError, FloodWaitError):
+            raise
+        except Exception as e:
+            res = {"ok": False, "error": f"unknown: {e}", "fallback_link": None}
+        return res
+
+
+async def _drain_queue(queue: asyncio.Queue):
+    while True:
+        yield await queue.get()
+
+
+@asynccontextmanager
+async def poll_update_stream(session_string: str, max_pending: int = 1000):
+    """Async context manager: stream degli UpdateMessagePoll ricevuti dall'account.
+
+        async with poll_update_stream(session_string) as updates:
+            async for update in updates:
+                ...  # update.poll_id, update.results
+
+    Il client pooled resta in uso per tutta la durata del contesto. Se il
+    consumatore resta indietro oltre `max_pending` update, quelli in eccesso
+    vengono scartati: chi consuma deve prevedere una risincronizzazione
+    periodica (Telegram comunque non garantisce la consegna degli update
+    dei supergruppi non aperti di recente).
+    """
+    async with _session_client(session_string) as client:
+        if client is None:
+            raise TelegramOperationError("Sessione Telegram non valida. Riconnettiti.")
+        queue: asyncio.Queue = asyncio.Queue(max_pending)
+
+        async def _on_update(update: Any) -> None:
+            try:
+                queue.put_nowait(update)
+            except asyncio.QueueFull:
+                pass
+
+        client.add_event_handler(_on_update, events.Raw(UpdateMessagePoll))
+        try:
+            # Una richiesta updates.getState segnala a Telegram che questa
+            # connessione vuole ricevere gli update.
+            await client(GetStateRequest())
+            yield _drain_queue(queue)
+        finally:
+            client.remove_event_handler(_on_update)
 
 
 # ---------------------------------------------------------------------------
@@ -853,39 +2169,37 @@ def get_poll_voters(
 # ---------------------------------------------------------------------------
 
 async def _send_dm_async(session_string: str, recipient: Any, text: str) -> dict:
-    client = _new_client(session_string)
-    try:
-        await client.connect()
-        if not await client.is_user_authorized():
+    async with _session_client(session_string) as client:
+        if client is None:
             return {"ok": False, "error": "session_invalid", "fallback_link": None}
         # Risolvi entity: recipient puo' essere user_id (int) o username (str senza @)
+        # La InputPeer arriva dalla cache entita' (persistente, se legata) o
+        # da ResolveUsername; username e id dalla stessa cache, senza GetUsers.
         try:
-            entity = await client.get_entity(recipient)
+            entity = await client.get_input_entity(recipient)
         except (UsernameNotOccupiedError, UsernameInvalidError, ValueError):
             return {"ok": False, "error": "unknown_user", "fallback_link": None}
-        uname = getattr(entity, "username", None)
+        user_id, uname = _cached_peer_info(client, entity)
         fb = f"https://t.me/{uname}" if uname else None
         try:
             await client.send_message(entity, text)
             return {
                 "ok": True,
                 "error": None,
-                "user_id": entity.id,
+                "user_id": user_id,
                 "username": uname,
                 "fallback_link": fb,
             }
         except UserPrivacyRestrictedError:
-            return {"ok": False, "error": "privacy", "user_id": entity.id, "username": uname, "fallback_link": fb}
+            return {"ok": False, "error": "privacy", "user_id": user_id, "username": uname, "fallback_link": fb}
         except UserIsBlockedError:
-            return {"ok": False, "error": "blocked_by_user", "user_id": entity.id, "username": uname, "fallback_link": fb}
+            return {"ok": False, "error": "blocked_by_user", "user_id": user_id, "username": uname, "fallback_link": fb}
         except YouBlockedUserError:
-            return {"ok": False, "error": "you_blocked_them", "user_id": entity.id, "username": uname, "fallback_link": fb}
+            return {"ok": False, "error": "you_blocked_them", "user_id": user_id, "username": uname, "fallback_link": fb}
         except InputUserDeactivatedError:
-            return {"ok": False, "error": "deactivated", "user_id": entity.id, "username": uname, "fallback_link": None}
+            return {"ok": False, "error": "deactivated", "user_id": user_id, "username": uname, "fallback_link": None}
         except (PeerIdInvalidError, UserIdInvalidError):
             return {"ok": False, "error": "invalid_id", "fallback_link": fb}
-    finally:
-        await client.disconnect()
 
 
 def send_dm(session_string: str, recipient: Any, text: str) -> dict:
@@ -923,3 +2237,160 @@ def send_dm(session_string: str, recipient: Any, text: str) -> dict:
         raise
     except Exception as e:
         return {"ok": False, "error": f"unknown: {e}", "fallback_link": None}
+
+
+# ---------------------------------------------------------------------------
+# Invio DM in batch
+# ---------------------------------------------------------------------------
+
+# Ritmo di invio DM (classe "dm" del governor): `DM_RATE_PER_S` messaggi/s a
+# regime e burst iniziale di `DM_BURST`, per account. FloodWait fino a DM_FLOOD_WAIT_MAX_S vengono
+# attesi e l'invio riprende dallo stesso destinatario; oltre, il batch si ferma.
+DM_RATE_PER_S = 0.8
+DM_BURST = 3
+DM_FLOOD_WAIT_MAX_S = 180
+
+
+async def _resolve_dm_recipients(client: Any, recipients: List[Any]) -> dict:
+    """Risolve i destinatari (user_id o username) una volta sola, prima dell'invio.
+
+    Ritorna {recipient: (input_peer, user_id, username) | None}; None se il
+    destinatario non esiste o non e' in cache. Le InputPeer vengono dalla
+    cache entita' della sessione (o da ResolveUsername per gli username
+    nuovi), username e id dalla stessa cache: nessuna GetUsers.
+    """
+    resolved = {}
+    for r in recipients:
+        if r in resolved:
+            continue
+        try:
+            peer = await client.get_input_entity(r)
+        except (UsernameNotOccupiedError, UsernameInvalidError, ValueError):
+            resolved[r] = None
+            continue
+        user_id, uname = _cached_peer_info(client, peer)
+        resolved[r] = (peer, user_id, uname)
+    return resolved
+
+
+async def _send_one_dm(
+    client: Any, target: Tuple[Any, int, Optional[str]], text: str, max_flood_wait: float,
+):
+    """Async generator: invia un DM, producendo eventuali pause per FloodWait e infine il risultato."""
+    peer, user_id, uname = target
+    fb = f"https://t.me/{uname}" if uname else None
+    base = {"user_id": user_id, "username": uname, "fallback_link": fb}
+    while True:
+        try:
+            # Come _send_dm_async (parse_mode, conversione della peer): la
+            # SendMessageRequest passa dal governor nella classe "dm"; senza
+            # flood-sleep automatico, per segnalare le pause al chiamante.
+            with _flood_sleep_threshold(0):
+                await client.send_message(peer, text)
+            yield {"ok": True, "error": None, **base}
+            return
+        except FloodWaitError as e:
+            if e.seconds > max_flood_wait:
+                raise
+            yield {"type": "paused", "seconds": e.seconds}
+            with telegram_metrics.timed(telegram_metrics.RETRY, "SendMessageRequest", flood_wait_s=e.seconds):
+                await asyncio.sleep(e.seconds + 1)
+        except UserPrivacyRestrictedError:
+            yield {"ok": False, "error": "privacy", **base}
+            return
+        except UserIsBlockedError:
+            yield {"ok": False, "error": "blocked_by_user", **base}
+            return
+        except YouBlockedUserError:
+            yield {"ok": False, "error": "you_blocked_them", **base}
+            return
+        except InputUserDeactivatedError:
+            yield {"ok": False, "error": "deactivated", **base, "fallback_link": None}
+            return
+        except (PeerIdInvalidError, UserIdInvalidError):
+            yield {"ok": False, "error": "invalid_id", "fallback_link": fb}
+            return
+
+
+async def _send_dm_batch_stream(
+    session_string: str,
+    messages: List[Tuple[Any, str]],
+    max_flood_wait: float,
+):
+    """Async generator degli eventi di un invio in batch (vedi send_dm_batch)."""
+    async with _session_client(session_string) as client:
+        if client is None:
+            for i in range(len(messages)):
+                yield {"type": "result", "index": i,
+                       "result": {"ok": False, "error": "session_invalid", "fallback_link": None}}
+            return
+        resolved = await _resolve_dm_recipients(client, [r for r, _ in messages])
+        for i, (recipient, text) in enumerate(messages):
+            target = resolved.get(recipient)
+            if target is None:
+                res = {"ok": False, "error": "unknown_user", "fallback_link": None}
+            else:
+                res = None
+                try:
+                    async for ev in _send_one_dm(client, target, text, max_flood_wait):
+                        if ev.get("type") == "paused":
+                            yield {"type": "paused", "index": i, "seconds": ev["seconds"]}
+                        else:
+                            res = ev
+                except (PeerFloodError, FloodWaitError):
+                    raise
+                except Exception as e:
+                    res = {"ok": False, "error": f"unknown: {e}", "fallback_link": None}
+            yield {"type": "result", "index": i, "result": res}
+
+
+def send_dm_batch(
+    session_string: str,
+    messages: List[Tuple[Any, str]],
+    on_result: Optional[Callable[[int, dict], None]] = None,
+    on_pause: Optional[Callable[[int, int], None]] = None,
+    *,
+    max_flood_wait: float = DM_FLOOD_WAIT_MAX_S,
+) -> List[dict]:
+    """Invia piu' DM sulla stessa connessione, con ritmo adattivo.
+
+    messages: lista di (recipient, text), recipient come in send_dm.
+    on_result(index, result): chiamata nel thread del chiamante appena un
+        invio e' concluso; `result` ha la stessa forma del ritorno di send_dm.
+    on_pause(index, seconds): chiamata quando Telegram impone un FloodWait
+        (<= max_flood_wait): l'invio si mette in pausa e poi riprende.
+
+    I destinatari vengono risolti tutti all'inizio; l'invio e' regolato dal
+    governor dell'account (classe "dm": DM_RATE_PER_S, DM_BURST), condiviso
+    con gli altri invii dello stesso account. Ritorna la lista dei risultati, nello
+    stesso ordine di `messages`.
+
+    Solleva TelegramOperationError, dopo aver notificato i risultati gia'
+    ottenuti, per gli errori che bloccano l'intero batch:
+      - PeerFloodError (anti-spam Telegram);
+      - FloodWaitError piu' lungo di max_flood_wait.
+    """
+    results: List[dict] = []
+    stream = _send_dm_batch_stream(session_string, list(messages), max_flood_wait)
+    try:
+        for ev in _iterate(stream):
+            if ev["type"] == "paused":
+                if on_pause is not None:
+                    on_pause(ev["index"], ev["seconds"])
+                continue
+            results.append(ev["result"])
+            if on_result is not None:
+                on_result(ev["index"], ev["result"])
+    except PeerFloodError as e:
+        raise TelegramOperationError(
+            "Telegram ha temporaneamente bloccato il tuo account dall'invio di DM verso "
+            "non-contatti (protezione anti-spam). Attendi qualche ora prima di riprovare, "
+            "oppure aggiungi i destinatari ai tuoi contatti Telegram."
+        ) from e
+    except FloodWaitError as e:
+        raise TelegramOperationError(f"Rate limit Telegram: riprova fra {e.seconds}s.") from e
+    except TelegramOperationError:
+        raise
+    except Exception as e:
+        raise TelegramOperationError(f"Errore durante l'invio dei DM: {e}") from e
+    return results
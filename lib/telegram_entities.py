@@ -0,0 +1,110 @@
+"""
+Cache persistente delle entita' Telegram (peer id, access_hash, username).
+
+Una StringSession non contiene la cache entita' di Telethon: ogni client
+nuovo (riavvio del processo, eviction dal pool) deve risolvere di nuovo
+gruppi e utenti, e un `user_id` numerico mai visto da quel client non e'
+risolvibile affatto (ValueError). Gli access_hash sono pero' stabili per
+coppia (account, peer): li persistiamo per organizer e li ricarichiamo nella
+sessione in memoria del client prima dell'uso.
+
+Gli access_hash sono legati all'account Telegram che li ha ottenuti: la
+cache va svuotata quando l'organizer si disconnette o collega un altro
+account (le pagine cancellano il campo insieme alla sessione cifrata).
+
+Backend:
+- MemoryEntityStore: solo in processo (test, worker senza Firestore);
+- FirestoreEntityStore: un campo mappa nel documento organizers/{email}.
+"""
+
+from __future__ import annotations
+
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# (marked peer id, access_hash, username lowercase o None)
+EntityRow = Tuple[int, int, Optional[str]]
+
+
+class EntityStore(ABC):
+    """Interfaccia dei backend di persistenza delle entita' di un organizer.
+
+    `key` identifica il contenuto persistito: due istanze con la stessa key
+    (es. ricreate a ogni rerun Streamlit) puntano agli stessi dati, quindi un
+    client gia' idratato da una non va idratato di nuovo dall'altra.
+    """
+
+    key: str = ""
+
+    @abstractmethod
+    def load(self) -> List[EntityRow]:
+        ...
+
+    @abstractmethod
+    def save(self, rows: Iterable[EntityRow]) -> None:
+        ...
+
+
+class MemoryEntityStore(EntityStore):
+    """Store in memoria, per test e processi senza Firestore."""
+
+    def __init__(self, key: str = "memory"):
+        self.key = key
+        self._lock = threading.Lock()
+        self._rows: Dict[int, EntityRow] = {}
+
+    def load(self) -> List[EntityRow]:
+        with self._lock:
+            return list(self._rows.values())
+
+    def save(self, rows: Iterable[EntityRow]) -> None:
+        with self._lock:
+            for row in rows:
+                self._rows[row[0]] = row
+
+
+class FirestoreEntityStore(EntityStore):
+    """Entita' salvate nel documento organizer, campo mappa `field`.
+
+    Formato: {field: {"<marked_id>": {"h": access_hash, "u": username}}}.
+    Le scritture sono merge dei soli peer nuovi. Oltre `max_entries` voci
+    non se ne aggiungono altre (il documento Firestore ha un limite di 1 MiB):
+    gruppi e canali hanno la precedenza sugli utenti.
+    """
+
+    DEFAULT_FIELD = "telegram_entity_cache"
+
+    def __init__(self, doc_ref: Any, field: str = DEFAULT_FIELD, max_entries: int = 4000):
+        self._doc_ref = doc_ref
+        self._field = field
+        self.max_entries = max_entries
+        self.key = f"firestore:{doc_ref.path}:{field}"
+        self._lock = threading.Lock()
+        self._known: set = set()
+
+    def load(self) -> List[EntityRow]:
+        snap = self._doc_ref.get([self._field])
+        data = (snap.to_dict() or {}).get(self._field) or {}
+        rows: List[EntityRow] = []
+        for peer_id, item in data.items():
+            try:
+                rows.append((int(peer_id), int(item.get("h", 0)), item.get("u") or None))
+            except (TypeError, ValueError, AttributeError):
+                continue
+        with self._lock:
+            self._known = {r[0] for r in rows}
+        return rows
+
+    def save(self, rows: Iterable[EntityRow]) -> None:
+        # Peer id negativi = gruppi/canali: prima loro.
+        ordered = sorted(rows, key=lambda r: r[0] >= 0)
+        payload = {}
+        with self._lock:
+            for peer_id, access_hash, username in ordered:
+                if peer_id not in self._known and len(self._known) >= self.max_entries:
+                    continue
+                self._known.add(peer_id)
+                payload[str(peer_id)] = {"h": access_hash, "u": username}
+        if payload:
+            self._doc_ref.set({self._field: payload}, merge=True)
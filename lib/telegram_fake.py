@@ -0,0 +1,773 @@
+"""
+Backend Telegram finto, in memoria, per test e benchmark senza un account reale.
+
+Implementa la parte di TelegramClient usata da lib/telegram_client.py
+(connect, is_user_authorized, get_me, get_entity, get_input_entity,
+get_messages, iter_messages, iter_dialogs, send_message, log_out, login e le
+richieste raw GetPollVotes / ResolvePhone / ResolveUsername / SendMessage /
+GetState) sopra un "mondo" condiviso: utenti, gruppi, sondaggi con votanti.
+Le risposte sono tipi TL veri di Telethon, quindi il parsing del modulo
+client gira senza modifiche; le richieste passano dal governor dei
+rate-limit come quelle dei client reali.
+
+    backend = FakeTelegramBackend(latency_s=0.05, connect_latency_s=0.4)
+    session = backend.add_account("Organizer")
+    chat_id, msg_id = backend.synthetic_poll(session, n_voters=1000, n_options=4)
+    set_client_factory(backend.client)
+    get_poll_voters(session, chat_id, msg_id)
+    backend.stats()  # {"rpc": {"GetPollVotesRequest": 20, ...}, "connects": 1, ...}
+
+Configurabili: latenza per RPC (con jitter) e per l'handshake, FloodWait o
+altri errori iniettati su un tipo di richiesta (inject_flood_wait,
+inject_error), esito dei DM per destinatario (FakeUser.dm_error) e
+visibilita' del numero (FakeUser.phone_discoverable).
+
+Le sessioni sono stringhe opache ("fake:<n>") associate a un account del
+backend. Come la cache entita' di Telethon, quella del client finto si
+riempie con gli utenti e i gruppi visti nelle risposte; con
+`warm_cache=True` (default) i gruppi dell'account sono gia' in cache alla
+connessione, come dopo l'idratazione da un EntityStore.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import itertools
+import random
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from telethon.errors import (
+    ChannelPrivateError,
+    FloodWaitError,
+    PeerIdInvalidError,
+    PhoneCodeInvalidError,
+    PhoneNotOccupiedError,
+    SessionPasswordNeededError,
+    UsernameNotOccupiedError,
+)
+from telethon.tl import types
+from telethon.tl.functions.auth import LogOutRequest
+from telethon.tl.functions.channels import GetMessagesRequest as GetChannelMessagesRequest
+from telethon.tl.functions.contacts import ResolvePhoneRequest, ResolveUsernameRequest
+from telethon.tl.functions.messages import (
+    GetDialogsRequest,
+    GetMessagesRequest,
+    GetPollVotesRequest,
+    SearchRequest,
+    SendMessageRequest,
+)
+from telethon.tl.functions.updates import GetStateRequest
+from telethon.tl.functions.users import GetUsersRequest
+from telethon.tl.types.contacts import ResolvedPeer
+from telethon.tl.types.messages import VotesList
+from telethon.utils import get_peer_id
+
+from lib.telegram_client import _governed_call
+
+# Codice di login accettato da sign_in (il backend non manda SMS).
+LOGIN_CODE = "12345"
+# Elementi per pagina delle richieste paginate (come Telethon).
+DIALOGS_PAGE_SIZE = 100
+SEARCH_PAGE_SIZE = 100
+GET_MESSAGES_MAX_IDS = 100
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+# ---------------------------------------------------------------------------
+# Mondo finto
+# ---------------------------------------------------------------------------
+
+@dataclass
+class FakeUser:
+    id: int
+    access_hash: int
+    first_name: str = ""
+    last_name: str = ""
+    username: Optional[str] = None
+    phone: Optional[str] = None            # solo cifre, senza "+"
+    phone_discoverable: bool = True        # ResolvePhone lo trova
+    # Errore Telethon sollevato dai DM verso questo utente (es.
+    # UserPrivacyRestrictedError); None = consegnato.
+    dm_error: Optional[type] = None
+    password: Optional[str] = None         # 2FA per il login
+
+    def tl(self, is_self: bool = False) -> types.User:
+        return types.User(
+            id=self.id,
+            is_self=is_self or None,
+            access_hash=self.access_hash,
+            first_name=self.first_name,
+            last_name=self.last_name or None,
+            username=self.username,
+            phone=self.phone,
+        )
+
+
+@dataclass
+class FakePoll:
+    msg_id: int
+    poll_id: int
+    question: str
+    options: List[str]
+    date: datetime
+    public_voters: bool = True
+    multiple_choice: bool = False
+    closed: bool = False
+    # Per opzione: user_id -> data del voto.
+    votes: List[Dict[int, datetime]] = field(default_factory=list)
+
+    def option_bytes(self, idx: int) -> bytes:
+        return bytes([idx])
+
+    def voters(self) -> set:
+        return set().union(*self.votes) if self.votes else set()
+
+    def tl_media(self) -> types.MessageMediaPoll:
+        return types.MessageMediaPoll(
+            poll=types.Poll(
+                id=self.poll_id,
+                question=types.TextWithEntities(self.question, []),
+                answers=[
+                    types.PollAnswer(types.TextWithEntities(text, []), self.option_bytes(i))
+                    for i, text in enumerate(self.options)
+                ],
+                hash=0,
+                closed=self.closed or None,
+                public_voters=self.public_voters or None,
+                multiple_choice=self.multiple_choice or None,
+            ),
+            results=types.PollResults(
+                results=[
+                    types.PollAnswerVoters(self.option_bytes(i), voters=len(v))
+                    for i, v in enumerate(self.votes)
+                ],
+                total_voters=len(self.voters()),
+            ),
+        )
+
+
+@dataclass
+class FakeChat:
+    id: int                                # id non marcato
+    access_hash: int
+    title: str
+    megagroup: bool = True                 # False = gruppo base (Chat)
+    username: Optional[str] = None
+    members: set = field(default_factory=set)
+    polls: Dict[int, FakePoll] = field(default_factory=dict)
+    texts: Dict[int, str] = field(default_factory=dict)
+    last_msg_id: int = 0
+    date: datetime = field(default_factory=_now)
+    pinned_by: set = field(default_factory=set)
+
+    @property
+    def marked_id(self) -> int:
+        return get_peer_id(self.peer())
+
+    def peer(self):
+        return types.PeerChannel(self.id) if self.megagroup else types.PeerChat(self.id)
+
+    def input_peer(self):
+        if self.megagroup:
+            return types.InputPeerChannel(self.id, self.access_hash)
+        return types.InputPeerChat(self.id)
+
+    def tl(self):
+        if self.megagroup:
+            return types.Channel(
+                id=self.id, title=self.title, photo=types.ChatPhotoEmpty(), date=self.date,
+                megagroup=True, access_hash=self.access_hash, username=self.username,
+            )
+        return types.Chat(
+            id=self.id, title=self.title, photo=types.ChatPhotoEmpty(),
+            participants_count=len(self.members), date=self.date, version=1,
+        )
+
+    def message(self, msg_id: int) -> Optional[types.Message]:
+        poll = self.polls.get(msg_id)
+        if poll is not None:
+            return types.Message(id=msg_id, peer_id=self.peer(), date=poll.date, message="", media=poll.tl_media())
+        if msg_id in self.texts:
+            return types.Message(id=msg_id, peer_id=self.peer(), date=self.date, message=self.texts[msg_id])
+        return None
+
+
+@dataclass
+class FakeDialog:
+    """Il sottoinsieme di telethon.tl.custom.Dialog letto da _dialog_group/_scan_groups_async."""
+
+    entity: Any
+    id: int
+    name: str
+    date: datetime
+    pinned: bool = False
+
+
+class _FakeSession:
+    """Come MemorySession: `_entities` ha righe (marked_id, access_hash, username, phone, name)."""
+
+    def __init__(self, session_string: str):
+        self.string = session_string
+        self._entities: set = set()
+
+    def save(self) -> str:
+        return self.string
+
+    def process_entities(self, entities: Any) -> None:
+        for entity in entities:
+            row = _entity_row(entity)
+            if row is not None:
+                self._entities.add(row)
+
+
+def _entity_row(entity: Any) -> Optional[tuple]:
+    """Riga della cache entita' per un'entita' TL, come MemorySession."""
+    if isinstance(entity, types.User):
+        name = " ".join(x for x in (entity.first_name, entity.last_name) if x)
+        return (entity.id, entity.access_hash, (entity.username or "").lower() or None, entity.phone, name or None)
+    if isinstance(entity, types.Channel):
+        return (get_peer_id(types.PeerChannel(entity.id)), entity.access_hash,
+                (entity.username or "").lower() or None, None, entity.title or None)
+    if isinstance(entity, types.Chat):
+        return (get_peer_id(types.PeerChat(entity.id)), 0, None, None, entity.title or None)
+    return None
+
+
+# ---------------------------------------------------------------------------
+# Backend
+# ---------------------------------------------------------------------------
+
+class FakeTelegramBackend:
+    """Stato condiviso dei client finti: account, utenti, gruppi, sondaggi, statistiche."""
+
+    def __init__(
+        self,
+        latency_s: float = 0.0,
+        connect_latency_s: float = 0.0,
+        jitter: float = 0.0,
+        seed: int = 0,
+        warm_cache: bool = True,
+    ):
+        self.latency_s = latency_s
+        self.connect_latency_s = connect_latency_s
+        self.jitter = jitter
+        self.warm_cache = warm_cache
+        self._rng = random.Random(seed)
+        self._ids = itertools.count(1_000_000)
+        self.users: Dict[int, FakeUser] = {}
+        self.chats: Dict[int, FakeChat] = {}       # marked_id -> chat
+        self.sessions: Dict[str, int] = {}         # session_string -> user_id
+        self.sent: List[dict] = []                 # DM consegnati
+        self.rpc_counts: Counter = Counter()
+        self.connects = 0
+        self._faults: List[list] = []              # [nome richiesta | None, factory, rimanenti]
+        self._clients: List["FakeTelegramClient"] = []
+        self._pending_logins: Dict[str, str] = {}  # phone_code_hash -> phone
+
+    # -- costruzione del mondo ----------------------------------------------
+
+    def add_user(
+        self,
+        first_name: str = "",
+        last_name: str = "",
+        username: Optional[str] = None,
+        phone: Optional[str] = None,
+        **kwargs,
+    ) -> FakeUser:
+        user = FakeUser(
+            id=next(self._ids), access_hash=self._rng.getrandbits(63),
+            first_name=first_name, last_name=last_name, username=username,
+            phone=(phone or "").lstrip("+") or None, **kwargs,
+        )
+        self.users[user.id] = user
+        return user
+
+    def add_account(self, first_name: str = "Organizer", **kwargs) -> str:
+        """Crea un utente gia' loggato e ritorna la sua StringSession finta."""
+        return self.session_for(self.add_user(first_name, **kwargs))
+
+    def session_for(self, user: FakeUser) -> str:
+        session_string = f"fake:{next(self._ids)}"
+        self.sessions[session_string] = user.id
+        return session_string
+
+    def add_group(
+        self,
+        title: str,
+        members: List[int] = (),
+        megagroup: bool = True,
+        username: Optional[str] = None,
+        date: Optional[datetime] = None,
+    ) -> int:
+        """Crea un gruppo (supergruppo o base) e ritorna il suo chat_id marcato."""
+        chat = FakeChat(
+            id=next(self._ids), access_hash=self._rng.getrandbits(63), title=title,
+            megagroup=megagroup, username=username, members=set(members), date=date or _now(),
+        )
+        self.chats[chat.marked_id] = chat
+        return chat.marked_id
+
+    def join(self, chat_id: int, user_id: int) -> None:
+        self.chats[chat_id].members.add(user_id)
+
+    def add_text_message(self, chat_id: int, text: str) -> int:
+        chat = self.chats[chat_id]
+        chat.last_msg_id += 1
+        chat.texts[chat.last_msg_id] = text
+        chat.date = _now()
+        return chat.last_msg_id
+
+    def add_poll(
+        self,
+        chat_id: int,
+        question: str,
+        options: List[str],
+        public_voters: bool = True,
+        multiple_choice: bool = False,
+        closed: bool = False,
+    ) -> int:
+        """Pubblica un sondaggio nel gruppo e ritorna il msg_id."""
+        chat = self.chats[chat_id]
+        chat.last_msg_id += 1
+        chat.polls[chat.last_msg_id] = FakePoll(
+            msg_id=chat.last_msg_id, poll_id=self._rng.getrandbits(63), question=question,
+            options=list(options), date=_now(), public_voters=public_voters,
+            multiple_choice=multiple_choice, closed=closed, votes=[{} for _ in options],
+        )
+        chat.date = _now()
+        return chat.last_msg_id
+
+    def vote(self, chat_id: int, msg_id: int, user_id: int, idx: int, date: Optional[datetime] = None) -> None:
+        """Registra (o sposta) il voto di un utente e notifica gli update ai client connessi."""
+        chat = self.chats[chat_id]
+        poll = chat.polls[msg_id]
+        if not poll.multiple_choice:
+            for votes in poll.votes:
+                votes.pop(user_id, None)
+        poll.votes[idx][user_id] = date or _now()
+        chat.members.add(user_id)
+        update = types.UpdateMessagePoll(poll_id=poll.poll_id, results=poll.tl_media().results)
+        for client in list(self._clients):
+            if client.is_connected() and client.user_id in chat.members:
+                client._dispatch_update(update)
+
+    def close_poll(self, chat_id: int, msg_id: int) -> None:
+        self.chats[chat_id].polls[msg_id].closed = True
+
+    def delete_message(self, chat_id: int, msg_id: int) -> None:
+        chat = self.chats[chat_id]
+        chat.polls.pop(msg_id, None)
+        chat.texts.pop(msg_id, None)
+
+    def synthetic_users(self, n: int, with_phone: bool = True, prefix: str = "voter") -> List[FakeUser]:
+        """`n` utenti con username e (opzionale) numero italiano univoci."""
+        users = []
+        for _ in range(n):
+            user = self.add_user()
+            user.first_name = f"{prefix.capitalize()}{user.id}"
+            user.username = f"{prefix}{user.id}"
+            user.phone = f"39{3_000_000_000 + user.id}" if with_phone else None
+            users.append(user)
+        return users
+
+    def synthetic_poll(
+        self,
+        session_string: str,
+        n_voters: int,
+        n_options: int = 4,
+        title: str = "Gruppo sintetico",
+        turnout: float = 1.0,
+    ) -> Tuple[int, int]:
+        """Gruppo con `n_voters` membri e un sondaggio pubblico con votanti distribuiti fra le opzioni.
+
+        Ritorna (chat_id, msg_id). `turnout` e' la frazione di membri che vota.
+        """
+        owner = self.sessions[session_string]
+        members = self.synthetic_users(n_voters)
+        chat_id = self.add_group(title, members=[owner] + [u.id for u in members])
+        msg_id = self.add_poll(chat_id, f"{title}: ci sei?", [f"Opzione {i + 1}" for i in range(n_options)])
+        start = _now() - timedelta(days=1)
+        for n, user in enumerate(members):
+            if self._rng.random() < turnout:
+                self.vote(chat_id, msg_id, user.id, self._rng.randrange(n_options), start + timedelta(seconds=n))
+        return chat_id, msg_id
+
+    # -- iniezione di errori ------------------------------------------------
+
+    def inject_error(self, factory: Callable[[Any], Exception], request: Optional[str] = None, times: int = 1) -> None:
+        """Le prossime `times` richieste di tipo `request` (nome classe, None = qualsiasi)
+        falliscono con `factory(richiesta)`."""
+        self._faults.append([request, factory, times])
+
+    def inject_flood_wait(self, seconds: int, request: Optional[str] = None, times: int = 1) -> None:
+        self.inject_error(lambda req: FloodWaitError(request=req, capture=seconds), request, times)
+
+    def _take_fault(self, name: str) -> Optional[Callable[[Any], Exception]]:
+        for fault in self._faults:
+            if fault[0] in (None, name) and fault[2] > 0:
+                fault[2] -= 1
+                if fault[2] == 0:
+                    self._faults.remove(fault)
+                return fault[1]
+        return None
+
+    # -- statistiche --------------------------------------------------------
+
+    def reset_stats(self) -> None:
+        self.rpc_counts.clear()
+        self.connects = 0
+        self.sent.clear()
+
+    def stats(self) -> dict:
+        return {
+            "rpc": dict(self.rpc_counts),
+            "rpc_total": sum(self.rpc_counts.values()),
+            "connects": self.connects,
+            "dm_sent": len(self.sent),
+        }
+
+    # -- client -------------------------------------------------------------
+
+    def client(self, session_string: str = "") -> "FakeTelegramClient":
+        """Factory per set_client_factory / TelegramClientPool."""
+        return FakeTelegramClient(self, session_string)
+
+    async def _delay(self, base: float) -> None:
+        if base <= 0:
+            return
+        spread = base * self.jitter
+        await asyncio.sleep(max(0.0, base + self._rng.uniform(-spread, spread)))
+
+    def _chat_for_peer(self, peer: Any, user_id: Optional[int] = None) -> FakeChat:
+        """Il gruppo della peer; ChannelPrivateError se non esiste o `user_id` non ne fa parte."""
+        try:
+            chat = self.chats.get(get_peer_id(peer))
+        except (TypeError, ValueError):
+            chat = None
+        if chat is None or (user_id is not None and user_id not in chat.members):
+            raise ChannelPrivateError(request=None)
+        return chat
+
+    def _user_for_peer(self, peer: Any, request: Any) -> FakeUser:
+        user = self.users.get(getattr(peer, "user_id", None))
+        if user is None or user.access_hash != getattr(peer, "access_hash", None):
+            raise PeerIdInvalidError(request=request)
+        return user
+
+    async def _rpc(self, client: "FakeTelegramClient", request: Any) -> Any:
+        """Una richiesta MTProto: conteggio, latenza, errori iniettati, risposta."""
+        name = type(request).__name__
+        self.rpc_counts[name] += 1
+        await self._delay(self.latency_s)
+        fault = self._take_fault(name)
+        if fault is not None:
+            raise fault(request)
+        handler = getattr(self, "_handle_" + name, None)
+        if handler is None:
+            raise NotImplementedError(f"FakeTelegramBackend: {name} non supportata")
+        return handler(client, request)
+
+    # -- handler delle richieste ---------------------------------------------
+
+    def _handle_GetStateRequest(self, client, request):
+        return types.updates.State(pts=1, qts=0, date=_now(), seq=1, unread_count=0)
+
+    def _handle_GetUsersRequest(self, client, request):
+        return [self.users[client.user_id].tl(is_self=True)]
+
+    def _handle_LogOutRequest(self, client, request):
+        self.sessions.pop(client.session.string, None)
+        return types.auth.LoggedOut()
+
+    def _handle_ResolveUsernameRequest(self, client, request):
+        wanted = request.username.lower()
+        for user in self.users.values():
+            if (user.username or "").lower() == wanted:
+                return ResolvedPeer(peer=types.PeerUser(user.id), chats=[], users=[user.tl()])
+        for chat in self.chats.values():
+            if (chat.username or "").lower() == wanted:
+                return ResolvedPeer(peer=chat.peer(), chats=[chat.tl()], users=[])
+        raise UsernameNotOccupiedError(request=request)
+
+    def _handle_ResolvePhoneRequest(self, client, request):
+        for user in self.users.values():
+            if user.phone == request.phone.lstrip("+") and user.phone_discoverable:
+                return ResolvedPeer(peer=types.PeerUser(user.id), chats=[], users=[user.tl()])
+        raise PhoneNotOccupiedError(request=request)
+
+    def _handle_GetDialogsRequest(self, client, request):
+        # offset_id = posizione nella lista ordinata (paginazione semplificata).
+        dialogs = self._dialogs_for(client.user_id)
+        return dialogs[request.offset_id:request.offset_id + request.limit]
+
+    def _handle_GetMessagesRequest(self, client, request):
+        # messages.GetMessages non ha la peer (per i gruppi base gli id sono
+        # dell'account): get_messages la allega alla richiesta.
+        chat = self._chat_for_peer(request._fake_peer, client.user_id)
+        return [chat.message(m.id) for m in request.id]
+
+    def _handle_SearchRequest(self, client, request):
+        chat = self._chat_for_peer(request.peer, client.user_id)
+        ids = sorted(chat.polls if isinstance(request.filter, types.InputMessagesFilterPoll)
+                     else set(chat.polls) | set(chat.texts), reverse=True)
+        ids = [i for i in ids if i > (request.min_id or 0) and (not request.max_id or i < request.max_id)]
+        return [chat.message(i) for i in ids[:request.limit]]
+
+    def _handle_GetPollVotesRequest(self, client, request):
+        chat = self._chat_for_peer(request.peer, client.user_id)
+        poll = chat.polls.get(request.id)
+        if poll is None or not poll.public_voters:
+            raise PeerIdInvalidError(request=request)
+        rows = []
+        for idx, votes in enumerate(poll.votes):
+            if request.option is None or request.option == poll.option_bytes(idx):
+                rows.extend((date, uid, idx) for uid, date in votes.items())
+        rows.sort(key=lambda r: (r[0], r[1]), reverse=True)
+        start = int(request.offset or 0)
+        page = rows[start:start + request.limit]
+        end = start + len(page)
+        return VotesList(
+            count=len(rows),
+            votes=[types.MessagePeerVote(types.PeerUser(uid), poll.option_bytes(idx), date) for date, uid, idx in page],
+            chats=[],
+            users=[self.users[uid].tl() for _, uid, _ in page],
+            next_offset=str(end) if end < len(rows) else None,
+        )
+
+    def _handle_SendMessageRequest(self, client, request):
+        user = self._user_for_peer(request.peer, request)
+        if user.dm_error is not None:
+            raise user.dm_error(request=request)
+        self.sent.append({"from": client.user_id, "to": user.id, "text": request.message})
+        return types.UpdateShortSentMessage(id=len(self.sent), pts=1, pts_count=1, date=_now(), out=True)
+
+    def _dialogs_for(self, user_id: int) -> List[FakeChat]:
+        chats = [c for c in self.chats.values() if user_id in c.members]
+        chats.sort(key=lambda c: c.date, reverse=True)
+        chats.sort(key=lambda c: user_id not in c.pinned_by)
+        return chats
+
+
+# ---------------------------------------------------------------------------
+# Client
+# ---------------------------------------------------------------------------
+
+class FakeTelegramClient:
+    """Client finto con la superficie di TelegramClient usata da lib/telegram_client.py."""
+
+    flood_sleep_threshold = 60
+
+    def __init__(self, backend: FakeTelegramBackend, session_string: str = ""):
+        self._backend = backend
+        self.session = _FakeSession(session_string)
+        self._connected = False
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._handlers: List[Tuple[Callable, Any]] = []
+
+    @property
+    def user_id(self) -> Optional[int]:
+        return self._backend.sessions.get(self.session.string)
+
+    # -- connessione e login -------------------------------------------------
+
+    async def connect(self) -> None:
+        self._backend.connects += 1
+        await self._backend._delay(self._backend.connect_latency_s)
+        self._connected = True
+        self._loop = asyncio.get_running_loop()
+        self._backend._clients.append(self)
+        if self._backend.warm_cache and self.user_id is not None:
+            for chat in self._backend.chats.values():
+                if self.user_id in chat.members:
+                    self._remember(chat.tl())
+
+    async def disconnect(self) -> None:
+        self._connected = False
+        if self in self._backend._clients:
+            self._backend._clients.remove(self)
+
+    def is_connected(self) -> bool:
+        return self._connected
+
+    async def is_user_authorized(self) -> bool:
+        return self.user_id is not None
+
+    async def send_code_request(self, phone: str):
+        await self._backend._delay(self._backend.latency_s)
+        phone_code_hash = f"hash{next(self._backend._ids)}"
+        self._backend._pending_logins[phone_code_hash] = phone.lstrip("+")
+        self.session.string = f"fake-login:{phone_code_hash}"
+        return types.auth.SentCode(
+            type=types.auth.SentCodeTypeApp(length=len(LOGIN_CODE)), phone_code_hash=phone_code_hash,
+        )
+
+    async def sign_in(self, phone=None, code=None, *, password=None, phone_code_hash=None):
+        backend = self._backend
+        await backend._delay(backend.latency_s)
+        if password is not None:
+            user = backend.users.get(getattr(self, "_awaiting_2fa", None))
+            if user is None or user.password != password:
+                raise PhoneCodeInvalidError(request=None)
+        else:
+            if str(code) != LOGIN_CODE or phone_code_hash not in backend._pending_logins:
+                raise PhoneCodeInvalidError(request=None)
+            number = backend._pending_logins.pop(phone_code_hash)
+            user = next((u for u in backend.users.values() if u.phone == number), None)
+            if user is None:
+                user = backend.add_user("Organizer", phone=number)
+            if user.password:
+                self._awaiting_2fa = user.id
+                raise SessionPasswordNeededError(request=None)
+        self.session.string = backend.session_for(user)
+        return user.tl(is_self=True)
+
+    async def log_out(self) -> bool:
+        await self(LogOutRequest())
+        await self.disconnect()
+        return True
+
+    # -- richieste ----------------------------------------------------------
+
+    async def __call__(self, request, ordered=False, flood_sleep_threshold=None):
+        async def _send(threshold):
+            if threshold is None:
+                threshold = self.flood_sleep_threshold
+            while True:
+                try:
+                    result = await self._backend._rpc(self, request)
+                except FloodWaitError as e:
+                    # Come Telethon: sotto soglia si attende e si ritenta.
+                    if e.seconds > threshold:
+                        raise
+                    await asyncio.sleep(e.seconds)
+                    continue
+                self._remember_from(result)
+                return result
+
+        if not self._connected:
+            raise ConnectionError("FakeTelegramClient non connesso")
+        return await _governed_call(self, request, flood_sleep_threshold, _send)
+
+    def _remember(self, entity: Any) -> None:
+        self.session.process_entities([entity])
+
+    def _remember_from(self, result: Any) -> None:
+        """Come Telethon: utenti e chat di ogni risposta finiscono nella cache entita'."""
+        for entity in (getattr(result, "users", None) or []) + (getattr(result, "chats", None) or []):
+            self._remember(entity)
+
+    def _cached_input_peer(self, marked_id: int):
+        for row in self.session._entities:
+            if row[0] == marked_id:
+                if marked_id > 0:
+                    return types.InputPeerUser(marked_id, row[1])
+                chat = self._backend.chats.get(marked_id)
+                return chat.input_peer() if chat is not None else None
+        return None
+
+    async def get_input_entity(self, peer: Any):
+        if isinstance(peer, (types.InputPeerUser, types.InputPeerChannel, types.InputPeerChat)):
+            return peer
+        if isinstance(peer, int):
+            cached = self._cached_input_peer(peer)
+            if cached is None:
+                raise ValueError(f"Could not find the input entity for {peer}")
+            return cached
+        username = str(peer).lstrip("@").lower()
+        for row in self.session._entities:
+            if row[2] == username:
+                return self._cached_input_peer(row[0])
+        resolved = await self(ResolveUsernameRequest(username))
+        return self._cached_input_peer(get_peer_id(resolved.peer))
+
+    async def get_entity(self, peer: Any):
+        if isinstance(peer, str):
+            resolved = await self(ResolveUsernameRequest(peer.lstrip("@")))
+            return (resolved.users or resolved.chats)[0]
+        input_peer = await self.get_input_entity(peer)
+        if isinstance(input_peer, types.InputPeerUser):
+            return self._backend._user_for_peer(input_peer, None).tl()
+        return self._backend._chat_for_peer(input_peer).tl()
+
+    async def get_me(self) -> types.User:
+        return (await self(GetUsersRequest([types.InputUserSelf()])))[0]
+
+    async def get_messages(self, entity: Any, ids: Any = None):
+        peer = await self.get_input_entity(entity)
+        single = isinstance(ids, int)
+        wanted = [ids] if single else list(ids or [])
+        out: List[Optional[types.Message]] = []
+        for start in range(0, len(wanted), GET_MESSAGES_MAX_IDS):
+            chunk = [types.InputMessageID(i) for i in wanted[start:start + GET_MESSAGES_MAX_IDS]]
+            if isinstance(peer, types.InputPeerChannel):
+                request = GetChannelMessagesRequest(types.InputChannel(peer.channel_id, peer.access_hash), chunk)
+            else:
+                request = GetMessagesRequest(chunk)
+            request._fake_peer = peer
+            out.extend(await self(request))
+        return out[0] if single else out
+
+    async def iter_messages(self, entity: Any, limit: Optional[int] = None, filter: Any = None, min_id: int = 0):
+        peer = await self.get_input_entity(entity)
+        remaining = limit if limit is not None else float("inf")
+        max_id = 0
+        while remaining > 0:
+            page = await self(SearchRequest(
+                peer=peer, q="", filter=filter or types.InputMessagesFilterEmpty(),
+                min_date=None, max_date=None, offset_id=0, add_offset=0,
+                limit=int(min(SEARCH_PAGE_SIZE, remaining)), max_id=max_id, min_id=min_id, hash=0,
+            ))
+            for msg in page:
+                yield msg
+            remaining -= len(page)
+            if len(page) < SEARCH_PAGE_SIZE:
+                return
+            max_id = page[-1].id
+
+    async def iter_dialogs(self, limit: Optional[int] = None):
+        offset = 0
+        while True:
+            page = await self(GetDialogsRequest(
+                offset_date=None, offset_id=offset, offset_peer=types.InputPeerEmpty(),
+                limit=DIALOGS_PAGE_SIZE, hash=0,
+            ))
+            for chat in page:
+                entity = chat.tl()
+                self._remember(entity)
+                yield FakeDialog(
+                    entity=entity, id=chat.marked_id, name=chat.title, date=chat.date,
+                    pinned=self.user_id in chat.pinned_by,
+                )
+                offset += 1
+                if limit is not None and offset >= limit:
+                    return
+            if len(page) < DIALOGS_PAGE_SIZE:
+                return
+
+    async def send_message(self, entity: Any, message: str):
+        peer = await self.get_input_entity(entity)
+        return await self(SendMessageRequest(peer=peer, message=message, random_id=random.getrandbits(63)))
+
+    # -- update -------------------------------------------------------------
+
+    def add_event_handler(self, callback: Callable, event: Any = None) -> None:
+        self._handlers.append((callback, event))
+
+    def remove_event_handler(self, callback: Callable, event: Any = None) -> None:
+        self._handlers = [(cb, ev) for cb, ev in self._handlers if cb is not callback]
+
+    def _dispatch_update(self, update: Any) -> None:
+        if self._loop is None or self._loop.is_closed():
+            return
+        for callback, event in list(self._handlers):
+            # events.Raw(types): una classe o una tupla di classi, None = tutte.
+            wanted = getattr(event, "types", None)
+            if wanted and not isinstance(update, wanted):
+                continue
+            asyncio.run_coroutine_threadsafe(callback(update), self._loop)
@@ -0,0 +1,107 @@
+"""
+Indice persistente dei gruppi Telegram di un organizer (picker del gruppo capitolo).
+
+Elencare i gruppi richiede di scorrere tutti i dialog dell'account
+(iter_dialogs), lento per chi e' in centinaia di chat. L'indice viene
+salvato nel documento organizers/{email}, campo GROUP_INDEX_FIELD, e
+aggiornato in modo incrementale: i dialog arrivano dal piu' recente, quindi
+basta leggere quelli con attivita' successiva all'ultimo sync (watermark).
+Un gruppo abbandonato non compare fra i dialog recenti: per questo, oltre
+GROUP_INDEX_FULL_TTL_S, si rifa' un elenco completo.
+
+Formato del campo:
+
+    telegram_group_index: {
+      "groups": {"<chat_id>": {"title": str, "is_megagroup": bool}},
+      "watermark": float,        # data (epoch) del dialog piu' recente visto
+      "synced_at": float,        # ultimo sync (epoch)
+      "full_synced_at": float,   # ultimo elenco completo (epoch)
+    }
+
+Qui solo logica pura: la lettura dei dialog e' in telegram_client.sync_group_index.
+"""
+
+from __future__ import annotations
+
+import unicodedata
+from typing import List, Optional
+
+GROUP_INDEX_FIELD = "telegram_group_index"
+
+# Sotto questa eta' l'indice si usa cosi' com'e', senza richieste a Telegram.
+GROUP_INDEX_TTL_S = 60.0
+# Oltre questa eta' dell'ultimo elenco completo si rilegge tutto.
+GROUP_INDEX_FULL_TTL_S = 24 * 60 * 60.0
+
+
+def empty_index() -> dict:
+    return {"groups": {}, "watermark": 0.0, "synced_at": 0.0, "full_synced_at": 0.0}
+
+
+def needs_sync(index: Optional[dict], now: float, ttl_s: float = GROUP_INDEX_TTL_S) -> bool:
+    return not index or now - float(index.get("synced_at") or 0) >= ttl_s
+
+
+def needs_full_sync(index: Optional[dict], now: float, full_ttl_s: float = GROUP_INDEX_FULL_TTL_S) -> bool:
+    return not index or now - float(index.get("full_synced_at") or 0) >= full_ttl_s
+
+
+def apply_group_sync(index: Optional[dict], sync: dict, now: float) -> dict:
+    """Nuovo indice dopo un sync.
+
+    `sync`: {"groups": [{"chat_id", "title", "is_megagroup"}], "removed": [chat_id],
+    "watermark": float, "complete": bool}. Un sync completo sostituisce i gruppi,
+    uno incrementale li unisce a quelli gia' noti.
+    """
+    base = empty_index() if sync.get("complete") or not index else index
+    groups = {} if sync.get("complete") else dict(base.get("groups") or {})
+    for chat_id in sync.get("removed", []):
+        groups.pop(str(chat_id), None)
+    for g in sync.get("groups", []):
+        groups[str(g["chat_id"])] = {"title": g["title"], "is_megagroup": bool(g["is_megagroup"])}
+    return {
+        "groups": groups,
+        "watermark": max(float(base.get("watermark") or 0), float(sync.get("watermark") or 0)),
+        "synced_at": now,
+        "full_synced_at": now if sync.get("complete") else float(base.get("full_synced_at") or 0),
+    }
+
+
+def group_list(index: Optional[dict]) -> List[dict]:
+    """Gruppi dell'indice nel formato di list_groups, ordinati per titolo."""
+    groups = []
+    for chat_id, g in ((index or {}).get("groups") or {}).items():
+        try:
+            groups.append({"chat_id": int(chat_id), "title": g.get("title", ""), "is_megagroup": bool(g.get("is_megagroup"))})
+        except (TypeError, ValueError, AttributeError):
+            continue
+    groups.sort(key=lambda g: (g["title"] or "").lower())
+    return groups
+
+
+def _fold(text: str) -> str:
+    """Minuscolo e senza accenti, per confronti tolleranti."""
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).lower()
+
+
+def search_groups(groups: List[dict], query: str) -> List[dict]:
+    """Filtra per prefisso: ogni parola della query deve iniziare una parola del titolo.
+
+    Una query numerica confronta anche il prefisso del chat_id. Query vuota:
+    tutti i gruppi.
+    """
+    terms = _fold(query).split()
+    if not terms:
+        return list(groups)
+    matches = []
+    for g in groups:
+        words = _fold(g.get("title", "")).replace("-", " ").split()
+        chat_id = str(g.get("chat_id", ""))
+        if all(
+            any(w.startswith(term) for w in words)
+            or (term.lstrip("-").isdigit() and chat_id.startswith(term))
+            for term in terms
+        ):
+            matches.append(g)
+    return matches
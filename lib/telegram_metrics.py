@@ -0,0 +1,339 @@
+"""
+Strumentazione leggera delle chiamate Telegram.
+
+lib/telegram_client.py e lib/telegram_pool.py registrano un evento per ogni
+passo di un'operazione, cosi' che un "Aggiorna" lento si possa scomporre in
+handshake, risoluzione del gruppo e letture dei voti:
+
+    {
+      "ts": float,                  # epoch di fine
+      "kind": "op" | "connect" | "authorize" | "rpc" | "retry",
+      "name": str,                  # operazione (es. "get_poll_voters_delta") o richiesta TL
+      "op": str | None,             # operazione in corso (contextvar), per connect/rpc/retry
+      "duration_s": float,
+      "ok": bool,
+      "error": str | None,          # nome della classe d'errore
+      "wait_s": float,              # solo rpc: attesa nel governor prima dell'invio
+      "flood_wait_s": float,        # rpc fallite per FloodWait e retry: secondi imposti
+    }
+
+Gli eventi vanno ai sink registrati: di default un ring buffer in memoria
+(metrics_buffer(), letto dalla pagina admin); TELEGRAM_METRICS_SINK nei
+secrets aggiunge "jsonl:<path>" o "firestore" (collezione telegram_metrics).
+Un sink che fallisce non interrompe mai la chiamata Telegram: gli errori
+sono contati per sink (sink_errors()) e il primo di ogni sink va nel log.
+"""
+
+from __future__ import annotations
+
+import contextvars
+import json
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import Counter, deque
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+METRICS_COLLECTION = "telegram_metrics"
+RING_BUFFER_SIZE = 5000
+
+OP = "op"
+CONNECT = "connect"
+AUTHORIZE = "authorize"
+RPC = "rpc"
+RETRY = "retry"
+
+_CURRENT_OP: contextvars.ContextVar = contextvars.ContextVar("telegram_op", default=None)
+
+
+# ---------------------------------------------------------------------------
+# Sink
+# ---------------------------------------------------------------------------
+
+class MetricsSink(ABC):
+    """Destinazione degli eventi. `recent` e' opzionale (serve alla pagina admin)."""
+
+    @abstractmethod
+    def record(self, event: dict) -> None:
+        ...
+
+    def recent(self, limit: int = RING_BUFFER_SIZE) -> List[dict]:
+        return []
+
+
+class RingBufferSink(MetricsSink):
+    """Ultimi `maxlen` eventi del processo, in memoria."""
+
+    def __init__(self, maxlen: int = RING_BUFFER_SIZE):
+        self._events: deque = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    def record(self, event: dict) -> None:
+        with self._lock:
+            self._events.append(event)
+
+    def recent(self, limit: int = RING_BUFFER_SIZE) -> List[dict]:
+        with self._lock:
+            events = list(self._events)
+        return events[-limit:]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._events.clear()
+
+
+class JsonlSink(MetricsSink):
+    """Un evento JSON per riga, in append su file (es. per analisi offline)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def record(self, event: dict) -> None:
+        line = json.dumps(event, separators=(",", ":")) + "\n"
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+    def recent(self, limit: int = RING_BUFFER_SIZE) -> List[dict]:
+        try:
+            with self._lock, open(self.path, encoding="utf-8") as f:
+                lines = deque(f, maxlen=limit)
+        except FileNotFoundError:
+            return []
+        return [json.loads(line) for line in lines if line.strip()]
+
+
+class FirestoreMetricsSink(MetricsSink):
+    """Eventi nella collezione `telegram_metrics`, scritti a batch da un thread.
+
+    `db`: client Firestore; None = firestore.client() al primo flush (l'app
+    Firebase e' gia' inizializzata da pagine e worker). Gli eventi si
+    accumulano finche' non sono `flush_size` o passano `flush_interval_s`
+    secondi dall'ultimo flush, cosi' il loop del pool non aspetta mai
+    Firestore.
+    """
+
+    def __init__(self, db: Any = None, flush_size: int = 200, flush_interval_s: float = 30.0):
+        self._db = db
+        self.flush_size = flush_size
+        self.flush_interval_s = flush_interval_s
+        self._pending: List[dict] = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _client(self) -> Any:
+        if self._db is None:
+            from firebase_admin import firestore
+            self._db = firestore.client()
+        return self._db
+
+    def record(self, event: dict) -> None:
+        with self._lock:
+            self._pending.append(event)
+            due = (
+                len(self._pending) >= self.flush_size
+                or time.monotonic() - self._last_flush >= self.flush_interval_s
+            )
+        if due:
+            self.flush(wait=False)
+
+    def flush(self, wait: bool = True) -> None:
+        with self._lock:
+            events, self._pending = self._pending, []
+            self._last_flush = time.monotonic()
+        if not events:
+            return
+        if wait:
+            self._write(events)
+        else:
+            threading.Thread(target=self._write_background, args=(events,), daemon=True).start()
+
+    def _write_background(self, events: List[dict]) -> None:
+        try:
+            self._write(events)
+        except Exception as e:
+            _sink_failed(self, e)
+
+    def _write(self, events: List[dict]) -> None:
+        db = self._client()
+        col = db.collection(METRICS_COLLECTION)
+        # Limite Firestore: 500 scritture per batch.
+        for start in range(0, len(events), 500):
+            batch = db.batch()
+            for event in events[start:start + 500]:
+                batch.set(col.document(), event)
+            batch.commit()
+
+    def recent(self, limit: int = RING_BUFFER_SIZE) -> List[dict]:
+        query = (
+            self._client().collection(METRICS_COLLECTION)
+            .order_by("ts", direction="DESCENDING")
+            .limit(limit)
+        )
+        events = [snap.to_dict() for snap in query.stream()]
+        events.reverse()
+        return events
+
+
+_RING = RingBufferSink()
+_SINKS_LOCK = threading.Lock()
+_SINKS: List[MetricsSink] = [_RING]
+# Errori per classe di sink; i sink gia' segnalati nel log (id dell'istanza).
+_SINK_ERRORS: Counter = Counter()
+_SINKS_LOGGED: set = set()
+
+
+def _sink_failed(sink: MetricsSink, exc: BaseException) -> None:
+    name = type(sink).__name__
+    with _SINKS_LOCK:
+        _SINK_ERRORS[name] += 1
+        first = id(sink) not in _SINKS_LOGGED
+        _SINKS_LOGGED.add(id(sink))
+    if first:
+        logger.warning("Sink metriche %s in errore, eventi persi: %r", name, exc, exc_info=exc)
+
+
+def sink_errors() -> Dict[str, int]:
+    """Eventi non registrati per errore del sink, per classe di sink."""
+    with _SINKS_LOCK:
+        return dict(_SINK_ERRORS)
+
+
+def metrics_buffer() -> RingBufferSink:
+    """Ring buffer in memoria del processo (sempre attivo)."""
+    return _RING
+
+
+def add_metrics_sink(sink: MetricsSink) -> None:
+    global _SINKS
+    with _SINKS_LOCK:
+        if sink not in _SINKS:
+            _SINKS = _SINKS + [sink]
+
+
+def remove_metrics_sink(sink: MetricsSink) -> None:
+    global _SINKS
+    with _SINKS_LOCK:
+        _SINKS = [s for s in _SINKS if s is not sink]
+
+
+def metrics_sinks() -> List[MetricsSink]:
+    return list(_SINKS)
+
+
+def sink_from_spec(spec: str) -> Optional[MetricsSink]:
+    """Sink aggiuntivo da TELEGRAM_METRICS_SINK: "jsonl:<path>", "firestore" o "" (nessuno)."""
+    spec = (spec or "").strip()
+    if not spec or spec == "memory":
+        return None
+    if spec == "firestore":
+        return FirestoreMetricsSink()
+    if spec.startswith("jsonl:") and spec[len("jsonl:"):]:
+        return JsonlSink(spec[len("jsonl:"):])
+    raise ValueError(f"TELEGRAM_METRICS_SINK non valido: {spec!r}")
+
+
+# ---------------------------------------------------------------------------
+# Registrazione
+# ---------------------------------------------------------------------------
+
+def record(kind: str, name: str, duration_s: float, ok: bool = True, **fields: Any) -> None:
+    event = {
+        "ts": time.time(),
+        "kind": kind,
+        "name": name,
+        "op": _CURRENT_OP.get(),
+        "duration_s": round(duration_s, 6),
+        "ok": ok,
+        "error": None,
+        **fields,
+    }
+    for sink in _SINKS:
+        try:
+            sink.record(event)
+        except Exception as e:
+            _sink_failed(sink, e)
+
+
+@contextmanager
+def timed(kind: str, name: str, **fields: Any):
+    """Misura il blocco e registra un evento; il dict prodotto accetta campi extra.
+
+    Utilizzabile anche attorno a un `await`: il tempo e' quello di parete.
+    """
+    extra: Dict[str, Any] = dict(fields)
+    start = time.perf_counter()
+    try:
+        yield extra
+    except BaseException as e:
+        extra.setdefault("error", type(e).__name__)
+        record(kind, name, time.perf_counter() - start, ok=False, **extra)
+        raise
+    record(kind, name, time.perf_counter() - start, **extra)
+
+
+@contextmanager
+def operation(name: str):
+    """Operazione di alto livello: gli eventi registrati dentro portano `op=name`.
+
+    Il contextvar passa anche ai task creati all'interno (asyncio copia il
+    contesto alla creazione).
+    """
+    token = _CURRENT_OP.set(name)
+    try:
+        with timed(OP, name):
+            yield
+    finally:
+        _CURRENT_OP.reset(token)
+
+
+# ---------------------------------------------------------------------------
+# Aggregazione
+# ---------------------------------------------------------------------------
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Percentile `q` (0-100) per nearest-rank su valori gia' ordinati."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * q // 100))
+    return sorted_values[min(len(sorted_values), int(rank)) - 1]
+
+
+def summarize(events: Iterable[dict], by: tuple = ("kind", "name")) -> List[dict]:
+    """Statistiche per gruppo (default kind + name), in ordine di tempo totale.
+
+    Ogni riga: le chiavi di `by` + count, errors, p50_s, p90_s, p99_s, max_s,
+    total_s, wait_s (rpc), retries e flood_wait_s (retry e FloodWait).
+    """
+    groups: Dict[tuple, dict] = {}
+    for ev in events:
+        key = tuple(ev.get(k) for k in by)
+        g = groups.setdefault(key, {"durations": [], "errors": 0, "wait_s": 0.0, "retries": 0, "flood_wait_s": 0.0})
+        g["durations"].append(float(ev.get("duration_s") or 0.0))
+        g["errors"] += 0 if ev.get("ok", True) else 1
+        g["wait_s"] += float(ev.get("wait_s") or 0.0)
+        g["retries"] += 1 if ev.get("kind") == RETRY else 0
+        g["flood_wait_s"] += float(ev.get("flood_wait_s") or 0.0)
+
+    rows = []
+    for key, g in groups.items():
+        durations = sorted(g["durations"])
+        rows.append({
+            **dict(zip(by, key)),
+            "count": len(durations),
+            "errors": g["errors"],
+            "p50_s": percentile(durations, 50),
+            "p90_s": percentile(durations, 90),
+            "p99_s": percentile(durations, 99),
+            "max_s": durations[-1],
+            "total_s": round(sum(durations), 6),
+            "wait_s": round(g["wait_s"], 6),
+            "retries": g["retries"],
+            "flood_wait_s": g["flood_wait_s"],
+        })
+    rows.sort(key=lambda r: -r["total_s"])
+    return rows
@@ -0,0 +1,294 @@
+"""
+Pool process-wide di client Telethon gia' connessi e autorizzati.
+
+Il costo dominante di ogni operazione Telegram e' l'handshake MTProto
+(connect + is_user_authorized). Il pool tiene vivi i client per sessione,
+indicizzati dal fingerprint della StringSession, su un unico event loop
+dedicato (BackgroundLoop): Telethon lega ogni client al loop su cui ha fatto
+connect(), quindi tutte le operazioni devono girare su quel loop.
+
+Politiche:
+- idle eviction: un client non usato da `idle_ttl` secondi viene disconnesso
+  da un task di pulizia periodico;
+- health check: prima di riusare un client fermo da piu' di
+  `health_check_interval` secondi si verifica connessione e autorizzazione
+  con una richiesta leggera (updates.getState), fuori dal governor dei
+  rate-limit; un FloodWait sulla verifica non scarta il client;
+- capienza massima: oltre `max_clients` si chiudono i client idle usati
+  meno di recente; se sono tutti in uso il pool resta temporaneamente
+  sopra il limite invece di chiudere un client consegnato;
+- un errore di autorizzazione o di rete durante l'uso scarta il client,
+  che verra' ricreato alla richiesta successiva; chi lo sta ancora usando
+  finisce le sue richieste e la disconnessione avviene all'ultimo rilascio.
+
+Con `pooling=False` ogni operazione crea, connette e chiude il proprio
+client (il comportamento precedente al pool), per confronti e benchmark.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+
+from telethon.errors import FloodWaitError, UnauthorizedError
+from telethon.tl.functions.updates import GetStateRequest
+
+from lib import telegram_metrics
+from lib.aio_loop import BackgroundLoop
+
+
+# Errori che indicano un client non piu' riutilizzabile.
+DISCARD_ERRORS = (UnauthorizedError, ConnectionError, OSError, asyncio.TimeoutError)
+
+
+def session_fingerprint(session_string: str) -> str:
+    """Identificativo stabile e non reversibile di una StringSession."""
+    return hashlib.sha256((session_string or "").encode("utf-8")).hexdigest()[:24]
+
+
+async def _safe_disconnect(client: Any) -> None:
+    try:
+        await client.disconnect()
+    except Exception:
+        pass
+
+
+@dataclass
+class _PooledClient:
+    key: str
+    client: Any
+    created_at: float
+    last_used: float
+    last_checked: float
+    in_use: int = 0
+    # Tolto dal pool: si disconnette quando l'ultimo utilizzatore lo rilascia.
+    retired: bool = False
+    extras: Dict[str, Any] = field(default_factory=dict)
+
+
+class TelegramClientPool:
+    """Mantiene client Telethon connessi e autorizzati, uno per sessione."""
+
+    def __init__(
+        self,
+        client_factory: Callable[[str], Any],
+        *,
+        idle_ttl: float = 600.0,
+        health_check_interval: float = 60.0,
+        reap_interval: float = 30.0,
+        max_clients: int = 50,
+        background: Optional[BackgroundLoop] = None,
+        pooling: bool = True,
+    ):
+        self._factory = client_factory
+        self.pooling = pooling
+        self.idle_ttl = idle_ttl
+        self.health_check_interval = health_check_interval
+        self.reap_interval = reap_interval
+        self.max_clients = max_clients
+        self._bg = background or BackgroundLoop(name="telegram-pool")
+        # Strutture toccate solo dal thread del loop: nessun lock necessario.
+        self._entries: Dict[str, _PooledClient] = {}
+        self._key_locks: Dict[str, asyncio.Lock] = {}
+        self._reaper: Optional[asyncio.Task] = None
+
+    # -- facciata sincrona --------------------------------------------------
+
+    @property
+    def background(self) -> BackgroundLoop:
+        return self._bg
+
+    def run(self, coro, timeout: Optional[float] = None):
+        """Esegue una coroutine sul loop del pool e ne ritorna il risultato."""
+        return self._bg.run(coro, timeout=timeout)
+
+    def submit(self, coro):
+        """Schedula una coroutine sul loop del pool senza attenderla."""
+        return self._bg.submit(coro)
+
+    def iterate(self, agen):
+        """Consuma un async generator sul loop del pool, elemento per elemento."""
+        return self._bg.iterate(agen)
+
+    def stats(self) -> dict:
+        """Snapshot (best effort) dello stato del pool, per debug/UI."""
+        now = time.monotonic()
+        return {
+            "clients": len(self._entries),
+            "in_use": sum(1 for e in list(self._entries.values()) if e.in_use),
+            "oldest_idle_s": max(
+                (now - e.last_used for e in list(self._entries.values()) if not e.in_use),
+                default=0.0,
+            ),
+        }
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Disconnette tutti i client e ferma il loop."""
+        if not self._bg.is_running():
+            return
+        try:
+            self._bg.run(self._close_async(), timeout=timeout)
+        except Exception:
+            pass
+        self._bg.stop(timeout)
+
+    # -- API async (da usare sul loop del pool) ------------------------------
+
+    @asynccontextmanager
+    async def session(self, session_string: str) -> AsyncIterator[Optional[Any]]:
+        """Fornisce il client connesso per la sessione, o None se non autorizzata.
+
+        Uso:
+            async with pool.session(session_string) as client:
+                if client is None:
+                    ...  # sessione revocata / mai completata
+        """
+        if not self.pooling:
+            async with self._one_shot(session_string) as client:
+                yield client
+            return
+        entry = await self._checkout(session_string)
+        if entry is None:
+            yield None
+            return
+        try:
+            yield entry.client
+        except DISCARD_ERRORS:
+            await self._drop(entry)
+            raise
+        finally:
+            entry.in_use -= 1
+            entry.last_used = time.monotonic()
+            if entry.retired and not entry.in_use:
+                await _safe_disconnect(entry.client)
+
+    async def discard(self, session_string: str) -> None:
+        """Chiude e rimuove il client della sessione (es. dopo logout)."""
+        entry = self._entries.get(session_fingerprint(session_string))
+        if entry is not None:
+            await self._drop(entry)
+
+    # -- interni ------------------------------------------------------------
+
+    @asynccontextmanager
+    async def _one_shot(self, session_string: str) -> AsyncIterator[Optional[Any]]:
+        """Client usa-e-getta (pooling=False): connect all'ingresso, disconnect all'uscita."""
+        entry = await self._connect(session_fingerprint(session_string), session_string)
+        if entry is None:
+            yield None
+            return
+        try:
+            yield entry.client
+        finally:
+            await _safe_disconnect(entry.client)
+
+    def _lock_for(self, key: str) -> asyncio.Lock:
+        lock = self._key_locks.get(key)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._key_locks[key] = lock
+        return lock
+
+    def _ensure_reaper(self) -> None:
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.get_running_loop().create_task(self._reap_forever())
+
+    async def _checkout(self, session_string: str) -> Optional[_PooledClient]:
+        self._ensure_reaper()
+        key = session_fingerprint(session_string)
+        async with self._lock_for(key):
+            entry = self._entries.get(key)
+            if entry is not None and not await self._is_healthy(entry):
+                await self._drop(entry)
+                entry = None
+            if entry is None:
+                entry = await self._connect(key, session_string)
+                if entry is None:
+                    return None
+                self._entries[key] = entry
+            # Prima di _enforce_capacity: il client appena creato non e' idle.
+            entry.in_use += 1
+            entry.last_used = time.monotonic()
+            await self._enforce_capacity()
+            return entry
+
+    async def _connect(self, key: str, session_string: str) -> Optional[_PooledClient]:
+        client = self._factory(session_string)
+        try:
+            with telegram_metrics.timed(telegram_metrics.CONNECT, "connect"):
+                await client.connect()
+            with telegram_metrics.timed(telegram_metrics.AUTHORIZE, "is_user_authorized") as extra:
+                authorized = await client.is_user_authorized()
+                extra["authorized"] = bool(authorized)
+            if not authorized:
+                await _safe_disconnect(client)
+                return None
+        except BaseException:
+            await _safe_disconnect(client)
+            raise
+        now = time.monotonic()
+        return _PooledClient(key=key, client=client, created_at=now, last_used=now, last_checked=now)
+
+    async def _is_healthy(self, entry: _PooledClient) -> bool:
+        if not entry.client.is_connected():
+            return False
+        now = time.monotonic()
+        if entry.in_use or now - entry.last_checked < self.health_check_interval:
+            return True
+        try:
+            # Non governata (vedi telegram_client._method_class) e senza
+            # flood-sleep: la verifica non consuma il budget dell'account.
+            await entry.client(GetStateRequest(), flood_sleep_threshold=0)
+        except FloodWaitError:
+            # L'account e' limitato ma la connessione risponde: si salta la verifica.
+            return True
+        except DISCARD_ERRORS:
+            return False
+        entry.last_checked = time.monotonic()
+        return True
+
+    async def _drop(self, entry: _PooledClient) -> None:
+        """Toglie il client dal pool; se e' in uso lo disconnette l'ultimo rilascio (session)."""
+        if self._entries.get(entry.key) is entry:
+            del self._entries[entry.key]
+        entry.retired = True
+        if not entry.in_use:
+            await _safe_disconnect(entry.client)
+
+    async def _enforce_capacity(self) -> None:
+        excess = len(self._entries) - self.max_clients
+        if excess <= 0:
+            return
+        idle = sorted((e for e in self._entries.values() if not e.in_use), key=lambda e: e.last_used)
+        for entry in idle[:excess]:
+            await self._drop(entry)
+
+    async def _reap_once(self) -> None:
+        now = time.monotonic()
+        for entry in list(self._entries.values()):
+            if not entry.in_use and now - entry.last_used >= self.idle_ttl:
+                await self._drop(entry)
+        # I lock per chiave di sessioni non piu' in pool non servono piu'.
+        for key in list(self._key_locks):
+            if key not in self._entries and not self._key_locks[key].locked():
+                del self._key_locks[key]
+
+    async def _reap_forever(self) -> None:
+        while True:
+            await asyncio.sleep(self.reap_interval)
+            try:
+                await self._reap_once()
+            except Exception:
+                # La pulizia non deve mai far morire il task.
+                pass
+
+    async def _close_async(self) -> None:
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+        for entry in list(self._entries.values()):
+            await self._drop(entry)
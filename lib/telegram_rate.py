@@ -0,0 +1,239 @@
+"""
+Governor dei rate-limit Telegram, condiviso da tutte le pagine del processo.
+
+Ogni account (fingerprint della sessione) ha un token bucket per classe di
+metodo ("read", "dm", "resolve"), e per ogni classe una scadenza di
+FloodWait: quando Telegram impone un'attesa, tutte le richieste della stessa
+classe per quell'account aspettano (o falliscono subito), non solo quella
+che l'ha ricevuta. Due tab o due pagine dello stesso organizer condividono
+cosi' lo stesso budget.
+
+Le scadenze possono essere persistite (FloodStore) per sopravvivere a un
+riavvio del processo: FirestoreFloodStore le salva nel documento organizer.
+
+Il governor gira sul loop del pool (acquire e' una coroutine); lo stato e'
+protetto da un lock perche' snapshot() viene chiamato dai thread Streamlit.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, Optional
+
+from telethon.errors import FloodWaitError
+
+READ = "read"
+DM = "dm"
+RESOLVE = "resolve"
+
+# (richieste/s a regime, burst) per classe di metodo.
+DEFAULT_LIMITS: Dict[str, tuple] = {
+    READ: (4.0, 12),
+    DM: (0.8, 3),
+    RESOLVE: (0.7, 5),
+}
+
+# FloodWait piu' brevi non vengono persistiti (costerebbe una scrittura per poco).
+PERSIST_MIN_WAIT_S = 60
+
+
+class RateLimitedError(FloodWaitError):
+    """FloodWait ancora in corso per l'account: sollevata senza contattare Telegram.
+
+    E' una FloodWaitError (con `seconds` = attesa residua), quindi i chiamanti
+    la gestiscono come un FloodWait vero.
+    """
+
+    def __init__(self, seconds: float, method_class: str):
+        super().__init__(request=None, capture=max(1, int(seconds + 0.999)))
+        self.method_class = method_class
+
+
+class FloodStore(ABC):
+    """Persistenza delle scadenze FloodWait di un account: {classe: epoch di fine}."""
+
+    key: str = ""
+
+    @abstractmethod
+    def load(self) -> Dict[str, float]:
+        ...
+
+    @abstractmethod
+    def save(self, method_class: str, until: float) -> None:
+        ...
+
+
+class MemoryFloodStore(FloodStore):
+    def __init__(self, key: str = "memory"):
+        self.key = key
+        self._data: Dict[str, float] = {}
+
+    def load(self) -> Dict[str, float]:
+        return dict(self._data)
+
+    def save(self, method_class: str, until: float) -> None:
+        self._data[method_class] = until
+
+
+class FirestoreFloodStore(FloodStore):
+    """Scadenze nel documento organizer, campo mappa `field` ({classe: epoch})."""
+
+    DEFAULT_FIELD = "telegram_flood_until"
+
+    def __init__(self, doc_ref: Any, field: str = DEFAULT_FIELD):
+        self._doc_ref = doc_ref
+        self._field = field
+        self.key = f"firestore:{doc_ref.path}:{field}"
+
+    def load(self) -> Dict[str, float]:
+        snap = self._doc_ref.get([self._field])
+        data = (snap.to_dict() or {}).get(self._field) or {}
+        out = {}
+        for cls, until in data.items():
+            try:
+                out[cls] = float(until)
+            except (TypeError, ValueError):
+                continue
+        return out
+
+    def save(self, method_class: str, until: float) -> None:
+        self._doc_ref.set({self._field: {method_class: until}}, merge=True)
+
+
+class _Bucket:
+    def __init__(self, rate: float, burst: int, now: float):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.stamp = now
+        self.blocked_until = 0.0  # monotonic
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+
+class RateGovernor:
+    """Token bucket e scadenze FloodWait per (account, classe di metodo)."""
+
+    def __init__(
+        self,
+        limits: Optional[Dict[str, tuple]] = None,
+        clock: Callable[[], float] = time.monotonic,
+        wall_clock: Callable[[], float] = time.time,
+    ):
+        self.limits = dict(DEFAULT_LIMITS, **(limits or {}))
+        self._clock = clock
+        self._wall = wall_clock
+        self._lock = threading.Lock()
+        self._buckets: Dict[tuple, _Bucket] = {}
+        self._stores: Dict[str, FloodStore] = {}
+        self._loaded: Dict[str, str] = {}  # account -> key dello store gia' caricato
+
+    def _bucket(self, account: str, method_class: str) -> _Bucket:
+        bucket = self._buckets.get((account, method_class))
+        if bucket is None:
+            rate, burst = self.limits.get(method_class, self.limits[READ])
+            bucket = _Bucket(rate, burst, self._clock())
+            self._buckets[(account, method_class)] = bucket
+        return bucket
+
+    # -- persistenza --------------------------------------------------------
+
+    def bind_store(self, account: str, store: Optional[FloodStore]) -> None:
+        with self._lock:
+            if store is None:
+                self._stores.pop(account, None)
+                self._loaded.pop(account, None)
+            else:
+                self._stores[account] = store
+
+    async def ensure_loaded(self, account: str) -> None:
+        """Carica (una volta per store) le scadenze persistite dell'account."""
+        with self._lock:
+            store = self._stores.get(account)
+            if store is None or self._loaded.get(account) == store.key:
+                return
+            self._loaded[account] = store.key
+        try:
+            saved = await asyncio.get_running_loop().run_in_executor(None, store.load)
+        except Exception:
+            return  # senza stato persistito si riparte dai bucket pieni
+        wall, now = self._wall(), self._clock()
+        with self._lock:
+            for method_class, until in saved.items():
+                if until > wall:
+                    bucket = self._bucket(account, method_class)
+                    bucket.blocked_until = max(bucket.blocked_until, now + (until - wall))
+
+    # -- API ----------------------------------------------------------------
+
+    async def acquire(self, account: str, method_class: str, max_wait: Optional[float] = None) -> None:
+        """Attende un token della classe per l'account.
+
+        Se c'e' un FloodWait in corso piu' lungo di `max_wait` solleva subito
+        RateLimitedError; None = attende sempre.
+        """
+        await self.ensure_loaded(account)
+        while True:
+            with self._lock:
+                now = self._clock()
+                bucket = self._bucket(account, method_class)
+                blocked = bucket.blocked_until - now
+                if blocked > 0:
+                    if max_wait is not None and blocked > max_wait:
+                        raise RateLimitedError(blocked, method_class)
+                    wait = blocked
+                else:
+                    bucket.refill(now)
+                    if bucket.tokens >= 1:
+                        bucket.tokens -= 1
+                        return
+                    wait = (1 - bucket.tokens) / bucket.rate
+            await asyncio.sleep(wait)
+
+    def note_flood_wait(self, account: str, method_class: str, seconds: float) -> None:
+        """Registra un FloodWait: blocca la classe per l'account e svuota il bucket."""
+        with self._lock:
+            now = self._clock()
+            bucket = self._bucket(account, method_class)
+            bucket.blocked_until = max(bucket.blocked_until, now + seconds)
+            bucket.tokens = 0.0
+            bucket.stamp = bucket.blocked_until
+            store = self._stores.get(account)
+        if store is not None and seconds >= PERSIST_MIN_WAIT_S:
+            until = self._wall() + seconds
+            try:
+                future = asyncio.get_running_loop().run_in_executor(None, store.save, method_class, until)
+            except RuntimeError:
+                store.save(method_class, until)  # chiamato fuori dal loop
+            else:
+                future.add_done_callback(lambda f: f.exception())
+
+    def snapshot(self, account: str) -> Dict[str, dict]:
+        """Stato per classe: {"tokens", "capacity", "rate_per_s", "blocked_for_s"}."""
+        with self._lock:
+            now = self._clock()
+            state = {}
+            for method_class in self.limits:
+                bucket = self._bucket(account, method_class)
+                if bucket.stamp <= now:
+                    bucket.refill(now)
+                state[method_class] = {
+                    "tokens": round(max(0.0, bucket.tokens), 2),
+                    "capacity": bucket.capacity,
+                    "rate_per_s": bucket.rate,
+                    "blocked_for_s": max(0.0, round(bucket.blocked_until - now, 1)),
+                }
+            return state
+
+    def forget(self, account: str) -> None:
+        """Dimentica bucket e scadenze di un account (logout)."""
+        with self._lock:
+            for k in [k for k in self._buckets if k[0] == account]:
+                del self._buckets[k]
+            self._stores.pop(account, None)
+            self._loaded.pop(account, None)
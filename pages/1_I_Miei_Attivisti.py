@@ -9,18 +9,24 @@ from lib.telegram_client import (
     TelegramConfigError,
     TelegramLoginError,
     TelegramOperationError,
+    bind_entity_store,
+    bind_rate_store,
     encrypt_session,
+    get_rate_state,
     is_telegram_configured,
-    list_groups as tg_list_groups,
     logout as tg_logout,
     normalize_phone_to_e164,
-    resolve_phone as tg_resolve_phone,
+    resolve_phones_bulk as tg_resolve_phones_bulk,
     send_code as tg_send_code,
+    session_identity as tg_session_identity,
     sign_in_with_code as tg_sign_in_with_code,
     sign_in_with_password as tg_sign_in_with_password,
+    sync_group_index as tg_sync_group_index,
     try_decrypt_session,
-    whoami as tg_whoami,
 )
+from lib.telegram_entities import FirestoreEntityStore
+from lib.telegram_groups import GROUP_INDEX_FIELD, group_list, search_groups
+from lib.telegram_rate import FirestoreFloodStore
 
 def load_json(filepath):
     try:
@@ -107,6 +113,32 @@ st.write(f"{current_i18n.get('manage_activists', 'Gestione attivisti per:')} **{
 
 # 4. FETCH DATI E VISUALIZZAZIONE
 doc_ref = db.collection(COLLECTION_NAME).document(user_email)
+
+
+def _apply_telegram_ids(updates_by_email):
+    """Scrive gli id Telegram trovati dal sync in transazione sul doc corrente.
+
+    La risoluzione puo' durare minuti: per ogni attivista ancora presente e
+    ancora senza telegram_user_id si impostano solo telegram_user_id e
+    telegram_username (se vuoto); gli altri campi restano quelli del doc.
+    """
+    @firestore.transactional
+    def _txn(transaction):
+        snap = doc_ref.get(transaction=transaction)
+        fresh_activists = (snap.to_dict() or {}).get("activists", [])
+        merged = []
+        for a in fresh_activists:
+            upd = updates_by_email.get(a.get("email"))
+            if upd and not a.get("telegram_user_id"):
+                a = dict(a, telegram_user_id=upd["telegram_user_id"])
+                if upd.get("telegram_username") and not a.get("telegram_username"):
+                    a["telegram_username"] = upd["telegram_username"]
+            merged.append(a)
+        transaction.update(doc_ref, {"activists": merged})
+
+    _txn(db.transaction())
+
+
 doc = doc_ref.get()
 
 if doc.exists:
@@ -123,6 +155,16 @@ else:
     # Crea il documento vuoto se non esiste
     doc_ref.set({"activists": []})
 
+# Session decifrata una volta per run e usata da tutte le sezioni (None se
+# assente, corrotta o Telegram non configurato).
+existing_session = try_decrypt_session(telegram_session_encrypted)
+
+# Cache entita' Telegram (peer id / access_hash) persistita nel doc organizer:
+# evita di risolvere di nuovo gruppi e utenti gia' visti.
+if existing_session:
+    bind_entity_store(existing_session, FirestoreEntityStore(doc_ref))
+    bind_rate_store(existing_session, FirestoreFloodStore(doc_ref))
+
 # 4.5 SEZIONE INTEGRAZIONE TELEGRAM
 st.markdown("---")
 with st.expander(f"📡 {current_i18n.get('tg_section_title', 'Connect your Telegram')}", expanded=False):
@@ -131,22 +173,36 @@ with st.expander(f"📡 {current_i18n.get('tg_section_title', 'Connect your Tele
     if not is_telegram_configured():
         st.warning(current_i18n.get("tg_not_configured", "Telegram integration not yet configured by the administrator."))
     else:
-        # Stato attuale: prova a decifrare la session salvata e verifica
-        existing_session = try_decrypt_session(telegram_session_encrypted)
+        # Stato attuale: verifica la session salvata
         me = None
+        identity = None
         if existing_session:
+            # Servito dalla cache (ri-verifica in background quando scade il TTL):
+            # solo la prima visita paga la connessione a Telegram.
             with st.spinner("..."):
-                me = tg_whoami(existing_session)
+                identity = tg_session_identity(existing_session)
+            me = identity["me"]
 
         if me:
             # Caso: gia' connesso
             who_str = ("@" + me["username"]) if me.get("username") else (me.get("first_name") or str(me.get("id")))
             st.success(current_i18n.get("tg_status_connected", "Connected as {who}").replace("{who}", who_str))
+            if identity and identity.get("verified_at"):
+                verified_ago = max(0, int(_time.time() - identity["verified_at"]))
+                st.caption(
+                    current_i18n.get("tg_status_verified_ago", "Last verified {seconds}s ago")
+                    .replace("{seconds}", str(verified_ago))
+                )
             col_d1, _ = st.columns([2, 6])
             if col_d1.button(f"🔌 {current_i18n.get('tg_btn_disconnect', 'Disconnect Telegram')}", key="tg_btn_disconnect"):
                 with st.spinner("..."):
                     tg_logout(existing_session)
-                doc_ref.set({"telegram_session_encrypted": ""}, merge=True)
+                doc_ref.set({
+                    "telegram_session_encrypted": "",
+                    FirestoreEntityStore.DEFAULT_FIELD: firestore.DELETE_FIELD,
+                    GROUP_INDEX_FIELD: firestore.DELETE_FIELD,
+                    FirestoreFloodStore.DEFAULT_FIELD: firestore.DELETE_FIELD,
+                }, merge=True)
                 for k in ("tg_step", "tg_phone", "tg_phone_code_hash", "tg_intermediate_session"):
                     st.session_state.pop(k, None)
                 st.success(current_i18n.get("tg_disconnect_success", "Telegram disconnected."))
@@ -208,7 +264,13 @@ with st.expander(f"📡 {current_i18n.get('tg_section_title', 'Connect your Tele
                             st.rerun()
                         else:
                             enc = encrypt_session(next_session)
-                            doc_ref.set({"telegram_session_encrypted": enc}, merge=True)
+                            # Nuovo account: gli access_hash in cache non valgono piu'.
+                            doc_ref.set({
+                                "telegram_session_encrypted": enc,
+                                FirestoreEntityStore.DEFAULT_FIELD: firestore.DELETE_FIELD,
+                                GROUP_INDEX_FIELD: firestore.DELETE_FIELD,
+                                FirestoreFloodStore.DEFAULT_FIELD: firestore.DELETE_FIELD,
+                            }, merge=True)
                             for k in ("tg_step", "tg_phone", "tg_phone_code_hash", "tg_intermediate_session"):
                                 st.session_state.pop(k, None)
                             st.success(current_i18n.get("tg_login_success", "Telegram connected successfully!"))
@@ -236,7 +298,12 @@ with st.expander(f"📡 {current_i18n.get('tg_section_title', 'Connect your Tele
                                 pwd_input,
                             )
                         enc = encrypt_session(final_session)
-                        doc_ref.set({"telegram_session_encrypted": enc}, merge=True)
+                        doc_ref.set({
+                            "telegram_session_encrypted": enc,
+                            FirestoreEntityStore.DEFAULT_FIELD: firestore.DELETE_FIELD,
+                            GROUP_INDEX_FIELD: firestore.DELETE_FIELD,
+                            FirestoreFloodStore.DEFAULT_FIELD: firestore.DELETE_FIELD,
+                        }, merge=True)
                         for k in ("tg_step", "tg_phone", "tg_phone_code_hash", "tg_intermediate_session"):
                             st.session_state.pop(k, None)
                         st.success(current_i18n.get("tg_login_success", "Telegram connected successfully!"))
@@ -249,7 +316,6 @@ with st.expander(f"📡 {current_i18n.get('tg_section_title', 'Connect your Tele
                     st.rerun()
 
 # 4.6 SEZIONE GRUPPO TELEGRAM DEL CAPITOLO
-existing_session_for_groups = try_decrypt_session(telegram_session_encrypted)
 with st.expander(f"📍 {current_i18n.get('chapter_section_title', 'Chapter Telegram group')}", expanded=False):
     st.write(current_i18n.get("chapter_section_desc", ""))
 
@@ -262,23 +328,49 @@ with st.expander(f"📍 {current_i18n.get('chapter_section_title', 'Chapter Tele
             .replace("{id}", str(telegram_chat_id_saved))
         )
 
-    # Se Telegram e' connesso, offri picker dai dialog
-    if existing_session_for_groups:
-        col_load, _ = st.columns([3, 5])
-        if col_load.button(
+    # Se Telegram e' connesso, offri picker dall'indice gruppi salvato nel doc
+    # organizer (aggiornato in modo incrementale, vedi lib/telegram_groups.py).
+    if existing_session:
+        group_index = data.get(GROUP_INDEX_FIELD) if doc.exists else None
+        col_load, col_full, _ = st.columns([3, 2, 3])
+        load_clicked = col_load.button(
             f"🔄 {current_i18n.get('chapter_load_groups_btn', 'Load my Telegram groups')}",
             key="btn_load_tg_groups",
-        ):
+        )
+        full_clicked = bool(group_index) and col_full.button(
+            current_i18n.get("chapter_full_refresh_btn", "Reload all"),
+            key="btn_full_tg_groups",
+        )
+        if load_clicked or full_clicked:
             try:
                 with st.spinner("..."):
-                    st.session_state["tg_groups_cache"] = tg_list_groups(existing_session_for_groups)
+                    synced = tg_sync_group_index(
+                        existing_session, group_index, force_full=full_clicked
+                    )
+                if synced is not group_index:
+                    doc_ref.update({GROUP_INDEX_FIELD: synced})
+                    group_index = synced
             except TelegramOperationError as e:
                 st.error(str(e))
 
-        groups_cache = st.session_state.get("tg_groups_cache")
+        groups_cache = group_list(group_index) if group_index else None
         if groups_cache is not None:
-            if not groups_cache:
+            st.caption(
+                current_i18n.get("chapter_groups_synced_ago", "{count} groups, list updated {minutes} min ago")
+                .replace("{count}", str(len(groups_cache)))
+                .replace("{minutes}", str(max(0, int((_time.time() - float(group_index.get("synced_at") or 0)) // 60))))
+            )
+            group_query = st.text_input(
+                current_i18n.get("chapter_group_filter_label", "Filter groups"),
+                key="tg_groups_filter",
+                placeholder=current_i18n.get("chapter_group_filter_placeholder", "Start of the group name or ID"),
+            )
+            all_groups_count = len(groups_cache)
+            groups_cache = search_groups(groups_cache, group_query)
+            if not all_groups_count:
                 st.info(current_i18n.get("chapter_no_groups", "No groups found in your Telegram account."))
+            elif not groups_cache:
+                st.info(current_i18n.get("chapter_no_groups_match", "No group matches the filter."))
             else:
                 # Pre-seleziona il gruppo salvato se presente
                 try:
@@ -315,7 +407,7 @@ with st.expander(f"📍 {current_i18n.get('chapter_section_title', 'Chapter Tele
         st.info(current_i18n.get("chapter_connect_first", "Connect Telegram above to pick from your groups, or enter the ID manually below."))
 
     # Fallback: inserimento manuale (sempre disponibile)
-    with st.expander(f"✏️ {current_i18n.get('chapter_manual_entry', 'Enter manually')}", expanded=not existing_session_for_groups):
+    with st.expander(f"✏️ {current_i18n.get('chapter_manual_entry', 'Enter manually')}", expanded=not existing_session):
         with st.form("chapter_form_manual", clear_on_submit=False):
             chat_id_input = st.text_input(
                 current_i18n.get("chapter_chat_id_label", "Telegram group chat ID"),
@@ -341,12 +433,11 @@ with st.expander(f"📍 {current_i18n.get('chapter_section_title', 'Chapter Tele
                     st.error(f"{current_i18n.get('save_error', 'Save error:')} {e}")
 
 # 4.7 SEZIONE SINCRONIZZAZIONE TELEGRAM DA NUMERI
-existing_session_for_sync = try_decrypt_session(telegram_session_encrypted)
 with st.expander(f"🔄 {current_i18n.get('phone_sync_title', 'Sincronizza Telegram da numeri')}", expanded=False):
     st.write(current_i18n.get("phone_sync_desc", "Per ogni attivista con numero di telefono ma senza username Telegram, prova a risolvere via il numero. Utile per chi non ha un @username pubblico."))
     if not is_telegram_configured():
         st.warning(current_i18n.get("tg_not_configured", "Telegram integration not yet configured."))
-    elif not existing_session_for_sync:
+    elif not existing_session:
         st.warning(current_i18n.get("cubes_no_session", "Telegram non connesso."))
     else:
         # Conta candidati (attivisti senza user_id che hanno un telefono)
@@ -373,61 +464,76 @@ with st.expander(f"🔄 {current_i18n.get('phone_sync_title', 'Sincronizza Teleg
             st.info(current_i18n.get("phone_sync_nothing_to_do", "Nessun attivista da risolvere (tutti gia' hanno user_id Telegram o numero non normalizzabile)."))
         else:
             st.write(current_i18n.get("phone_sync_will_process", "Saranno processati {n} attivisti.").replace("{n}", str(n_total)))
+            resolve_blocked_s = int(get_rate_state(existing_session)["resolve"]["blocked_for_s"])
+            if resolve_blocked_s:
+                st.warning(
+                    current_i18n.get("phone_sync_rate_blocked", "Telegram ha messo in pausa le ricerche per numero di questo account: riprova fra {seconds}s.")
+                    .replace("{seconds}", str(resolve_blocked_s))
+                )
             if st.button(f"🔄 {current_i18n.get('phone_sync_btn', 'Avvia sincronizzazione')}", key="btn_phone_sync", type="primary"):
                 progress = st.empty()
                 results_rows = []
-                for i, act in enumerate(candidates, start=1):
+                names_by_phone = {
+                    act.get("telefono", ""): f"{act.get('nome', '')} {act.get('cognome', '')}"
+                    for act in candidates
+                }
+
+                def _on_sync_progress(done, total, raw_phone):
                     progress.info(
                         current_i18n.get("phone_sync_progress", "Sincronizzo {n}/{total} — {name}")
-                        .replace("{n}", str(i))
-                        .replace("{total}", str(n_total))
-                        .replace("{name}", f"{act.get('nome', '')} {act.get('cognome', '')}")
+                        .replace("{n}", str(done))
+                        .replace("{total}", str(total))
+                        .replace("{name}", names_by_phone.get(raw_phone, raw_phone))
                     )
-                    try:
-                        res = tg_resolve_phone(existing_session_for_sync, act.get("telefono", ""))
-                    except TelegramOperationError as exc:
-                        progress.error(str(exc))
+
+                try:
+                    resolved_by_phone = tg_resolve_phones_bulk(
+                        existing_session,
+                        [act.get("telefono", "") for act in candidates],
+                        on_progress=_on_sync_progress,
+                    )
+                except TelegramOperationError as exc:
+                    progress.error(str(exc))
+                    resolved_by_phone = {}
+
+                # Applica tutti gli aggiornamenti con un'unica scrittura dell'array,
+                # in transazione sul doc riletto (vedi _apply_telegram_ids).
+                updates_by_email = {}
+                for act in candidates:
+                    res = resolved_by_phone.get(act.get("telefono", ""))
+                    if res is None:
+                        continue
+                    if res.get("ok"):
+                        updates_by_email[act.get("email")] = {
+                            "telegram_user_id": res["user_id"],
+                            "telegram_username": res.get("username"),
+                        }
                         results_rows.append({
                             "Nome": f"{act.get('nome', '')} {act.get('cognome', '')}",
-                            "Tel": act.get("telefono", ""),
-                            "Esito": f"❌ {exc}",
+                            "Tel": res.get("phone_e164") or act.get("telefono", ""),
+                            "Esito": f"✅ user_id={res['user_id']}" + (f", @{res['username']}" if res.get('username') else " (senza username)"),
                         })
-                        break
-                    if res.get("ok"):
-                        # Aggiorna l'attivista (ArrayRemove vecchio + ArrayUnion nuovo)
-                        updated = dict(act)
-                        updated["telegram_user_id"] = res["user_id"]
-                        if res.get("username") and not updated.get("telegram_username"):
-                            updated["telegram_username"] = res["username"]
-                        try:
-                            batch = db.batch()
-                            batch.update(doc_ref, {"activists": firestore.ArrayRemove([act])})
-                            batch.update(doc_ref, {"activists": firestore.ArrayUnion([updated])})
-                            batch.commit()
-                            results_rows.append({
-                                "Nome": f"{act.get('nome', '')} {act.get('cognome', '')}",
-                                "Tel": res.get("phone_e164") or act.get("telefono", ""),
-                                "Esito": f"✅ user_id={res['user_id']}" + (f", @{res['username']}" if res.get('username') else " (senza username)"),
-                            })
-                        except Exception as exc:
-                            results_rows.append({
-                                "Nome": f"{act.get('nome', '')} {act.get('cognome', '')}",
-                                "Tel": res.get("phone_e164") or act.get("telefono", ""),
-                                "Esito": f"⚠️ Salvataggio fallito: {exc}",
-                            })
                     else:
                         err_code = res.get("error", "unknown")
                         err_label = {
                             "normalize_failed": "❌ Numero non normalizzabile",
                             "not_on_telegram_or_privacy": "❌ Non su Telegram o privacy",
                             "session_invalid": "🔌 Sessione non valida",
+                            "rate_limited": f"⏳ Rate limit Telegram, riprova fra {res.get('retry_after', '?')}s",
                         }.get(err_code, f"❌ {err_code}")
                         results_rows.append({
                             "Nome": f"{act.get('nome', '')} {act.get('cognome', '')}",
                             "Tel": res.get("phone_e164") or act.get("telefono", ""),
                             "Esito": err_label,
                         })
-                    _time.sleep(1.5)  # anti-FloodWait
+
+                if updates_by_email:
+                    try:
+                        _apply_telegram_ids(updates_by_email)
+                    except Exception as exc:
+                        for row in results_rows:
+                            if row["Esito"].startswith("✅"):
+                                row["Esito"] = f"⚠️ Salvataggio fallito: {exc}"
 
                 progress.empty()
                 ok_count = sum(1 for r in results_rows if r["Esito"].startswith("✅"))
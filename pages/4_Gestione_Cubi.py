@@ -13,8 +13,7 @@ Lo storage e' nella collezione Firestore `cube_events`.
 
 import json
 import uuid
-import time as _time
-from datetime import datetime, time
+from datetime import datetime, time, timezone
 
 import firebase_admin
 import pandas as pd
@@ -24,15 +23,48 @@ from firebase_admin import firestore
 from lib.telegram_client import (
     TelegramConfigError,
     TelegramOperationError,
+    bind_entity_store,
+    bind_rate_store,
     get_poll_message,
-    get_poll_voters,
+    get_poll_voters_delta,
+    get_poll_voters_delta_batch,
     is_telegram_configured,
     list_open_polls as tg_list_open_polls,
     parse_telegram_message_link,
-    send_dm,
+    get_rate_state,
     try_decrypt_session,
     whoami as tg_whoami,
 )
+from lib.cube_events import (
+    EVENTS_COLLECTION,
+    build_refresh_update,
+    derive_initial_category,
+    known_option_counts,
+    remember_mappings,
+    reminder_candidates,
+    reminder_job_items,
+    render_reminder_template,
+)
+from lib.reminder_jobs import (
+    ACTIVE_STATUSES,
+    cancel_reminder_job,
+    enqueue_reminder_job,
+    is_claimable,
+    load_job,
+    start_reminder_job,
+)
+from lib.refresh_scheduler import EVENT_TIMEZONE, event_start
+from lib.reminder_schedules import (
+    DEFAULT_OFFSETS_H,
+    OFFSET_CHOICES_H,
+    cancel_event_schedules,
+    cancel_reminder_schedule,
+    create_reminder_schedules,
+    event_schedules,
+    reschedule_event,
+)
+from lib.telegram_entities import FirestoreEntityStore
+from lib.telegram_rate import FirestoreFloodStore
 
 
 # ---------------------------------------------------------------------------
@@ -125,6 +157,9 @@ telegram_chat_id_saved = org_data.get("telegram_chat_id", "")
 telegram_chat_title_saved = org_data.get("telegram_chat_title", "")
 
 session_string = try_decrypt_session(telegram_session_encrypted)
+if session_string:
+    bind_entity_store(session_string, FirestoreEntityStore(org_ref))
+    bind_rate_store(session_string, FirestoreFloodStore(org_ref))
 
 
 # ---------------------------------------------------------------------------
@@ -151,7 +186,6 @@ if not blocked and not telegram_chat_id_saved:
 # Helpers
 # ---------------------------------------------------------------------------
 
-CATEGORIES = ["ignore", "yes", "maybe", "no"]
 CATEGORY_LABELS = {
     "yes": ("✅", "Partecipa"),
     "maybe": ("🤔", "Forse"),
@@ -165,18 +199,6 @@ def category_label(cat: str, lang: str = "IT") -> str:
     return f"{emoji} {label_it}"
 
 
-def render_reminder_template(template: str, recipient: dict, ev: dict) -> str:
-    """Sostituisce i placeholder nel template per un destinatario specifico."""
-    out = template or ""
-    out = out.replace("{nome}", recipient.get("nome", "") or "")
-    out = out.replace("{cognome}", recipient.get("cognome", "") or "")
-    out = out.replace("{data}", ev.get("data", "") or "")
-    out = out.replace("{ora}", ev.get("ora", "") or "")
-    out = out.replace("{luogo}", ev.get("luogo", "") or "")
-    out = out.replace("{poll_link}", ev.get("poll_link", "") or "")
-    return out
-
-
 def reminder_status_label(error_code):
     """Mappa il codice di errore di send_dm su una stringa i18n."""
     mapping = {
@@ -188,6 +210,8 @@ def reminder_status_label(error_code):
         "unknown_user": t("reminders_status_unknown_user", "❓ Utente non trovato"),
         "session_invalid": t("reminders_status_session_invalid", "🔌 Sessione non valida"),
         "invalid_id": t("reminders_status_invalid_id", "❓ ID non valido"),
+        "interrupted": t("reminders_status_interrupted", "⚠️ Esito incerto (invio interrotto)"),
+        "peer_flood": t("reminders_status_peer_flood", "🛑 Bloccato dall'anti-spam"),
     }
     if error_code in mapping:
         return mapping[error_code]
@@ -197,198 +221,88 @@ def reminder_status_label(error_code):
     return error_code or ""
 
 
-# Keyword per indovinare la categoria dal testo dell'opzione del sondaggio.
-# IMPORTANTE: la lista "no" viene matchata PRIMA della lista "yes" perche'
-# espressioni come "non vengo" / "non posso" contengono parole che da sole
-# matcherebbero "yes" (es. "vengo", "posso").
-import re as _re
-
-CATEGORY_KEYWORDS = {
-    "no": [
-        r"\bno\b",
-        r"non\s+posso",
-        r"non\s+vengo",
-        r"non\s+riesco",
-        r"non\s+partecipo",
-        r"non\s+ci\s+sar",
-        r"impossibile",
-        r"\bko\b",
-        r"\bskip\b",
-        r"\bsalto\b",
-        r"can't",
-        r"cannot",
-        r"\bout\b",
-        r"\bnope\b",
-        r"❌",
-        r"🚫",
-        r"👎",
-    ],
-    "maybe": [
-        r"\bforse\b",
-        r"\bvediamo\b",
-        r"non\s+lo\s+so",
-        r"\bnon\s+so\b",
-        r"\bmagari\b",
-        r"\bboh\b",
-        r"incerto",
-        r"in\s+forse",
-        r"\bmaybe\b",
-        r"perhaps",
-        r"not\s+sure",
-        r"\bdunno\b",
-        r"\?",
-        r"🤔",
-        r"❓",
-    ],
-    "yes": [
-        r"\bs[iì]\b",
-        r"\bci\s+sar[oò]\b",
-        r"\bvengo\b",
-        r"\bpresente\b",
-        r"\bpartecipo\b",
-        r"ci\s+sono",
-        r"primo\s+giorno",
-        r"secondo\s+giorno",
-        r"terzo\s+giorno",
-        r"quarto\s+giorno",
-        r"quinto\s+giorno",
-        r"day\s+\d",
-        r"giorno\s+\d",
-        r"\d+\s*°\s*giorno",
-        r"\bok\b",
-        r"\byes\b",
-        r"i'?ll\s+be\s+there",
-        r"\bcoming\b",
-        r"\bgoing\b",
-        r"attending",
-        r"\bin\b",
-        r"✅",
-        r"👍",
-        r"🙋",
-    ],
-}
-
-
-def auto_detect_category(option_text: str) -> str:
-    """Indovina la categoria (yes/maybe/no/ignore) dal testo libero di un'opzione.
-
-    Logica: lowercase + regex word-boundary matching, in ordine no -> maybe -> yes
-    (l'ordine evita falsi positivi: "non vengo" deve matchare NO prima di YES).
-    Ritorna "ignore" se nessuna keyword matcha.
-    """
-    if not option_text:
-        return "ignore"
-    t = option_text.strip().lower()
-    if not t:
-        return "ignore"
-    for cat in ("no", "maybe", "yes"):
-        for pattern in CATEGORY_KEYWORDS[cat]:
-            if _re.search(pattern, t, flags=_re.IGNORECASE):
-                return cat
-    return "ignore"
-
-
-def derive_initial_category(option_text: str, memorized_mappings: dict) -> str:
-    """Decide la categoria di default per un'opzione del poll.
-
-    1) Se l'organizer ha gia' classificato esattamente quel testo in passato
-       (memorized_mappings), riutilizza quella scelta.
-    2) Altrimenti applica auto_detect_category sul testo.
-    3) Default finale: "ignore".
-    """
-    key = (option_text or "").strip().lower()
-    if key and memorized_mappings and key in memorized_mappings:
-        cat = memorized_mappings[key]
-        if cat in CATEGORIES:
-            return cat
-    return auto_detect_category(option_text)
-
-
-def remember_mappings(current_memory: dict, poll_options_with_categories) -> dict:
-    """Aggiorna la memoria mapping con le scelte non-banali dell'organizer.
-
-    Non memorizziamo "ignore" (e' il default, non insegna nulla).
-    Le voci esistenti vengono SOVRASCRITTE (l'ultimo verdetto vince).
-    """
-    out = dict(current_memory or {})
-    for opt in poll_options_with_categories:
-        text = (opt.get("text") or "").strip().lower()
-        cat = opt.get("category", "ignore")
-        if not text:
+# Ogni quanti secondi la pagina rilegge l'avanzamento di un job di invio.
+REMINDER_JOB_POLL_S = 2
+
+
+def schedule_status_label(sched):
+    status = sched.get("status")
+    if status == "sent":
+        return t("reminders_schedule_sent", "✅ Inviato a {n}").replace("{n}", str(sched.get("n_recipients") or 0))
+    if status == "skipped":
+        if sched.get("n_recipients") == 0:
+            return t("reminders_schedule_nobody", "⏭ Tutti avevano gia' risposto")
+        return t("reminders_schedule_skipped", "⏭ Saltato: {err}").replace("{err}", sched.get("error") or "")
+    if status == "failed":
+        return t("reminders_schedule_failed", "❌ {err}").replace("{err}", sched.get("error") or "")
+    if sched.get("error"):
+        return t("reminders_schedule_retry", "⏳ In attesa (riprovo: {err})").replace("{err}", sched["error"])
+    return t("reminders_schedule_pending", "⏳ In attesa")
+
+
+def render_reminder_job_results(job):
+    """Riepilogo e tabella esiti di un job di invio concluso."""
+    status = job.get("status")
+    if status == "failed" or (status == "cancelled" and job.get("error")):
+        st.error(t("reminders_aborted", "Interrotto: {err}").replace("{err}", job.get("error") or ""))
+    elif status == "cancelled":
+        st.warning(t("reminders_job_cancelled", "Invio annullato."))
+    st.success(
+        t("reminders_done", "Reminder inviati: {ok} OK, {fail} falliti.")
+        .replace("{ok}", str(job.get("ok", 0)))
+        .replace("{fail}", str(job.get("fail", 0)))
+    )
+    results = job.get("results", {})
+    result_rows = []
+    for idx, item in enumerate(job.get("items", [])):
+        r = results.get(str(idx))
+        if r is None:
             continue
-        if cat == "ignore":
-            continue
-        if cat not in CATEGORIES:
-            continue
-        out[text] = cat
-    return out
-
-
-def compute_participations(activists_list, options_with_voters):
-    """Match votanti -> attivisti, prima per telegram_user_id (canonico, infallibile),
-    poi per telegram_username (fallback).
-
-    Ritorna (participations, outside_voters).
-    participations: dict keyed by activist email.
-    outside_voters: list di dict per chi ha votato ma non e' nella lista attivisti.
-    """
-    # Index attivisti per user_id (priorita') e per username (fallback)
-    by_user_id = {}
-    by_username = {}
-    for a in activists_list:
-        uid = a.get("telegram_user_id")
-        if isinstance(uid, int) and uid > 0:
-            by_user_id[uid] = a
-        uname = (a.get("telegram_username") or "").strip().lower().lstrip("@")
-        if uname:
-            by_username[uname] = a
-
-    participations = {}
-    matched_user_ids = set()
-    for opt in options_with_voters:
-        for v in opt.get("voters", []):
-            vid = v.get("user_id")
-            vuname = (v.get("username") or "").strip().lower()
-            # Match priority: user_id > username
-            act = None
-            if isinstance(vid, int) and vid in by_user_id:
-                act = by_user_id[vid]
-            elif vuname and vuname in by_username:
-                act = by_username[vuname]
-            if act is None:
-                continue
-            # Se vota piu' opzioni (multiple_choice), prendiamo la prima trovata
-            if act["email"] not in participations:
-                participations[act["email"]] = {
-                    "voted": True,
-                    "option_idx": opt["idx"],
-                    "option_text": opt["text"],
-                    "telegram_user_id": vid,
-                    "voted_at": v.get("voted_at"),
-                }
-                if vid:
-                    matched_user_ids.add(vid)
-
-    outside = []
-    for opt in options_with_voters:
-        for v in opt.get("voters", []):
-            if v.get("user_id") in matched_user_ids:
-                continue
-            outside.append({
-                "user_id": v.get("user_id"),
-                "username": v.get("username"),
-                "first_name": v.get("first_name", ""),
-                "last_name": v.get("last_name", ""),
-                "option_idx": opt["idx"],
-                "option_text": opt["text"],
-                "voted_at": v.get("voted_at"),
-            })
-
-    return participations, outside
+        res_label = reminder_status_label(None if r.get("ok") else (r.get("error") or "unknown: ?"))
+        uname = r.get("username") or item.get("username")
+        uid = r.get("user_id") or item.get("user_id")
+        result_rows.append({
+            t("reminders_table_name", "Nome"): f"{item.get('nome', '')} {item.get('cognome', '')}",
+            t("reminders_table_telegram", "Telegram"): ("@" + uname) if uname else (f"id:{uid}" if uid else "—"),
+            t("reminders_table_result", "Risultato"): res_label,
+            t("reminders_fallback_link", "Apri chat"): r.get("fallback_link") or "",
+        })
+    if result_rows:
+        st.dataframe(pd.DataFrame(result_rows), hide_index=True, use_container_width=True)
+
+
+@st.fragment(run_every=REMINDER_JOB_POLL_S)
+def reminder_job_progress(job_id, event_id, key_prefix):
+    """Avanzamento di un job di invio; a job concluso ridisegna la pagina intera."""
+    job = load_job(db, job_id)
+    if job is None or job.get("status") not in ACTIVE_STATUSES:
+        st.rerun()
+    items = job.get("items", [])
+    total = len(items)
+    done = int(job.get("cursor", 0))
+    label = (
+        t("reminders_sending", "Invio {n}/{total} — {name}")
+        .replace("{n}", str(min(done + 1, total)))
+        .replace("{total}", str(total))
+        .replace("{name}", f"{items[done]['nome']} {items[done]['cognome']}" if done < total else "")
+    )
+    st.progress(done / total if total else 1.0, text=label)
+    if job.get("paused_s"):
+        st.warning(
+            t("reminders_paused", "Rate limit Telegram: pausa di {seconds}s, poi riprendo ({n}/{total})")
+            .replace("{seconds}", str(job["paused_s"]))
+            .replace("{n}", str(done + 1))
+            .replace("{total}", str(total))
+        )
+    elif job.get("status") == "queued" and job.get("error"):
+        st.warning(job["error"])
+    if st.button("⏹ " + t("reminders_job_cancel", "Annulla invio"), key=f"{key_prefix}_cancel_reminder_job"):
+        cancel_reminder_job(db, job_id, event_id)
+        st.rerun()
 
 
 def event_collection():
-    return db.collection("cube_events")
+    return db.collection(EVENTS_COLLECTION)
 
 
 def format_event_header(ev):
@@ -484,6 +398,8 @@ def submit_new_cube(form_data, form_ora, form_luogo, form_note, form_poll_link):
         "poll_multiple_choice": (poll_data or {}).get("multiple_choice", False),
         "participations": {},
         "outside_voters": [],
+        "poll_option_counts": {},
+        "poll_voter_ids": {},
         "last_refresh": None,
         "created_at": firestore.SERVER_TIMESTAMP,
         "updated_at": firestore.SERVER_TIMESTAMP,
@@ -675,36 +591,24 @@ def render_event(ev):
 
         if refresh_clicked:
             try:
+                # I conteggi salvati valgono solo se c'e' anche la cache votanti
+                # (eventi creati prima del refresh incrementale: refresh completo).
+                known_counts = known_option_counts(ev)
                 with st.spinner(t("cubes_refreshing", "Leggo i votanti dal sondaggio...")):
-                    voters_data = get_poll_voters(
+                    delta = get_poll_voters_delta(
                         session_string,
                         ev["telegram_chat_ref"],
                         ev["telegram_poll_msg_id"],
+                        known_counts=known_counts,
                     )
                 # Reload attivisti (lista dinamica)
                 current_org = org_ref.get().to_dict() or {}
-                current_activists = current_org.get("activists", [])
-                participations, outside = compute_participations(current_activists, voters_data["options"])
-                # Se al refresh sono apparse opzioni nuove (raro: poll modificato),
-                # le aggiungiamo a poll_options con auto-detect / memoria.
-                existing_idxs = {o["idx"] for o in ev.get("poll_options", [])}
-                merged_poll_options = list(ev.get("poll_options", []))
-                org_mem = (org_ref.get().to_dict() or {}).get("poll_option_mappings", {})
-                for vopt in voters_data.get("options", []):
-                    if vopt["idx"] not in existing_idxs:
-                        merged_poll_options.append({
-                            "idx": vopt["idx"],
-                            "text": vopt["text"],
-                            "category": derive_initial_category(vopt["text"], org_mem),
-                        })
-                event_collection().document(eid).update({
-                    "participations": participations,
-                    "outside_voters": outside,
-                    "last_refresh": firestore.SERVER_TIMESTAMP,
-                    "poll_question": voters_data["question"],
-                    "poll_options": merged_poll_options,
-                    "updated_at": firestore.SERVER_TIMESTAMP,
-                })
+                event_collection().document(eid).update(build_refresh_update(
+                    ev,
+                    delta,
+                    current_org.get("activists", []),
+                    current_org.get("poll_option_mappings", {}),
+                ))
                 st.success(t("cubes_refresh_done", "Aggiornato!"))
                 st.rerun()
             except TelegramOperationError as e:
@@ -805,38 +709,23 @@ def render_event(ev):
         # === Sezione 4.5: reminder DM (Fase 3) ===
         if ev.get("status") != "closed" and session_string:
             st.markdown("---")
-            with st.expander("📨 " + t("reminders_section_title", "Manda reminder"), expanded=False):
-                rcp_cat_by_idx = {o["idx"]: o.get("category", "ignore") for o in ev.get("poll_options", [])}
-                rcp_parts = ev.get("participations", {})
-                rcp_sent = ev.get("reminders_sent", {})
-                candidates = []
-                skipped_unreachable = []
-                for a in activists:
-                    uname_r = (a.get("telegram_username") or "").strip().lstrip("@")
-                    uid_r = a.get("telegram_user_id")
-                    email_r = a.get("email", "")
-                    nome_r = a.get("nome", "")
-                    cogn_r = a.get("cognome", "")
-                    part_r = rcp_parts.get(email_r)
-                    if part_r:
-                        status_cat_r = rcp_cat_by_idx.get(part_r.get("option_idx"), "ignore")
-                        if status_cat_r in ("yes", "no"):
-                            continue
-                    else:
-                        status_cat_r = "no_response"
-                    # Raggiungibile se abbiamo user_id (canonico) o username
-                    if not uname_r and not (isinstance(uid_r, int) and uid_r > 0):
-                        skipped_unreachable.append({"nome": nome_r, "cognome": cogn_r, "email": email_r, "status_cat": status_cat_r})
-                        continue
-                    candidates.append({
-                        "email": email_r,
-                        "nome": nome_r,
-                        "cognome": cogn_r,
-                        "username": uname_r,
-                        "user_id": uid_r if isinstance(uid_r, int) else None,
-                        "status_cat": status_cat_r,
-                        "last_sent": rcp_sent.get(email_r, {}).get("sent_at"),
-                    })
+            with st.expander(
+                "📨 " + t("reminders_section_title", "Manda reminder"),
+                expanded=bool(ev.get("active_reminder_job")),
+            ):
+                # Job di invio in corso (o l'ultimo lanciato da questa sessione).
+                rem_job_id = ev.get("active_reminder_job") or st.session_state.get(f"{key_prefix}_reminder_job")
+                rem_job = load_job(db, rem_job_id) if rem_job_id else None
+                rem_job_running = bool(rem_job) and rem_job.get("status") in ACTIVE_STATUSES
+                if rem_job_running:
+                    # Esecutore sparito (es. riavvio del processo): si riprende dal cursore.
+                    if is_claimable(rem_job, datetime.now(timezone.utc)):
+                        start_reminder_job(db, rem_job_id, session_string)
+                    reminder_job_progress(rem_job_id, eid, key_prefix)
+                elif rem_job:
+                    render_reminder_job_results(rem_job)
+
+                candidates, skipped_unreachable = reminder_candidates(ev, activists)
 
                 if not candidates and not skipped_unreachable:
                     st.info(t("reminders_no_recipients", "Nessun destinatario raggiungibile."))
@@ -897,105 +786,91 @@ def render_event(ev):
                             st.code(preview_text, language=None)
 
                     n_sel = len(selected_emails)
+                    # FloodWait in corso sull'account (anche da un'altra pagina o tab).
+                    dm_blocked_s = int(get_rate_state(session_string)["dm"]["blocked_for_s"])
+                    if dm_blocked_s:
+                        st.warning(
+                            t("reminders_rate_blocked", "Telegram ha messo in pausa gli invii di questo account: riprova fra {seconds}s.")
+                            .replace("{seconds}", str(dm_blocked_s))
+                        )
                     btn_label = t("reminders_btn_send", "Invia reminder a {n} selezionati").replace("{n}", str(n_sel))
-                    if st.button("📨 " + btn_label, key=f"{key_prefix}_send_reminders", disabled=(n_sel == 0), type="primary"):
-                        progress = st.empty()
-                        results = []
+                    if st.button(
+                        "📨 " + btn_label,
+                        key=f"{key_prefix}_send_reminders",
+                        disabled=(n_sel == 0 or rem_job_running),
+                        type="primary",
+                    ):
                         recipients_to_send = [c for c in visible_candidates if c["email"] in selected_emails]
-                        for i, rcp in enumerate(recipients_to_send, start=1):
-                            progress.info(
-                                t("reminders_sending", "Invio {n}/{total} — {name}")
-                                .replace("{n}", str(i))
-                                .replace("{total}", str(len(recipients_to_send)))
-                                .replace("{name}", f"{rcp['nome']} {rcp['cognome']}")
-                            )
-                            personalized = render_reminder_template(template_val, rcp, ev)
-                            try:
-                                # Preferisce user_id (canonico) se cached, altrimenti username
-                                tg_recipient = rcp.get("user_id") or rcp.get("username")
-                                res = send_dm(session_string, tg_recipient, personalized)
-                            except TelegramOperationError as exc:
-                                results.append({
-                                    "email": rcp["email"],
-                                    "nome": rcp["nome"],
-                                    "cognome": rcp["cognome"],
-                                    "username": rcp.get("username"),
-                                    "user_id": rcp.get("user_id"),
-                                    "ok": False,
-                                    "error": str(exc),
-                                    "fallback_link": (f"https://t.me/{rcp['username']}" if rcp.get("username") else None),
-                                })
-                                progress.error(t("reminders_aborted", "Interrotto: {err}").replace("{err}", str(exc)))
-                                break
-                            results.append({
-                                "email": rcp["email"],
-                                "nome": rcp["nome"],
-                                "cognome": rcp["cognome"],
-                                "username": rcp.get("username") or res.get("username"),
-                                "ok": res.get("ok", False),
-                                "error": res.get("error"),
-                                "fallback_link": res.get("fallback_link"),
-                                "user_id": res.get("user_id") or rcp.get("user_id"),
-                            })
-                            _time.sleep(1.2)
-
-                        progress.empty()
-
-                        ts_now = firestore.SERVER_TIMESTAMP
-                        new_sent_map = dict(ev.get("reminders_sent", {}))
-                        log_entries = []
-                        ok_count = 0
-                        fail_count = 0
-                        for r in results:
-                            entry = {
-                                "sent_at": ts_now,
-                                "status": "ok" if r["ok"] else "fail",
-                                "error": r.get("error"),
-                                "fallback_link": r.get("fallback_link"),
-                            }
-                            new_sent_map[r["email"]] = entry
-                            if r["ok"]:
-                                ok_count += 1
-                            else:
-                                fail_count += 1
-                            log_entries.append({
-                                "event_id": eid,
-                                "organizer_email": user_email,
-                                "to_email": r["email"],
-                                "to_username": r["username"],
-                                "to_telegram_user_id": r.get("user_id"),
-                                "status": entry["status"],
-                                "error": entry["error"],
-                                "sent_at": ts_now,
-                            })
+                        job_items = reminder_job_items(template_val, recipients_to_send, ev)
                         try:
-                            event_collection().document(eid).update({
-                                "reminders_sent": new_sent_map,
-                                "updated_at": ts_now,
-                            })
-                            for le in log_entries:
-                                db.collection("reminder_log").add(le)
+                            job_id = enqueue_reminder_job(db, user_email, eid, job_items)
                         except Exception as exc:
                             st.error(f"{t('save_error', 'Errore:')} {exc}")
-
-                        st.success(
-                            t("reminders_done", "Reminder inviati: {ok} OK, {fail} falliti.")
-                            .replace("{ok}", str(ok_count))
-                            .replace("{fail}", str(fail_count))
+                        else:
+                            # L'invio prosegue sul loop del pool anche se il browser si disconnette.
+                            st.session_state[f"{key_prefix}_reminder_job"] = job_id
+                            start_reminder_job(db, job_id, session_string)
+                            st.rerun()
+
+                    # Reminder programmati: stesso messaggio e stessa scelta
+                    # "Forse", destinatari ricalcolati dal worker al momento dell'invio.
+                    st.markdown("**⏰ " + t("reminders_schedule_title", "Programma invio automatico") + "**")
+                    if event_start(ev) is None:
+                        st.caption(t("reminders_schedule_no_date", "Imposta data e ora del cubo per programmare i reminder."))
+                    else:
+                        sched_offsets = st.multiselect(
+                            t("reminders_schedule_offsets", "Ore prima del cubo"),
+                            options=OFFSET_CHOICES_H,
+                            default=DEFAULT_OFFSETS_H,
+                            format_func=lambda h: f"{h}h",
+                            key=f"{key_prefix}_sched_offsets",
                         )
+                        st.caption(t(
+                            "reminders_schedule_hint",
+                            "Al momento dell'invio il sondaggio viene riletto e il reminder va solo a chi non ha ancora risposto. Richiede il worker `python worker.py reminders`.",
+                        ))
+                        if st.button(
+                            "⏰ " + t("reminders_schedule_btn", "Programma"),
+                            key=f"{key_prefix}_sched_create",
+                            disabled=not sched_offsets,
+                        ):
+                            try:
+                                sched_res = create_reminder_schedules(
+                                    db, user_email, eid, ev, sched_offsets, template_val, include_maybe,
+                                )
+                            except Exception as exc:
+                                st.error(f"{t('save_error', 'Errore:')} {exc}")
+                            else:
+                                if sched_res["past"]:
+                                    st.session_state[f"{key_prefix}_sched_past"] = sched_res["past"]
+                                st.rerun()
+                        sched_past = st.session_state.pop(f"{key_prefix}_sched_past", None)
+                        if sched_past:
+                            st.warning(
+                                t("reminders_schedule_past", "Orari gia' passati, non programmati: {offsets}")
+                                .replace("{offsets}", ", ".join(f"{h}h" for h in sched_past))
+                            )
 
-                        result_rows = []
-                        for r in results:
-                            res_label = reminder_status_label(None if r["ok"] else (r.get("error") or "unknown: ?"))
-                            fb = r.get("fallback_link") or ""
-                            result_rows.append({
-                                t("reminders_table_name", "Nome"): f"{r['nome']} {r['cognome']}",
-                                t("reminders_table_telegram", "Telegram"): ("@" + r["username"]) if r.get("username") else (f"id:{r['user_id']}" if r.get("user_id") else "—"),
-                                t("reminders_table_result", "Risultato"): res_label,
-                                t("reminders_fallback_link", "Apri chat"): fb,
-                            })
-                        if result_rows:
-                            st.dataframe(pd.DataFrame(result_rows), hide_index=True, use_container_width=True)
+                schedules = [s for s in event_schedules(db, eid) if s.get("status") != "cancelled"]
+                for sched in schedules:
+                    sched_due = sched.get("due_at")
+                    due_s = (
+                        sched_due.astimezone(EVENT_TIMEZONE).strftime("%Y-%m-%d %H:%M")
+                        if hasattr(sched_due, "astimezone") else "?"
+                    )
+                    sched_line = (
+                        t("reminders_schedule_item", "{offset}h prima ({when})")
+                        .replace("{offset}", str(sched.get("offset_h", "?")))
+                        .replace("{when}", due_s)
+                    )
+                    sched_line += "  ·  " + schedule_status_label(sched)
+                    sc1, sc2 = st.columns([8, 2])
+                    sc1.write(sched_line)
+                    if sched.get("status") == "pending" and sc2.button(
+                        t("reminders_schedule_cancel", "Annulla"), key=f"{key_prefix}_sched_cancel_{sched['id']}"
+                    ):
+                        cancel_reminder_schedule(db, sched["id"])
+                        st.rerun()
 
         # === Sezione 5: azioni ===
         st.markdown("---")
@@ -1014,6 +889,7 @@ def render_event(ev):
                         "status": "closed",
                         "updated_at": firestore.SERVER_TIMESTAMP,
                     })
+                    cancel_event_schedules(db, eid)
                     st.rerun()
         with col_a2:
             edit_toggle_key = f"{key_prefix}_edit_open"
@@ -1031,6 +907,7 @@ def render_event(ev):
             cd1, cd2, _ = st.columns([2, 2, 6])
             if cd1.button("🗑 " + t("btn_yes_delete", "Si, elimina"), key=f"{key_prefix}_delete_yes", type="primary"):
                 event_collection().document(eid).delete()
+                cancel_event_schedules(db, eid)
                 st.session_state.pop(f"{key_prefix}_confirm_del", None)
                 st.success(t("cubes_deleted", "Cubo eliminato."))
                 st.rerun()
@@ -1097,6 +974,8 @@ def render_event(ev):
                                     "poll_multiple_choice": poll_data.get("multiple_choice", False),
                                     "participations": {},
                                     "outside_voters": [],
+                                    "poll_option_counts": {},
+                                    "poll_voter_ids": {},
                                     "last_refresh": None,
                                 })
                             except TelegramOperationError as exc:
@@ -1112,9 +991,13 @@ def render_event(ev):
                                 "poll_options": [],
                                 "participations": {},
                                 "outside_voters": [],
+                                "poll_option_counts": {},
+                                "poll_voter_ids": {},
                                 "last_refresh": None,
                             })
                     event_collection().document(eid).update(update_payload)
+                    if (update_payload["data"], update_payload["ora"]) != (ev.get("data", ""), ev.get("ora", "")):
+                        reschedule_event(db, eid, {**ev, **update_payload})
                     st.session_state.pop(f"{key_prefix}_edit_open", None)
                     st.success(t("cubes_updated", "Cubo aggiornato."))
                     st.rerun()
@@ -1127,8 +1010,67 @@ def render_event(ev):
 # Layout: eventi attivi + eventi chiusi
 # ---------------------------------------------------------------------------
 
+def refresh_all_events(events):
+    """Aggiorna da Telegram tutti i cubi con sondaggio, su una sola connessione.
+
+    Un'unica lettura del doc organizer e un unico batch Firestore per tutti
+    gli update. Ritorna {"ok": int, "errors": [(header, messaggio)]}.
+    """
+    polls = [
+        {
+            "chat_ref": ev["telegram_chat_ref"],
+            "msg_id": int(ev["telegram_poll_msg_id"]),
+            "known_counts": known_option_counts(ev),
+        }
+        for ev in events
+    ]
+    results = get_poll_voters_delta_batch(session_string, polls)
+    current_org = org_ref.get().to_dict() or {}
+    batch = db.batch()
+    ok, errors = 0, []
+    for ev, res in zip(events, results):
+        if not res["ok"]:
+            errors.append((format_event_header(ev), res["error"]))
+            continue
+        batch.update(event_collection().document(ev["_id"]), build_refresh_update(
+            ev,
+            res["delta"],
+            current_org.get("activists", []),
+            current_org.get("poll_option_mappings", {}),
+        ))
+        ok += 1
+    if ok:
+        batch.commit()
+    return {"ok": ok, "errors": errors}
+
+
 st.markdown("---")
 st.subheader(t("cubes_active_title", "Cubi attivi"))
+refreshable_events = [
+    ev for ev in active_events if ev.get("telegram_chat_ref") and ev.get("telegram_poll_msg_id")
+]
+if len(refreshable_events) > 1:
+    if st.button(
+        "🔄 " + t("cubes_refresh_all", "Aggiorna tutti") + f" ({len(refreshable_events)})",
+        key="cubes_refresh_all",
+        disabled=blocked,
+    ):
+        try:
+            with st.spinner(t("cubes_refreshing_all", "Leggo i votanti di tutti i sondaggi...")):
+                st.session_state["cubes_refresh_all_result"] = refresh_all_events(refreshable_events)
+            st.rerun()
+        except TelegramOperationError as e:
+            st.error(str(e))
+        except Exception as e:
+            st.error(f"{t('cubes_refresh_error', 'Errore refresh')}: {e}")
+refresh_all_result = st.session_state.pop("cubes_refresh_all_result", None)
+if refresh_all_result:
+    if refresh_all_result["ok"]:
+        st.success(
+            t("cubes_refresh_all_done", "Aggiornati {n} cubi.").replace("{n}", str(refresh_all_result["ok"]))
+        )
+    for header, error in refresh_all_result["errors"]:
+        st.error(f"{header}: {error}")
 if active_events:
     for ev in active_events:
         render_event(ev)
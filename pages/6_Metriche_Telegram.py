@@ -0,0 +1,235 @@
+"""
+Pagina "Metriche Telegram" — riservata admin.
+
+Scompone i tempi delle operazioni Telegram registrati da lib/telegram_metrics.py:
+  - per operazione (es. get_poll_voters_delta = bottone "Aggiorna"): conteggio,
+    errori e percentili della durata;
+  - per l'operazione scelta, dove va il tempo: handshake, verifica
+    autorizzazione, ogni tipo di richiesta, retry dopo FloodWait;
+  - per tipo di richiesta: latenza, attesa nel governor, FloodWait.
+
+Sorgenti: il ring buffer in memoria di questo processo e, se configurato con
+TELEGRAM_METRICS_SINK, il sink persistente (che raccoglie anche il worker).
+"""
+
+import json
+import time
+from datetime import datetime
+
+import pandas as pd
+import streamlit as st
+
+from lib import telegram_metrics
+from lib.telegram_client import configure_metrics_sink
+
+
+# ---------------------------------------------------------------------------
+# i18n
+# ---------------------------------------------------------------------------
+
+def load_json(filepath):
+    try:
+        with open(filepath, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+I18N = load_json("data/i18n.json")
+lang_code = st.session_state.get("lang", "EN")
+current_i18n = I18N.get(lang_code, I18N.get("EN", {}))
+
+
+def t(key, fallback=""):
+    return current_i18n.get(key, fallback or key)
+
+
+# ---------------------------------------------------------------------------
+# Auth
+# ---------------------------------------------------------------------------
+
+try:
+    is_logged_in = st.user.is_logged_in
+except AttributeError:
+    is_logged_in = st.user.get("email") is not None if hasattr(st.user, "get") else False
+
+if not is_logged_in:
+    st.error(t("login_required", "Devi effettuare il login per accedere a questa pagina."))
+    st.stop()
+
+user_profiles = st.session_state.get("user_profiles", [])
+if "admin" not in user_profiles:
+    st.error(t("admin_required", "Accesso negato. Questa pagina è riservata agli amministratori."))
+    st.stop()
+
+
+# ---------------------------------------------------------------------------
+# UI: titolo + sorgente
+# ---------------------------------------------------------------------------
+
+st.title(t("tg_metrics_page_title", "Metriche Telegram"))
+st.write(t("tg_metrics_page_desc", "Tempi delle operazioni Telegram: handshake, richieste, retry e FloodWait."))
+
+configure_metrics_sink()
+persistent_sinks = [s for s in telegram_metrics.metrics_sinks() if s is not telegram_metrics.metrics_buffer()]
+sink_errors = telegram_metrics.sink_errors()
+if sink_errors:
+    st.warning(
+        t("tg_metrics_sink_errors", "Eventi persi per errori del sink metriche:") + " "
+        + ", ".join(f"{name}: {count}" for name, count in sorted(sink_errors.items()))
+    )
+
+source_options = [("memory", t("tg_metrics_source_memory", "Questo processo (memoria)"))]
+if persistent_sinks:
+    source_options.append(("persistent", t("tg_metrics_source_persistent", "Sink persistente (anche worker)")))
+
+window_options = [
+    ("900", t("tg_metrics_window_15m", "Ultimi 15 minuti")),
+    ("3600", t("tg_metrics_window_1h", "Ultima ora")),
+    ("86400", t("tg_metrics_window_24h", "Ultime 24 ore")),
+    ("all", t("tg_metrics_window_all", "Tutto")),
+]
+
+col_f1, col_f2, col_f3 = st.columns([3, 3, 2])
+with col_f1:
+    source = st.selectbox(
+        t("tg_metrics_source", "Sorgente"),
+        options=[o[0] for o in source_options],
+        format_func=lambda x: dict(source_options)[x],
+    )
+with col_f2:
+    window = st.selectbox(
+        t("tg_metrics_window", "Periodo"),
+        options=[o[0] for o in window_options],
+        format_func=lambda x: dict(window_options)[x],
+        index=1,
+    )
+with col_f3:
+    st.write("")
+    if source == "memory" and st.button("🗑 " + t("tg_metrics_clear", "Svuota buffer")):
+        telegram_metrics.metrics_buffer().clear()
+        st.rerun()
+
+
+# ---------------------------------------------------------------------------
+# Carica eventi
+# ---------------------------------------------------------------------------
+
+try:
+    if source == "memory":
+        events = telegram_metrics.metrics_buffer().recent()
+    else:
+        events = persistent_sinks[0].recent()
+except Exception as e:
+    st.error(f"{t('tg_metrics_load_error', 'Errore lettura metriche')}: {e}")
+    st.stop()
+
+if window != "all":
+    since = time.time() - int(window)
+    events = [e for e in events if (e.get("ts") or 0) >= since]
+
+ops = [e for e in events if e.get("kind") == telegram_metrics.OP]
+rpcs = [e for e in events if e.get("kind") == telegram_metrics.RPC]
+
+col_s1, col_s2, col_s3, col_s4 = st.columns(4)
+col_s1.metric(t("tg_metrics_stat_ops", "Operazioni"), len(ops))
+col_s2.metric(t("tg_metrics_stat_rpc", "Richieste"), len(rpcs))
+col_s3.metric(t("tg_metrics_stat_errors", "Errori"), sum(1 for e in events if not e.get("ok", True)))
+col_s4.metric(t("tg_metrics_stat_flood", "FloodWait (s)"), int(sum(float(e.get("flood_wait_s") or 0) for e in events)))
+
+if not events:
+    st.info(t("tg_metrics_empty", "Nessun evento nel periodo selezionato."))
+    st.stop()
+
+
+def summary_frame(rows, label_key, label_title):
+    return pd.DataFrame([
+        {
+            label_title: r[label_key] or "—",
+            t("tg_metrics_col_count", "N"): r["count"],
+            t("tg_metrics_col_errors", "Errori"): r["errors"],
+            "p50 (s)": round(r["p50_s"], 3),
+            "p90 (s)": round(r["p90_s"], 3),
+            "p99 (s)": round(r["p99_s"], 3),
+            "max (s)": round(r["max_s"], 3),
+            t("tg_metrics_col_total", "Totale (s)"): round(r["total_s"], 2),
+        }
+        for r in rows
+    ])
+
+
+# ---------------------------------------------------------------------------
+# Per operazione
+# ---------------------------------------------------------------------------
+
+st.markdown("### " + t("tg_metrics_ops_title", "Per operazione"))
+op_rows = telegram_metrics.summarize(ops, by=("name",))
+if op_rows:
+    st.dataframe(
+        summary_frame(op_rows, "name", t("tg_metrics_col_operation", "Operazione")),
+        hide_index=True, use_container_width=True,
+    )
+else:
+    st.caption(t("tg_metrics_no_ops", "Nessuna operazione completa nel periodo (solo richieste del worker?)."))
+
+
+# ---------------------------------------------------------------------------
+# Scomposizione di un'operazione
+# ---------------------------------------------------------------------------
+
+st.markdown("### " + t("tg_metrics_breakdown_title", "Dove va il tempo"))
+op_names = sorted({e.get("op") or "—" for e in events if e.get("kind") != telegram_metrics.OP})
+selected_op = st.selectbox(t("tg_metrics_breakdown_op", "Operazione"), options=op_names)
+n_selected = sum(1 for e in ops if e.get("name") == selected_op)
+steps = [
+    e for e in events
+    if e.get("kind") != telegram_metrics.OP and (e.get("op") or "—") == selected_op
+]
+breakdown = []
+for r in telegram_metrics.summarize(steps):
+    breakdown.append({
+        t("tg_metrics_col_step", "Passo"): r["kind"],
+        t("tg_metrics_col_name", "Nome"): r["name"],
+        t("tg_metrics_col_count", "N"): r["count"],
+        t("tg_metrics_col_per_op", "Per operazione (s)"): round(r["total_s"] / n_selected, 3) if n_selected else None,
+        "p50 (s)": round(r["p50_s"], 3),
+        "p90 (s)": round(r["p90_s"], 3),
+        t("tg_metrics_col_wait", "Attesa governor (s)"): round(r["wait_s"], 2),
+        t("tg_metrics_col_flood", "FloodWait (s)"): r["flood_wait_s"],
+        t("tg_metrics_col_errors", "Errori"): r["errors"],
+    })
+st.caption(t(
+    "tg_metrics_breakdown_caption",
+    "Le richieste in parallelo si sovrappongono: la somma dei passi puo' superare la durata dell'operazione.",
+))
+st.dataframe(pd.DataFrame(breakdown), hide_index=True, use_container_width=True)
+
+
+# ---------------------------------------------------------------------------
+# Per tipo di richiesta
+# ---------------------------------------------------------------------------
+
+st.markdown("### " + t("tg_metrics_rpc_title", "Per tipo di richiesta"))
+rpc_rows = telegram_metrics.summarize(rpcs, by=("name",))
+if rpc_rows:
+    st.dataframe(
+        summary_frame(rpc_rows, "name", t("tg_metrics_col_request", "Richiesta")),
+        hide_index=True, use_container_width=True,
+    )
+
+
+# ---------------------------------------------------------------------------
+# Operazioni piu' lente
+# ---------------------------------------------------------------------------
+
+with st.expander(t("tg_metrics_slowest_title", "Operazioni piu' lente"), expanded=False):
+    slowest = sorted(ops, key=lambda e: -(e.get("duration_s") or 0))[:20]
+    st.dataframe(pd.DataFrame([
+        {
+            t("tg_metrics_col_when", "Quando"): datetime.fromtimestamp(e["ts"]).strftime("%Y-%m-%d %H:%M:%S"),
+            t("tg_metrics_col_operation", "Operazione"): e.get("name"),
+            t("tg_metrics_col_duration", "Durata (s)"): round(e.get("duration_s") or 0, 3),
+            t("tg_metrics_col_error", "Errore"): e.get("error") or "",
+        }
+        for e in slowest
+    ]), hide_index=True, use_container_width=True)
@@ -1,17 +1,19 @@
 import streamlit as st
-from groq import Groq
-import google.generativeai as genai
-from openai import OpenAI  # <--- NEW: Libreria standard per OpenRouter
 import json
 import extra_streamlit_components as stx
 import uuid
 import time
 import datetime
 import os
-import re
 import firebase_admin
 from firebase_admin import credentials, firestore
 
+from lib.llm.adapters import get_adapter, stream_chat
+from lib.llm.clients import API_KEY_SECRETS
+from lib.llm.kb_index import KB_FULL, KB_RETRIEVAL, KB_TOP_K, get_kb_index, retrieve_kb
+from lib.llm.prompts import compile_system_prompt, with_kb_chunks
+from lib.llm.render import StreamRenderer
+
 # --- 1. FUNZIONI DI CARICAMENTO ---
 def load_json(filepath):
     try:
@@ -24,12 +26,6 @@ def load_json(filepath):
         st.error(f"File non trovato: {filepath}")
         return {}
 
-def load_text(filepath):
-    if not filepath or not os.path.exists(filepath):
-        return ""
-    with open(filepath, "r", encoding="utf-8") as f:
-        return f.read()
-
 # --- 1.1 FIREBASE INITIALIZATION ---
 if not firebase_admin._apps:
     try:
@@ -345,7 +341,7 @@ with st.sidebar:
     current_expert = expert_options[selected_label]
 
     # --- RENDER SETTINGS (GENERICO) ---
-    prompt_placeholders = {}
+    setting_values = {}
     if "settings" in current_expert:
         st.markdown("---")
         for setting in current_expert["settings"]:
@@ -361,7 +357,7 @@ with st.sidebar:
                 key=f"set_{setting['key']}",
                 on_change=on_setting_change
             )
-            prompt_placeholders[f"{{{{{setting['key']}}}}}"] = opts_map[selection]
+            setting_values[setting["key"]] = opts_map[selection]
 
     if current_expert.get("disclaimer"):
         disclaimer_text = current_expert["disclaimer"].get(lang_code)
@@ -379,72 +375,47 @@ with st.sidebar:
 provider = current_expert.get("provider", global_provider).lower()
 model_name = current_expert.get("model_name", global_model)
 
-api_key = None
-client_groq = None
-client_openrouter = None
-
-# LOGICA DI INIZIALIZZAZIONE CLIENT (Dinamica)
-if provider == "groq":
-    try:
-        api_key = st.secrets.get("GROQ_API_KEY")
-    except:
-        pass
-    if not api_key:
-        api_key = st.sidebar.text_input("Groq API Key (gsk_...)", type="password")
-    
-    if api_key:
-        client_groq = Groq(api_key=api_key)
-
-elif provider == "gemini":
-    try:
-        api_key = st.secrets.get("GOOGLE_API_KEY")
-    except:
-        pass
-    if not api_key:
-        api_key = st.sidebar.text_input("Google API Key (AIza...)", type="password")
-    
-    if api_key:
-        genai.configure(api_key=api_key)
+# Chiave: secrets, altrimenti inserita a mano nella sidebar.
+API_KEY_PROMPTS = {
+    "groq": "Groq API Key (gsk_...)",
+    "gemini": "Google API Key (AIza...)",
+    "openrouter": "OpenRouter API Key (sk-or-...)",
+}
 
-elif provider == "openrouter":
-    try:
-        api_key = st.secrets.get("OPENROUTER_API_KEY")
-    except:
-        pass
-    if not api_key:
-        api_key = st.sidebar.text_input("OpenRouter API Key (sk-or-...)", type="password")
-    
-    if api_key:
-        client_openrouter = OpenAI(
-            base_url="https://openrouter.ai/api/v1",
-            api_key=api_key,
-            default_headers={
-                "HTTP-Referer": "https://av-assistant.streamlit.app",
-                "X-Title": "AV Assistant"
-            }
-        )
+api_key = None
+try:
+    api_key = st.secrets.get(API_KEY_SECRETS.get(provider, ""))
+except:
+    pass
+if not api_key and provider in API_KEY_PROMPTS:
+    api_key = st.sidebar.text_input(API_KEY_PROMPTS[provider], type="password")
 
 if not api_key:
     st.warning(f"⚠️ {ui_text.get('api_key_required', 'API Key required')} ({provider.upper()})")
     st.stop()
 
+# Adapter del provider (lib/llm/adapters.py): client condiviso dal processo,
+# timeout, retry e metriche delle chiamate LLM stanno li'.
+try:
+    llm = get_adapter(provider, model_name, api_key)
+except ValueError as e:
+    st.error(str(e))
+    st.stop()
+
 # --- 4. COSTRUZIONE PROMPT ---
 st.title(selected_label)
 
-raw_prompt = load_text(current_expert["prompt_file"])
-lang_name = "Italiano" if lang_code == "IT" else "English"
-final_system_instruction = raw_prompt.replace("{{LANGUAGE}}", lang_name)
-
-if current_expert.get("kb_file"):
-    kb_content = load_text(current_expert["kb_file"])
-    if kb_content:
-        final_system_instruction += f"\n\nCONTEXT / KNOWLEDGE BASE:\n{kb_content}"
-
-# Iniezione variabili dinamiche
-for key, value in prompt_placeholders.items():
-    final_system_instruction = final_system_instruction.replace(key, value)
-    
-final_system_instruction = re.sub(r"\{\{.*?\}\}", "", final_system_instruction)        
+# Template letti e compilati una volta, in cache finche' i file non cambiano
+# (lib/llm/prompts.py). Con kb_mode "retrieval" la KB resta fuori: per ogni
+# messaggio si aggiungono solo i chunk pertinenti (lib/llm/kb_index.py).
+kb_retrieval = bool(current_expert.get("kb_file")) and current_expert.get("kb_mode", KB_FULL) == KB_RETRIEVAL
+final_system_instruction = compile_system_prompt(
+    current_expert, lang_code, setting_values, include_kb=not kb_retrieval
+)
+if kb_retrieval:
+    # Costruisce (o carica da disco) l'indice gia' alla selezione dell'esperto.
+    if get_kb_index(current_expert["kb_file"]) is None:
+        st.warning(f"⚠️ {ui_text.get('kb_unavailable', 'Knowledge base non disponibile')}: {current_expert['kb_file']}")
 
 # --- 5. CHAT ENGINE (MULTI-PROVIDER) ---
 if "messages" not in st.session_state:
@@ -536,71 +507,22 @@ if prompt := st.chat_input(placeholder):
         st.markdown(prompt)
 
     with st.chat_message("assistant"):
-        stream_box = st.empty()
-        full_res = ""
+        # Aggiornamenti a cadenza (lib/llm/render.py) invece di uno per token.
+        renderer = StreamRenderer(st.empty(), provider=provider, model=model_name)
         
         try:
-            # === LOGICA GROQ ===
-            if provider == "groq":
-                messages_payload = [{"role": "system", "content": final_system_instruction}]
-                messages_payload.extend([{"role": m["role"], "content": m["content"]} for m in st.session_state.messages])
-                
-                completion = client_groq.chat.completions.create(
-                    model=model_name, 
-                    messages=messages_payload,
-                    temperature=APP_CONFIG.get("temperature", 0.6),
-                    max_tokens=1024,
-                    stream=True,
-                )
-
-                for chunk in completion:
-                    if chunk.choices and chunk.choices[0].delta.content:
-                        content = chunk.choices[0].delta.content
-                        full_res += content
-                        stream_box.markdown(full_res)
-
-            # === NEW: LOGICA OPENROUTER ===
-            # OpenRouter usa lo stesso formato messaggi di Groq/OpenAI
-            elif provider == "openrouter":
-                messages_payload = [{"role": "system", "content": final_system_instruction}]
-                messages_payload.extend([{"role": m["role"], "content": m["content"]} for m in st.session_state.messages])
-                
-                completion = client_openrouter.chat.completions.create(
-                    model=model_name, 
-                    messages=messages_payload,
-                    temperature=APP_CONFIG.get("temperature", 0.6),
-                    # Opzionali per OpenRouter
-                    # top_p=1,
-                    # frequency_penalty=0,
-                    # presence_penalty=0,
-                    stream=True,
-                )
-
-                for chunk in completion:
-                    if chunk.choices and chunk.choices[0].delta.content:
-                        content = chunk.choices[0].delta.content
-                        full_res += content
-                        stream_box.markdown(full_res)
-
-            # === LOGICA GEMINI ===
-            elif provider == "gemini":
-                model = genai.GenerativeModel(
-                    model_name=model_name,
-                    system_instruction=final_system_instruction
-                )
-                
-                gemini_history = []
-                for msg in st.session_state.messages[:-1]:
-                    role = "user" if msg["role"] == "user" else "model"
-                    gemini_history.append({"role": role, "parts": [msg["content"]]})
-                
-                chat = model.start_chat(history=gemini_history)
-                response = chat.send_message(prompt, stream=True)
-                
-                for chunk in response:
-                    if chunk.text:
-                        full_res += chunk.text
-                        stream_box.markdown(full_res)
+            messages_payload = [{"role": m["role"], "content": m["content"]} for m in st.session_state.messages]
+            params = {"temperature": APP_CONFIG.get("temperature", 0.6)}
+            system_instruction = final_system_instruction
+            if kb_retrieval:
+                kb_chunks = retrieve_kb(current_expert["kb_file"], prompt, current_expert.get("kb_top_k", KB_TOP_K))
+                system_instruction = with_kb_chunks(final_system_instruction, kb_chunks, setting_values)
+            try:
+                for event in stream_chat(llm, messages_payload, system_instruction, params):
+                    if event["type"] == "delta":
+                        renderer.write(event["text"])
+            finally:
+                full_res = renderer.close()
 
             # Salvataggio risposta
             ast_msg_date = datetime.datetime.now().isoformat()
@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest
+
+# I test importano i moduli come le pagine: `from lib import ...` dalla radice.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib import telegram_client as tc  # noqa: E402
+from lib.telegram_fake import FakeTelegramBackend  # noqa: E402
+
+# Governor senza attese: i test verificano il comportamento, non il ritmo.
+FAST_LIMITS = {"read": (1000.0, 1000), "dm": (1000.0, 1000), "resolve": (1000.0, 1000)}
+
+
+@pytest.fixture
+def backend():
+    """Backend Telegram finto al posto di Telethon, con pool e governor nuovi."""
+    backend = FakeTelegramBackend()
+    tc.set_client_factory(backend.client, rate_limits=FAST_LIMITS)
+    yield backend
+    tc.set_client_factory(None)
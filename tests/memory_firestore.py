@@ -0,0 +1,180 @@
+"""
+Client Firestore in memoria per i test.
+
+Copre la superficie usata da lib/: collection/document, get/create/set
+(anche merge)/update/delete, batch, transaction e i valori speciali
+SERVER_TIMESTAMP, DELETE_FIELD e Increment. Le transazioni non sono
+isolate: i test sono a thread singolo verso il database.
+"""
+
+import copy
+import itertools
+import threading
+from datetime import datetime, timezone
+
+from firebase_admin import firestore
+from google.api_core.exceptions import Conflict, NotFound
+
+
+def split_field_path(path: str):
+    """"a.`b.c`.d" -> ["a", "b.c", "d"] (forma di FieldPath.to_api_repr)."""
+    parts, current, quoted = [], "", False
+    for ch in path:
+        if ch == "`":
+            quoted = not quoted
+        elif ch == "." and not quoted:
+            parts.append(current)
+            current = ""
+        else:
+            current += ch
+    parts.append(current)
+    return parts
+
+
+def _resolve(value, old=None):
+    if value is firestore.SERVER_TIMESTAMP:
+        return datetime.now(timezone.utc)
+    if isinstance(value, firestore.Increment):
+        return (old or 0) + value.value
+    if isinstance(value, dict):
+        return {k: _resolve(v) for k, v in value.items() if v is not firestore.DELETE_FIELD}
+    return copy.deepcopy(value)
+
+
+def apply_update(doc: dict, update: dict) -> None:
+    """Applica a `doc` un update Firestore (chiavi con field path, valori speciali)."""
+    for key, value in update.items():
+        parts = split_field_path(key)
+        target = doc
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        if value is firestore.DELETE_FIELD:
+            target.pop(parts[-1], None)
+        else:
+            target[parts[-1]] = _resolve(value, target.get(parts[-1]))
+
+
+def _merge(doc: dict, data: dict) -> None:
+    for key, value in data.items():
+        if isinstance(value, dict) and isinstance(doc.get(key), dict):
+            _merge(doc[key], value)
+        elif value is firestore.DELETE_FIELD:
+            doc.pop(key, None)
+        else:
+            doc[key] = _resolve(value, doc.get(key))
+
+
+class _Snapshot:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data)
+
+
+class _DocumentRef:
+    def __init__(self, db, collection, doc_id):
+        self._db = db
+        self.id = doc_id
+        self.path = f"{collection}/{doc_id}"
+
+    def get(self, field_paths=None, transaction=None):
+        with self._db.lock:
+            return _Snapshot(self.id, copy.deepcopy(self._db.docs.get(self.path)))
+
+    def create(self, data):
+        with self._db.lock:
+            if self.path in self._db.docs:
+                raise Conflict(f"Document already exists: {self.path}")
+            self._db.docs[self.path] = _resolve(data)
+
+    def set(self, data, merge=False):
+        with self._db.lock:
+            if merge and self.path in self._db.docs:
+                _merge(self._db.docs[self.path], data)
+            else:
+                self._db.docs[self.path] = _resolve(data)
+
+    def update(self, data):
+        with self._db.lock:
+            if self.path not in self._db.docs:
+                raise NotFound(f"No document to update: {self.path}")
+            apply_update(self._db.docs[self.path], data)
+
+    def delete(self):
+        with self._db.lock:
+            self._db.docs.pop(self.path, None)
+
+
+class _CollectionRef:
+    def __init__(self, db, name):
+        self._db = db
+        self._name = name
+
+    def document(self, doc_id=None):
+        return _DocumentRef(self._db, self._name, doc_id or f"auto{next(self._db.ids)}")
+
+
+class _Batch:
+    def __init__(self, db):
+        self._db = db
+        self._ops = []
+
+    def create(self, ref, data):
+        self._ops.append(lambda: ref.create(data))
+
+    def set(self, ref, data, merge=False):
+        self._ops.append(lambda: ref.set(data, merge=merge))
+
+    def update(self, ref, data):
+        self._ops.append(lambda: ref.update(data))
+
+    def delete(self, ref):
+        self._ops.append(ref.delete)
+
+    def commit(self):
+        # Tutto o niente, come un batch vero.
+        with self._db.lock:
+            saved = copy.deepcopy(self._db.docs)
+            try:
+                for op in self._ops:
+                    op()
+            except Exception:
+                self._db.docs = saved
+                raise
+
+
+class _Transaction(_Batch):
+    pass
+
+
+class MemoryFirestore:
+    def __init__(self):
+        self.docs = {}
+        self.ids = itertools.count()
+        self.lock = threading.RLock()
+
+    def collection(self, name):
+        return _CollectionRef(self, name)
+
+    def batch(self):
+        return _Batch(self)
+
+    def transaction(self):
+        return _Transaction(self)
+
+    def data(self, path):
+        """Copia del documento `collection/id`, None se non esiste."""
+        with self.lock:
+            return copy.deepcopy(self.docs.get(path))
+
+
+def immediate_transactions(fn):
+    """Al posto di firestore.transactional: esegue la funzione e fa il commit delle scritture."""
+    def wrapper(transaction, *args, **kwargs):
+        result = fn(transaction, *args, **kwargs)
+        transaction.commit()
+        return result
+    return wrapper
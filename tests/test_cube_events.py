@@ -0,0 +1,86 @@
+"""Refresh incrementale degli eventi cubo (lib/cube_events.build_refresh_update)."""
+
+import pytest
+
+pytest.importorskip("firebase_admin")
+
+from lib import telegram_client as tc  # noqa: E402
+from lib.cube_events import build_refresh_update, compute_participations, known_option_counts  # noqa: E402
+from tests.memory_firestore import apply_update  # noqa: E402
+
+
+@pytest.fixture
+def poll(backend):
+    session = backend.add_account()
+    chat_id, msg_id = backend.synthetic_poll(session, n_voters=8, n_options=3)
+    voters = [u for u in backend.users.values() if u.username and u.username.startswith("voter")]
+    # Un attivista riconosciuto per user_id, uno per username, gli altri esterni.
+    activists = [
+        {"email": "a@x.it", "telegram_user_id": voters[0].id, "telegram_username": ""},
+        {"email": "b@x.it", "telegram_username": "@" + voters[1].username.upper()},
+        {"email": "c@x.it", "telegram_username": "mai_votato"},
+    ]
+    return {"session": session, "chat_id": chat_id, "msg_id": msg_id, "activists": activists, "voters": voters}
+
+
+def _refresh(ev, poll):
+    delta = tc.get_poll_voters_delta(
+        poll["session"], poll["chat_id"], poll["msg_id"], known_counts=known_option_counts(ev)
+    )
+    apply_update(ev, build_refresh_update(ev, delta, poll["activists"], {}))
+    return delta
+
+
+def _full_recompute(poll):
+    full = tc.get_poll_voters(poll["session"], poll["chat_id"], poll["msg_id"])
+    return compute_participations(poll["activists"], full["options"])
+
+
+def test_delta_refresh_matches_full_recompute(backend, poll):
+    ev = {"poll_options": [], "participations": {}, "outside_voters": [], "poll_voter_ids": {}}
+    first = _refresh(ev, poll)
+    assert len(first["changed_options"]) == 3
+    assert set(ev["participations"]) == {"a@x.it", "b@x.it"}
+
+    # Un voto nuovo e un voto spostato: solo le opzioni toccate vengono rilette.
+    newcomer = backend.synthetic_users(1)[0]
+    backend.vote(poll["chat_id"], poll["msg_id"], newcomer.id, 2)
+    moved = poll["voters"][0]
+    old_idx = ev["participations"]["a@x.it"]["option_idx"]
+    new_idx = (old_idx + 1) % 3
+    backend.vote(poll["chat_id"], poll["msg_id"], moved.id, new_idx)
+    second = _refresh(ev, poll)
+    assert {o["idx"] for o in second["changed_options"]} == {old_idx, new_idx, 2}
+
+    participations, outside = _full_recompute(poll)
+    assert ev["participations"]["a@x.it"]["option_idx"] == new_idx
+    assert ev["participations"] == participations
+    key = lambda v: (v["option_idx"], v["user_id"])  # noqa: E731
+    assert sorted(ev["outside_voters"], key=key) == sorted(outside, key=key)
+
+    # Sul doc restano solo gli user_id per opzione, allineati ai conteggi.
+    assert {k: len(v) for k, v in ev["poll_voter_ids"].items()} == ev["poll_option_counts"]
+    assert all(isinstance(uid, int) for ids in ev["poll_voter_ids"].values() for uid in ids)
+
+
+def test_unchanged_poll_writes_only_last_refresh(backend, poll):
+    ev = {"poll_options": [], "participations": {}, "outside_voters": [], "poll_voter_ids": {}}
+    _refresh(ev, poll)
+    delta = tc.get_poll_voters_delta(
+        poll["session"], poll["chat_id"], poll["msg_id"], known_counts=known_option_counts(ev)
+    )
+    assert delta["changed_options"] == []
+    assert set(build_refresh_update(ev, delta, poll["activists"], {})) == {"last_refresh"}
+
+
+def test_legacy_voter_cache_is_replaced(backend, poll):
+    ev = {
+        "poll_options": [], "participations": {}, "outside_voters": [],
+        "poll_voters": {"0": [{"user_id": 1, "username": "vecchio"}]},
+        "poll_option_counts": {"0": 1},
+    }
+    # Senza poll_voter_ids i conteggi salvati non valgono: refresh completo.
+    assert known_option_counts(ev) is None
+    _refresh(ev, poll)
+    assert "poll_voters" not in ev
+    assert set(ev["poll_voter_ids"]) == {"0", "1", "2"}
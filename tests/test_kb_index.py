@@ -0,0 +1,14 @@
+"""Indice BM25 delle knowledge base (lib/llm/kb_index.py)."""
+
+from lib.llm import kb_index
+
+
+def test_missing_kb_has_no_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(kb_index, "INDEX_DIR", str(tmp_path / "index"))
+    path = tmp_path / "kb.txt"
+    path.write_text("Le proteine servono.\n\n---\n\nIl riposo conta.", encoding="utf-8")
+    assert kb_index.retrieve_kb(str(path), "proteina") == ["Le proteine servono."]
+
+    path.unlink()
+    assert kb_index.get_kb_index(str(path)) is None
+    assert kb_index.retrieve_kb(str(path), "proteina") == []
@@ -0,0 +1,50 @@
+"""Base degli adapter LLM (lib/llm/adapters.py), con un provider finto."""
+
+import asyncio
+
+import pytest
+
+from lib.llm import adapters
+
+
+class _EchoAdapter(adapters.LLMAdapter):
+    provider = "echo"
+
+    def __init__(self, model="echo-1"):
+        # Nessun client reale: _stream non lo usa.
+        self.model = model
+
+    async def _stream(self, messages, system, params):
+        for word in messages[-1]["content"].split():
+            yield word + " ", None
+        yield "", {"input_tokens": 3, "output_tokens": 2}
+
+
+def test_adapter_must_implement_stream():
+    class Incomplete(adapters.LLMAdapter):
+        provider = "none"
+
+    with pytest.raises(TypeError):
+        Incomplete("m", "key")
+
+
+def test_completed_stream_is_recorded_ok():
+    async def consume():
+        return [e async for e in _EchoAdapter().stream([{"role": "user", "content": "ciao a tutti"}], "")]
+
+    events = asyncio.run(consume())
+    assert events[-1]["text"] == "ciao a tutti "
+    call = adapters.recent_llm_calls()[-1]
+    assert call["ok"] is True and call["output_tokens"] == 2
+
+
+def test_stream_closed_by_consumer_is_not_an_error():
+    async def first_delta():
+        stream = _EchoAdapter().stream([{"role": "user", "content": "uno due tre"}], "")
+        event = await stream.__anext__()
+        await stream.aclose()
+        return event
+
+    assert asyncio.run(first_delta())["text"] == "uno "
+    call = adapters.recent_llm_calls()[-1]
+    assert call["ok"] is None and call["error"] is None
@@ -0,0 +1,90 @@
+"""Job di invio reminder (lib/reminder_jobs.py): ripresa senza doppi invii."""
+
+import pytest
+
+pytest.importorskip("firebase_admin")
+
+from lib import reminder_jobs as rj  # noqa: E402
+from lib import telegram_client as tc  # noqa: E402
+from tests.memory_firestore import MemoryFirestore, immediate_transactions  # noqa: E402
+
+
+@pytest.fixture
+def db(monkeypatch):
+    monkeypatch.setattr(rj.firestore, "transactional", immediate_transactions)
+    db = MemoryFirestore()
+    db.collection("cube_events").document("ev1").set({"status": "active"})
+    return db
+
+
+@pytest.fixture
+def job(backend, db):
+    session = backend.add_account()
+    users = backend.synthetic_users(3)
+    items = [
+        {"email": f"{u.username}@x.it", "nome": u.first_name, "cognome": "", "username": u.username,
+         "user_id": None, "text": f"Ciao {u.first_name}"}
+        for u in users
+    ]
+    job_id = rj.enqueue_reminder_job(db, "org@x.it", "ev1", items)
+    return {"id": job_id, "session": session, "users": users}
+
+
+def _run(db, job, **kwargs):
+    return tc.get_client_pool().run(rj.run_reminder_job(db, job["id"], job["session"], **kwargs))
+
+
+def _sent_to(backend):
+    return [m["to"] for m in backend.sent]
+
+
+def test_job_sends_each_reminder_once(backend, db, job):
+    assert _run(db, job) == "done"
+    assert _sent_to(backend) == [u.id for u in job["users"]]
+    saved = rj.load_job(db, job["id"])
+    assert (saved["ok"], saved["fail"], saved["cursor"]) == (3, 0, 3)
+    assert "active_reminder_job" not in db.data("cube_events/ev1")
+    # Un job concluso non si riesegue.
+    assert _run(db, job) is None
+    assert len(backend.sent) == 3
+
+
+def test_crash_after_send_is_not_resent(backend, db, job, monkeypatch):
+    record_item = rj._record_item
+
+    def crash_on_second(db_, job_, idx, *args):
+        if idx == 1:
+            raise RuntimeError("processo terminato")
+        return record_item(db_, job_, idx, *args)
+
+    monkeypatch.setattr(rj, "_record_item", crash_on_second)
+    with pytest.raises(RuntimeError):
+        _run(db, job, lease_s=0)
+    monkeypatch.setattr(rj, "_record_item", record_item)
+
+    assert _run(db, job) == "done"
+    # Il secondo DM e' partito prima del crash: alla ripresa non si rinvia.
+    assert _sent_to(backend) == [u.id for u in job["users"]]
+    saved = rj.load_job(db, job["id"])
+    assert saved["results"]["1"]["error"] == "interrupted"
+    assert (saved["ok"], saved["fail"]) == (2, 1)
+
+
+def test_failure_before_send_is_retried(backend, db, job):
+    # Primo destinatario gia' in cache; la risoluzione del secondo cade prima dell'invio.
+    users = job["users"]
+    tc.get_client_pool().run(_warm_username(job["session"], users[0].username))
+    backend.inject_error(lambda req: ConnectionError("reset"), request="ResolveUsernameRequest")
+    with pytest.raises(ConnectionError):
+        _run(db, job, lease_s=0)
+    assert db.data(f"reminder_log/{job['id']}-1") is None
+
+    assert _run(db, job) == "done"
+    assert _sent_to(backend) == [u.id for u in users]
+    saved = rj.load_job(db, job["id"])
+    assert (saved["ok"], saved["fail"]) == (3, 0)
+
+
+async def _warm_username(session, username):
+    async with tc._session_client(session) as client:
+        await client.get_input_entity(username)
@@ -0,0 +1,23 @@
+"""Operazioni di lib/telegram_client.py sul backend finto (set_client_factory)."""
+
+import pytest
+
+from lib import telegram_client as tc
+
+
+def test_resolve_phones_bulk(backend):
+    session = backend.add_account()
+    backend.add_user("Anna", username="anna", phone="+393331112233")
+    results = tc.resolve_phones_bulk(session, ["+39 333 111 2233", "+393339998877"])
+    assert results["+39 333 111 2233"]["username"] == "anna"
+    assert results["+393339998877"]["error"] == "not_on_telegram_or_privacy"
+
+
+def test_resolve_phones_bulk_stops_on_dead_connection(backend):
+    session = backend.add_account()
+    backend.inject_error(lambda req: ConnectionError("reset"), request="ResolvePhoneRequest")
+    with pytest.raises(tc.TelegramOperationError):
+        tc.resolve_phones_bulk(session, ["+393330000001", "+393330000002", "+393330000003"])
+    # Nessun tentativo sui numeri restanti, e il client rotto esce dal pool.
+    assert backend.rpc_counts["ResolvePhoneRequest"] == 1
+    assert tc.get_client_pool().stats()["clients"] == 0
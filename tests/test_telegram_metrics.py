@@ -0,0 +1,31 @@
+"""Sink delle metriche Telegram (lib/telegram_metrics.py)."""
+
+import pytest
+
+from lib import telegram_metrics
+
+
+class _BrokenSink(telegram_metrics.MetricsSink):
+    def record(self, event):
+        raise OSError("disco pieno")
+
+
+def test_sink_must_implement_record():
+    with pytest.raises(TypeError):
+        telegram_metrics.MetricsSink()
+
+
+def test_sink_errors_are_counted_and_logged_once(caplog):
+    sink = _BrokenSink()
+    telegram_metrics.add_metrics_sink(sink)
+    try:
+        before = telegram_metrics.sink_errors().get("_BrokenSink", 0)
+        with caplog.at_level("WARNING", logger="lib.telegram_metrics"):
+            telegram_metrics.record(telegram_metrics.RPC, "GetStateRequest", 0.01)
+            telegram_metrics.record(telegram_metrics.RPC, "GetStateRequest", 0.01)
+    finally:
+        telegram_metrics.remove_metrics_sink(sink)
+    assert telegram_metrics.sink_errors()["_BrokenSink"] == before + 2
+    assert len([r for r in caplog.records if "_BrokenSink" in r.getMessage()]) == 1
+    # Il ring buffer riceve comunque gli eventi.
+    assert telegram_metrics.metrics_buffer().recent(1)[0]["name"] == "GetStateRequest"
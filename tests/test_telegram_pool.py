@@ -0,0 +1,90 @@
+"""TelegramClientPool sul backend finto (lib/telegram_fake.py): checkout, capienza, eviction."""
+
+import time
+
+import pytest
+
+from lib import telegram_client as tc
+from lib.telegram_pool import TelegramClientPool
+
+
+@pytest.fixture
+def make_pool(backend):
+    pools = []
+
+    def _make(**kwargs):
+        pool = TelegramClientPool(backend.client, **kwargs)
+        pools.append(pool)
+        return pool
+
+    yield _make
+    for pool in pools:
+        pool.close()
+
+
+def test_over_capacity_keeps_clients_in_use(backend, make_pool):
+    pool = make_pool(max_clients=1)
+    a, b = backend.add_account(), backend.add_account()
+
+    async def nested():
+        async with pool.session(a) as client_a:
+            async with pool.session(b) as client_b:
+                # Entrambi in uso: il pool resta sopra il limite.
+                assert client_a.is_connected() and client_b.is_connected()
+                assert pool.stats()["clients"] == 2
+        return client_a, client_b
+
+    client_a, client_b = pool.run(nested())
+    # Rilasciati, l'eccesso (il meno recente) si chiude alla checkout successiva.
+    pool.run(_touch(pool, b))
+    assert pool.stats()["clients"] == 1
+    assert not client_a.is_connected()
+    assert client_b.is_connected()
+
+
+async def _touch(pool, session_string):
+    async with pool.session(session_string) as client:
+        return client
+
+
+def test_idle_clients_are_evicted(backend, make_pool):
+    pool = make_pool(idle_ttl=0.05, reap_interval=0.02)
+    session = backend.add_account()
+    client = pool.run(_touch(pool, session))
+    deadline = time.monotonic() + 2
+    while pool.stats()["clients"] and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert pool.stats()["clients"] == 0
+    assert not client.is_connected()
+
+
+def test_disconnected_client_is_replaced_at_checkout(backend, make_pool):
+    pool = make_pool()
+    session = backend.add_account()
+    first = pool.run(_touch(pool, session))
+    assert pool.run(_touch(pool, session)) is first
+    pool.run(first.disconnect())
+    second = pool.run(_touch(pool, session))
+    assert second is not first and second.is_connected()
+    assert backend.connects == 2
+
+
+def test_revoked_session_yields_none(backend, make_pool):
+    pool = make_pool()
+    session = backend.add_account()
+    del backend.sessions[session]
+    assert pool.run(_touch(pool, session)) is None
+    assert pool.stats()["clients"] == 0
+
+
+def test_network_error_drops_the_pooled_client(backend):
+    session = backend.add_account()
+    backend.add_group("Cubo", members=[backend.sessions[session]])
+    assert [g["title"] for g in tc.list_groups(session)] == ["Cubo"]
+    backend.inject_error(lambda req: ConnectionError("reset"), request="GetDialogsRequest")
+    with pytest.raises(tc.TelegramOperationError):
+        tc.list_groups(session)
+    assert tc.get_client_pool().stats()["clients"] == 0
+    # L'operazione successiva riconnette un client nuovo.
+    assert [g["title"] for g in tc.list_groups(session)] == ["Cubo"]
+    assert backend.connects == 2
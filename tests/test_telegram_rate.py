@@ -0,0 +1,69 @@
+"""Governor dei rate-limit (lib/telegram_rate.py) e persistenza dei FloodWait."""
+
+import time
+
+import pytest
+
+from lib import telegram_client as tc
+from lib import telegram_rate as rate
+
+
+def _wait_for(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+def test_store_must_implement_load_and_save():
+    class LoadOnly(rate.FloodStore):
+        def load(self):
+            return {}
+
+    with pytest.raises(TypeError):
+        LoadOnly()
+
+
+def test_flood_wait_blocks_the_whole_class(backend):
+    session = backend.add_account()
+    backend.add_group("Cubo", members=[backend.sessions[session]])
+    backend.inject_flood_wait(300, request="GetDialogsRequest")
+    with pytest.raises(tc.TelegramOperationError, match="rate limit"):
+        tc.list_groups(session)
+    # Le letture successive falliscono senza contattare Telegram.
+    calls = sum(backend.rpc_counts.values())
+    with pytest.raises(tc.TelegramOperationError, match="rate limit"):
+        tc.list_groups(session)
+    assert sum(backend.rpc_counts.values()) == calls
+    assert tc.get_rate_state(session)[rate.READ]["blocked_for_s"] > 290
+
+
+def test_flood_wait_survives_a_restart(backend):
+    session = backend.add_account()
+    backend.add_group("Cubo", members=[backend.sessions[session]])
+    store = rate.MemoryFloodStore()
+    tc.bind_rate_store(session, store)
+    backend.inject_flood_wait(300, request="GetDialogsRequest")
+    with pytest.raises(tc.TelegramOperationError):
+        tc.list_groups(session)
+    assert _wait_for(lambda: rate.READ in store.load())
+    assert store.load()[rate.READ] == pytest.approx(time.time() + 300, abs=5)
+
+    # "Riavvio": governor e pool nuovi, stesso store persistente.
+    tc.set_client_factory(backend.client, rate_limits={"read": (1000.0, 1000)})
+    tc.bind_rate_store(session, store)
+    calls = backend.rpc_counts["GetDialogsRequest"]
+    with pytest.raises(tc.TelegramOperationError, match="rate limit"):
+        tc.list_groups(session)
+    assert backend.rpc_counts["GetDialogsRequest"] == calls
+
+
+def test_short_flood_waits_are_not_persisted(backend):
+    session = backend.add_account()
+    store = rate.MemoryFloodStore()
+    tc.bind_rate_store(session, store)
+    governor = tc.get_rate_governor()
+    governor.note_flood_wait(tc.session_fingerprint(session), rate.DM, rate.PERSIST_MIN_WAIT_S - 1)
+    governor.note_flood_wait(tc.session_fingerprint(session), rate.RESOLVE, rate.PERSIST_MIN_WAIT_S)
+    assert _wait_for(lambda: rate.RESOLVE in store.load())
+    assert rate.DM not in store.load()
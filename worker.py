@@ -0,0 +1,510 @@
+"""
+Processi in background di AV Assistant, da lanciare accanto a `streamlit run app.py`.
+
+    python worker.py track      # aggiorna i cubi attivi dagli update Telegram
+    python worker.py scheduler  # refresh periodico dei cubi attivi, con budget per account
+    python worker.py reminders  # job di invio reminder e reminder programmati
+
+Legge la configurazione da `.streamlit/secrets.toml` come l'app (Firebase,
+credenziali Telegram, chiave Fernet delle sessioni), quindi va lanciato
+dalla root del progetto.
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+
+import firebase_admin
+import streamlit as st
+from firebase_admin import credentials, firestore
+from google.api_core.exceptions import Conflict
+from telethon.errors import FloodWaitError
+
+from lib.cube_events import (
+    EVENTS_COLLECTION,
+    build_refresh_update,
+    known_option_counts,
+    reminder_candidates,
+    reminder_job_items,
+)
+from lib.poll_tracker import PollTracker, TrackedPoll
+from lib.refresh_scheduler import (
+    AccountBudget,
+    due_at,
+    event_start,
+    initial_due,
+    next_due_after_failure,
+    next_due_after_success,
+    refresh_cost,
+    with_jitter,
+)
+from lib.reminder_jobs import (
+    ACTIVE_STATUSES,
+    active_jobs,
+    enqueue_reminder_job,
+    is_claimable,
+    load_job,
+    new_owner_id,
+    run_reminder_job,
+)
+from lib.reminder_schedules import (
+    due_schedules,
+    mark_schedule,
+    postpone_schedule,
+    schedule_job_id,
+    split_due,
+)
+from lib.telegram_client import (
+    bind_entity_store,
+    bind_rate_store,
+    get_client_pool,
+    get_poll_voters_delta_async,
+    poll_update_stream,
+    try_decrypt_session,
+)
+from lib.telegram_entities import FirestoreEntityStore
+from lib.telegram_rate import FirestoreFloodStore
+
+logger = logging.getLogger("av-worker")
+
+ORGANIZERS_COLLECTION = "organizers"
+
+
+# ---------------------------------------------------------------------------
+# Firebase
+# ---------------------------------------------------------------------------
+
+def init_firestore():
+    """Inizializza Firebase dai secrets (come pages/chat.py) e ritorna il client."""
+    if not firebase_admin._apps:
+        fb_creds = dict(st.secrets["firebase"])
+        if "\\n" in fb_creds["private_key"]:
+            fb_creds["private_key"] = fb_creds["private_key"].replace("\\n", "\n")
+        firebase_admin.initialize_app(credentials.Certificate(fb_creds))
+    return firestore.client()
+
+
+def load_active_events(db) -> list:
+    """Cubi attivi con un sondaggio Telegram collegato."""
+    out = []
+    for doc in db.collection(EVENTS_COLLECTION).where("status", "==", "active").stream():
+        ev = doc.to_dict() or {}
+        ev["id"] = doc.id
+        if ev.get("telegram_chat_ref") and ev.get("telegram_poll_msg_id"):
+            out.append(ev)
+    return out
+
+
+def tracked_poll_from_event(ev: dict) -> TrackedPoll:
+    counts = known_option_counts(ev)
+    return TrackedPoll(
+        event_id=ev["id"],
+        chat_ref=ev["telegram_chat_ref"],
+        msg_id=int(ev["telegram_poll_msg_id"]),
+        counts=counts or None,
+    )
+
+
+def apply_refresh(db, organizer_email: str, event_id: str, delta: dict, extra: dict = None) -> None:
+    """Scrive un refresh incrementale sull'evento, come il bottone "Aggiorna".
+
+    `extra`: altri campi da scrivere nello stesso update (es. refresh_schedule).
+    """
+    ev_ref = db.collection(EVENTS_COLLECTION).document(event_id)
+    ev = ev_ref.get().to_dict()
+    if not ev or ev.get("status") != "active":
+        return
+    org = db.collection(ORGANIZERS_COLLECTION).document(organizer_email).get().to_dict() or {}
+    update = build_refresh_update(
+        ev,
+        delta,
+        org.get("activists", []),
+        org.get("poll_option_mappings", {}),
+    )
+    update.update(extra or {})
+    ev_ref.update(update)
+
+
+def load_organizer_session(db, organizer_email: str):
+    """Sessione Telegram decifrata dell'organizer (o None), con lo store entita' gia' legato."""
+    org_ref = db.collection(ORGANIZERS_COLLECTION).document(organizer_email)
+    org = org_ref.get().to_dict() or {}
+    session_string = try_decrypt_session(org.get("telegram_session_encrypted", ""))
+    if session_string:
+        bind_entity_store(session_string, FirestoreEntityStore(org_ref))
+        bind_rate_store(session_string, FirestoreFloodStore(org_ref))
+    return session_string
+
+
+# ---------------------------------------------------------------------------
+# track: update Telegram -> Firestore
+# ---------------------------------------------------------------------------
+
+@dataclass
+class _OrganizerTracking:
+    session_string: str
+    tracker: PollTracker
+    task: asyncio.Task
+
+
+async def _run_in_thread(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+
+def _new_tracker(db, organizer_email: str, session_string: str, args) -> PollTracker:
+    async def fetch_delta(poll: TrackedPoll) -> dict:
+        return await get_poll_voters_delta_async(
+            session_string, poll.chat_ref, poll.msg_id, known_counts=poll.counts
+        )
+
+    async def apply_delta(poll: TrackedPoll, delta: dict) -> None:
+        await _run_in_thread(apply_refresh, db, organizer_email, poll.event_id, delta)
+        logger.info(
+            "%s: evento %s aggiornato (%d opzioni cambiate)",
+            organizer_email, poll.event_id, len(delta.get("changed_options", [])),
+        )
+
+    return PollTracker(
+        fetch_delta,
+        apply_delta,
+        debounce_s=args.debounce,
+        resync_interval_s=args.resync_interval,
+    )
+
+
+async def _run_organizer(organizer_email: str, session_string: str, tracker: PollTracker) -> None:
+    try:
+        async with poll_update_stream(session_string) as updates:
+            await tracker.run(updates)
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        # Il ciclo principale lo riavvia al giro successivo.
+        logger.exception("%s: tracking interrotto", organizer_email)
+
+
+async def track_forever(db, args) -> None:
+    trackers = {}
+    while True:
+        try:
+            events = await _run_in_thread(load_active_events, db)
+        except Exception:
+            logger.exception("Lettura dei cubi attivi fallita")
+            events = None
+
+        if events is not None:
+            by_org = defaultdict(list)
+            for ev in events:
+                by_org[ev.get("organizer_email", "")].append(ev)
+            by_org.pop("", None)
+
+            for email in list(trackers):
+                if email not in by_org:
+                    trackers.pop(email).task.cancel()
+                    logger.info("%s: nessun cubo attivo, tracking fermato", email)
+
+            for email, org_events in by_org.items():
+                entry = trackers.get(email)
+                if entry is None or entry.task.done():
+                    session_string = await _run_in_thread(load_organizer_session, db, email)
+                    if not session_string:
+                        trackers.pop(email, None)
+                        continue
+                    tracker = _new_tracker(db, email, session_string, args)
+                    task = asyncio.ensure_future(_run_organizer(email, session_string, tracker))
+                    entry = _OrganizerTracking(session_string, tracker, task)
+                    trackers[email] = entry
+                    logger.info("%s: tracking avviato", email)
+                entry.tracker.sync(tracked_poll_from_event(ev) for ev in org_events)
+
+        await asyncio.sleep(args.reload_interval)
+
+
+def cmd_track(args) -> None:
+    db = init_firestore()
+    get_client_pool().run(track_forever(db, args))
+
+
+# ---------------------------------------------------------------------------
+# scheduler: refresh periodico con budget per account
+# ---------------------------------------------------------------------------
+
+def save_schedule_state(db, event_id: str, state: dict) -> None:
+    db.collection(EVENTS_COLLECTION).document(event_id).update({"refresh_schedule": state})
+
+
+async def _refresh_scheduled(db, ev: dict, session_string: str, budget: AccountBudget) -> None:
+    """Un refresh pianificato: delta Telegram, scrittura evento e nuova scadenza."""
+    now = datetime.now(timezone.utc)
+    state = dict(ev.get("refresh_schedule") or {})
+    counts = known_option_counts(ev)
+    try:
+        delta = await get_poll_voters_delta_async(
+            session_string, ev["telegram_chat_ref"], int(ev["telegram_poll_msg_id"]),
+            known_counts=counts or None,
+        )
+    except FloodWaitError as e:
+        # Non e' colpa del cubo: si ferma l'account e si riprova dopo l'attesa.
+        budget.block_for(e.seconds)
+        state["next_due"] = now + timedelta(seconds=e.seconds + with_jitter(60))
+        state["last_error"] = f"FloodWait {e.seconds}s"
+        logger.warning("%s: FloodWait %ss, account in pausa", ev.get("organizer_email"), e.seconds)
+    except Exception as e:
+        budget.charge(1)
+        state["failures"] = int(state.get("failures", 0)) + 1
+        state["last_error"] = str(e)[:300]
+        state["next_due"] = next_due_after_failure(ev, now, state["failures"])
+        logger.warning("Refresh evento %s fallito (%d di fila): %s", ev["id"], state["failures"], e)
+    else:
+        budget.charge(refresh_cost(delta))
+        state.update({
+            "last_run": now,
+            "failures": 0,
+            "last_error": None,
+            "poll_closed": bool(delta.get("is_closed")),
+        })
+        state["next_due"] = next_due_after_success({**ev, "refresh_schedule": state}, now)
+        await _run_in_thread(
+            apply_refresh, db, ev.get("organizer_email", ""), ev["id"], delta, {"refresh_schedule": state}
+        )
+        # Copia in memoria allineata, per il prossimo delta.
+        ev["poll_option_counts"] = delta.get("option_counts") or {}
+        ev.setdefault("poll_voter_ids", {})
+        ev["refresh_schedule"] = state
+        return
+    await _run_in_thread(save_schedule_state, db, ev["id"], state)
+    ev["refresh_schedule"] = state
+
+
+async def schedule_forever(db, args) -> None:
+    events = {}
+    sessions = {}
+    budgets = {}
+    running = {}
+    next_reload = 0.0
+    while True:
+        if time.monotonic() >= next_reload:
+            next_reload = time.monotonic() + args.reload_interval
+            try:
+                loaded = await _run_in_thread(load_active_events, db)
+            except Exception:
+                logger.exception("Lettura dei cubi attivi fallita")
+            else:
+                now = datetime.now(timezone.utc)
+                events = {ev["id"]: ev for ev in loaded}
+                for ev in events.values():
+                    # Mai pianificato: scadenza sparsa nel primo intervallo e
+                    # persistita subito, cosi' un riavvio non riparte da zero.
+                    if not (ev.get("refresh_schedule") or {}).get("next_due"):
+                        ev["refresh_schedule"] = {**(ev.get("refresh_schedule") or {}), "next_due": initial_due(ev, now)}
+                        await _run_in_thread(save_schedule_state, db, ev["id"], ev["refresh_schedule"])
+                sessions = {}
+                for email in {ev.get("organizer_email", "") for ev in events.values()} - {""}:
+                    sessions[email] = await _run_in_thread(load_organizer_session, db, email)
+                    budgets.setdefault(email, AccountBudget(args.budget_per_minute))
+
+        now = datetime.now(timezone.utc)
+        due_by_org = defaultdict(list)
+        for ev in events.values():
+            email = ev.get("organizer_email", "")
+            if sessions.get(email) and due_at(ev, now) <= now:
+                due_by_org[email].append(ev)
+
+        # Al piu' un refresh in corso per account; account diversi in parallelo.
+        for email, due in due_by_org.items():
+            task = running.get(email)
+            if (task is not None and not task.done()) or not budgets[email].available():
+                continue
+            ev = min(due, key=lambda e: due_at(e, now))
+            running[email] = asyncio.ensure_future(
+                _refresh_scheduled(db, ev, sessions[email], budgets[email])
+            )
+
+        await asyncio.sleep(args.tick)
+
+
+def cmd_scheduler(args) -> None:
+    db = init_firestore()
+    get_client_pool().run(schedule_forever(db, args))
+
+
+# ---------------------------------------------------------------------------
+# reminders: job di invio (lib/reminder_jobs.py) e reminder programmati
+# (lib/reminder_schedules.py)
+# ---------------------------------------------------------------------------
+
+def _load_event(db, event_id: str):
+    snap = db.collection(EVENTS_COLLECTION).document(event_id).get()
+    return {"id": snap.id, **snap.to_dict()} if snap.exists else None
+
+
+def _load_activists(db, organizer_email: str) -> list:
+    org = db.collection(ORGANIZERS_COLLECTION).document(organizer_email).get().to_dict() or {}
+    return org.get("activists", [])
+
+
+async def _dispatch_schedule(db, sched: dict, session_string: str) -> None:
+    """Reminder programmato scaduto: refresh del sondaggio, destinatari aggiornati, job di invio."""
+    now = datetime.now(timezone.utc)
+    email = sched.get("organizer_email", "")
+    ev = await _run_in_thread(_load_event, db, sched["event_id"])
+    if not ev or ev.get("status") != "active":
+        await _run_in_thread(mark_schedule, db, sched["id"], "cancelled", {"error": "Cubo chiuso o eliminato."})
+        return
+    start = event_start(ev)
+    if start is None or start <= now:
+        await _run_in_thread(mark_schedule, db, sched["id"], "skipped", {"error": "Cubo gia' iniziato."})
+        return
+    active_job_id = ev.get("active_reminder_job")
+    if active_job_id:
+        active_job = await _run_in_thread(load_job, db, active_job_id)
+        if active_job and active_job.get("status") in ACTIVE_STATUSES and active_job_id != schedule_job_id(sched["id"]):
+            # Un invio manuale e' in corso: i destinatari si calcolano dopo.
+            await _run_in_thread(postpone_schedule, db, sched, "Invio in corso.", now, False)
+            return
+
+    # Partecipazioni fresche: chi ha votato nel frattempo non riceve il reminder.
+    if ev.get("telegram_chat_ref") and ev.get("telegram_poll_msg_id"):
+        counts = known_option_counts(ev)
+        try:
+            delta = await get_poll_voters_delta_async(
+                session_string, ev["telegram_chat_ref"], int(ev["telegram_poll_msg_id"]),
+                known_counts=counts or None,
+            )
+        except Exception as e:
+            logger.warning("Refresh prima del reminder %s fallito: %s", sched["id"], e)
+            if await _run_in_thread(postpone_schedule, db, sched, str(e), now):
+                return
+            # Tentativi finiti: si invia con le partecipazioni gia' salvate.
+        else:
+            await _run_in_thread(apply_refresh, db, email, ev["id"], delta)
+            ev = await _run_in_thread(_load_event, db, sched["event_id"])
+            if not ev:
+                await _run_in_thread(mark_schedule, db, sched["id"], "cancelled", {"error": "Cubo eliminato."})
+                return
+
+    activists = await _run_in_thread(_load_activists, db, email)
+    candidates, _ = reminder_candidates(ev, activists)
+    recipients = [
+        c for c in candidates
+        if c["status_cat"] == "no_response" or sched.get("include_maybe")
+    ]
+    if not recipients:
+        await _run_in_thread(mark_schedule, db, sched["id"], "skipped", {"n_recipients": 0, "error": None})
+        return
+    job_id = schedule_job_id(sched["id"])
+    items = reminder_job_items(sched.get("template", ""), recipients, ev)
+    try:
+        await _run_in_thread(enqueue_reminder_job, db, email, ev["id"], items, job_id)
+    except Conflict:
+        pass  # job gia' creato da un giro precedente interrotto prima di marcare la programmazione
+    await _run_in_thread(mark_schedule, db, sched["id"], "sent", {
+        "job_id": job_id, "n_recipients": len(items), "error": None,
+    })
+    logger.info("Reminder programmato %s (%s, %dh prima): job %s con %d destinatari",
+                sched["id"], email, sched.get("offset_h", 0), job_id, len(items))
+
+
+async def _dispatch_due_schedules(db) -> None:
+    now = datetime.now(timezone.utc)
+    try:
+        due = await _run_in_thread(due_schedules, db, now)
+    except Exception:
+        logger.exception("Lettura dei reminder programmati fallita")
+        return
+    to_send, superseded = split_due(due)
+    for sched in superseded:
+        await _run_in_thread(mark_schedule, db, sched["id"], "skipped", {"error": "Superato da un reminder successivo."})
+    for sched in to_send:
+        session_string = await _run_in_thread(load_organizer_session, db, sched.get("organizer_email", ""))
+        if not session_string:
+            await _run_in_thread(mark_schedule, db, sched["id"], "failed", {"error": "Telegram non collegato."})
+            continue
+        try:
+            await _dispatch_schedule(db, sched, session_string)
+        except Exception:
+            logger.exception("Reminder programmato %s fallito", sched["id"])
+
+
+async def reminders_forever(db, args) -> None:
+    owner = new_owner_id()
+    running = {}  # organizer -> task: un job alla volta per account
+    while True:
+        # Prima i reminder programmati: i job che creano partono nello stesso giro.
+        await _dispatch_due_schedules(db)
+        try:
+            jobs = await _run_in_thread(active_jobs, db)
+        except Exception:
+            logger.exception("Lettura dei job di invio fallita")
+            jobs = []
+        now = datetime.now(timezone.utc)
+        for job in sorted(jobs, key=lambda j: j.get("created_at") or now):
+            email = job.get("organizer_email", "")
+            task = running.get(email)
+            if (task is not None and not task.done()) or not is_claimable(job, now):
+                continue
+            session_string = await _run_in_thread(load_organizer_session, db, email)
+            if not session_string:
+                continue
+            logger.info("Job reminder %s (%s): da %d/%d", job["id"], email,
+                        job.get("cursor", 0), len(job.get("items", [])))
+            running[email] = asyncio.ensure_future(
+                run_reminder_job(db, job["id"], session_string, owner=owner)
+            )
+        await asyncio.sleep(args.poll_interval)
+
+
+def cmd_reminders(args) -> None:
+    db = init_firestore()
+    get_client_pool().run(reminders_forever(db, args))
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Processi in background di AV Assistant.")
+    parser.add_argument("-v", "--verbose", action="store_true", help="log di debug")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_track = sub.add_parser("track", help="aggiorna i cubi attivi dagli update Telegram")
+    p_track.add_argument("--reload-interval", type=float, default=60.0,
+                         help="secondi fra due letture dei cubi attivi (default 60)")
+    p_track.add_argument("--resync-interval", type=float, default=900.0,
+                         help="secondi fra due ricontrolli completi dei sondaggi (default 900)")
+    p_track.add_argument("--debounce", type=float, default=2.0,
+                         help="attesa dopo un update prima del refresh (default 2)")
+    p_track.set_defaults(func=cmd_track)
+
+    p_sched = sub.add_parser("scheduler", help="refresh periodico dei cubi attivi")
+    p_sched.add_argument("--tick", type=float, default=5.0,
+                         help="secondi fra due controlli delle scadenze (default 5)")
+    p_sched.add_argument("--reload-interval", type=float, default=120.0,
+                         help="secondi fra due letture dei cubi attivi (default 120)")
+    p_sched.add_argument("--budget-per-minute", type=float, default=20.0,
+                         help="richieste Telegram al minuto per account (default 20)")
+    p_sched.set_defaults(func=cmd_scheduler)
+
+    p_rem = sub.add_parser("reminders", help="esegue i job di invio e i reminder programmati")
+    p_rem.add_argument("--poll-interval", type=float, default=10.0,
+                       help="secondi fra due controlli di job e programmazioni (default 10)")
+    p_rem.set_defaults(func=cmd_reminders)
+    return parser
+
+
+def main(argv=None) -> None:
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+    )
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()